@@ -1,13 +1,44 @@
 import os
+import io
 import re
+import shutil
+from collections import OrderedDict, deque
+import hashlib
 import dropbox # type: ignore
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta, timezone
 import time
+import random
 import requests
 import sys
+import json
+import csv
+import ast
+import itertools
+import sqlite3
+import queue
+import atexit
+import argparse
+import platform
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import warnings
+import bisect
+import signal
+import cProfile
+import pstats
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
 import jpholiday  # type: ignore # ← 追加：日本の祝日判定
+try:
+    import pyarrow as pa  # 分足アーカイブと read_csv の pyarrow エンジン用（なければどちらも使わない）
+    import pyarrow.compute
+    import pyarrow.ipc
+except ImportError:
+    pa = None
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To, Bcc
 
@@ -35,82 +66,847 @@ sys.stderr.reconfigure(line_buffering=True)
 # ▼ アクセストークンを定期的にリフレッシュするための設定（3時間）
 REFRESH_INTERVAL = timedelta(hours=3)
 
-# ▼ グローバル変数の初期化（Dropbox接続状態・最終更新時刻）
-dbx = None
-last_refresh_time = None
-
-# ▼ Dropboxのアクセストークンをリフレッシュする関数
-def refresh_access_token():
-    client_id = os.environ.get('DROPBOX_CLIENT_ID')
-    client_secret = os.environ.get('DROPBOX_CLIENT_SECRET')
-    refresh_token = os.environ.get('DROPBOX_REFRESH_TOKEN')
-    if not all([client_id, client_secret, refresh_token]):
-        print("🚫 認証情報が不足しています。環境変数を確認してください。")
-        exit(1)
-    url = 'https://api.dropbox.com/oauth2/token'
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = {
-        'grant_type': 'refresh_token',
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'refresh_token': refresh_token
-    }
-    try:
-        response = requests.post(url, headers=headers, data=data)
+# ▼ アクセストークンの裏でのリフレッシュ（期限切れ前に済ませ、失敗したら間隔を空けて再試行する）
+TOKEN_URL = os.environ.get("DROPBOX_TOKEN_URL", "https://api.dropbox.com/oauth2/token")
+TOKEN_REFRESH_MARGIN = timedelta(minutes=15)  # 有効期限（expires_in）のこれだけ前にリフレッシュ
+TOKEN_RETRY_BASE = 2.0   # 再試行待ちの初期値（秒）。失敗のたびに2倍（最大 TOKEN_RETRY_MAX）＋ゆらぎ
+TOKEN_RETRY_MAX = 300.0
+TOKEN_WAIT_TIMEOUT = 30.0  # 使えるトークンがないとき、リフレッシュを待つ最大秒数
+TOKEN_PROBE = True  # True なら新しいトークンを users_get_current_account で確かめてから使い始める
+
+# ▼ CSVダウンロードの並列数とタイムアウト（秒）
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_TIMEOUT = 10
+
+# ▼ グローバル変数の初期化（Dropbox接続・共有HTTPセッション）
+dropbox_connection = None
+http_session = None
+download_executor = None
+
+
+class DropboxConnection:
+    """Dropbox のアクセストークンとクライアントを持ち、期限切れ前に裏のスレッドでリフレッシュする。
+
+    リフレッシュ（トークン取得と接続確認）はこのスレッドだけが行い、失敗しても終了せず
+    間隔を空けて再試行する。その間は有効期限内の古いトークンをそのまま使う。
+    トークン取得の HTTP 接続とクライアントの接続プールは使い回す。
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.cond = threading.Condition()
+        self.client = None
+        self.expires_at = None
+        self.refreshed_at = None
+        self.failures = 0
+        self.thread = threading.Thread(target=self.run, name="dropbox-token", daemon=True)
+        self.thread.start()
+
+    # ▼ トークンエンドポイントから新しいアクセストークンを取得（(トークン, 有効秒数) を返す）
+    def fetch_token(self):
+        client_id = os.environ.get('DROPBOX_CLIENT_ID')
+        client_secret = os.environ.get('DROPBOX_CLIENT_SECRET')
+        refresh_token = os.environ.get('DROPBOX_REFRESH_TOKEN')
+        if not all([client_id, client_secret, refresh_token]):
+            raise RuntimeError("認証情報が不足しています。環境変数を確認してください。")
+        data = {
+            'grant_type': 'refresh_token',
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'refresh_token': refresh_token
+        }
+        response = self.session.post(TOKEN_URL, data=data, timeout=DOWNLOAD_TIMEOUT)
         response.raise_for_status()
-        access_token = response.json().get('access_token')
-        print('✅ アクセストークンをリフレッシュしました。')
-        return access_token
-    except requests.exceptions.RequestException as e:
-        print(f'🚫 アクセストークンのリフレッシュに失敗しました: {e}')
-        exit(1)
-
-# ▼ Dropboxクライアントの初期化＆リフレッシュ管理
+        body = response.json()
+        return body["access_token"], body.get("expires_in")
+
+    # ▼ 新しいトークンでクライアントを作り（接続プールは共有）、確認できたら差し替える
+    def refresh(self):
+        global http_session
+        access_token, expires_in = self.fetch_token()
+        if http_session is None:
+            # ▼ 接続プールを持つHTTPセッションを使い回す（並列ダウンロードでも再接続しない）
+            http_session = dropbox.create_session(max_connections=DOWNLOAD_CONCURRENCY)
+        # ✅ 期限切れで見捨てた取得もスレッドを握り続けないよう、1リクエストのタイムアウトは DOWNLOAD_DEADLINE 以下にする
+        client = dropbox.Dropbox(access_token, session=http_session, timeout=min(DOWNLOAD_TIMEOUT, DOWNLOAD_DEADLINE))
+        if TOKEN_PROBE:
+            client.users_get_current_account()
+        now = datetime.now(timezone.utc)
+        with self.cond:
+            self.client = client
+            self.refreshed_at = now
+            self.expires_at = now + timedelta(seconds=expires_in) if expires_in else None
+            self.failures = 0
+            self.cond.notify_all()
+
+    # ▼ 次にリフレッシュする時刻（REFRESH_INTERVAL ごと。有効期限が近ければその TOKEN_REFRESH_MARGIN 前）
+    def next_refresh_at(self):
+        due = self.refreshed_at + REFRESH_INTERVAL
+        if self.expires_at is not None:
+            due = min(due, self.expires_at - TOKEN_REFRESH_MARGIN)
+        return due
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+                metrics.count("token_refreshes")
+                print('✅ アクセストークンをリフレッシュし、Dropboxに接続しました。')
+                delay = (self.next_refresh_at() - datetime.now(timezone.utc)).total_seconds()
+            except Exception as e:
+                with self.cond:
+                    self.failures += 1
+                    failures = self.failures
+                metrics.count("token_refresh_failures")
+                delay = min(TOKEN_RETRY_MAX, TOKEN_RETRY_BASE * 2 ** (failures - 1)) * random.uniform(0.5, 1.0)
+                print(f'🚫 アクセストークンのリフレッシュに失敗しました（{failures}回目、{delay:.0f}秒後に再試行）: {e}')
+            time.sleep(max(delay, 0.0))
+
+    # ▼ 有効なトークンのクライアント（なければ裏のリフレッシュを最大 timeout 秒待ち、それでもなければ例外）
+    def get(self, timeout=TOKEN_WAIT_TIMEOUT):
+        with self.cond:
+            self.cond.wait_for(self.usable, timeout=timeout)
+            if not self.usable():
+                raise RuntimeError(f"Dropboxのアクセストークンを取得できていません（再試行 {self.failures}回）")
+            return self.client
+
+    def usable(self):
+        if self.client is None:
+            return False
+        return self.expires_at is None or datetime.now(timezone.utc) < self.expires_at
+
+
+# ▼ Dropboxクライアントを返す（トークンの取得・リフレッシュは DropboxConnection のスレッドが行う）
 def get_dropbox_client():
-    global dbx, last_refresh_time
-    now = datetime.utcnow()
-    time_since_refresh = (now - last_refresh_time) if last_refresh_time else None
-    if dbx is None or last_refresh_time is None or time_since_refresh > REFRESH_INTERVAL:
-        print(f"🔁 Dropboxクライアントを初期化します（前回更新から: {time_since_refresh}）")
-        access_token = refresh_access_token()
+    global dropbox_connection
+    if dropbox_connection is None:
+        print("🔁 Dropboxクライアントを初期化します")
+        dropbox_connection = DropboxConnection()
+    return dropbox_connection.get()
+
+
+# ▼ ----- 計測（段階ごとの所要時間・件数）と Prometheus / JSON 出力 -----
+
+METRICS_PROMETHEUS_PATH = ""  
+# ✅ Prometheus テキスト形式の出力先（サイクルごとに上書き。空欄なら出力しない）。例: "metrics.prom"
+
+METRICS_JSON_INTERVAL = 60  
+# ✅ 集計を JSON 1行でログに出す間隔（秒。0 なら出さない）
+
+METRICS_PREFIX = "kabuteku"  
+# ✅ Prometheus のメトリクス名の接頭辞
+
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# ✅ 所要時間ヒストグラムの区切り（秒）
+
+METRICS_QUANTILE_SAMPLES = 1000  
+# ✅ 分位点（p50 / p99）を求めるために段階ごとに残す直近の所要時間の件数
+
+PROFILE_TRIGGER_FILE = "profile_next_cycle"  
+# ✅ このファイルを置く（または SIGUSR1 を送る）と、次の1サイクルを cProfile で計測する
+
+PROFILE_OUTPUT_DIR = "profiles"  
+# ✅ cProfile の結果（.prof）の保存先
+
+
+class PipelineMetrics:
+    """段階ごとの所要時間ヒストグラムとカウンター。ダウンロードスレッドからも更新されるためロックで守る。"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.samples = {}
+        self.counters = {}
+        self.last_summary = time.monotonic()
+
+    # ▼ with metrics.time("listing"): のように囲んだ区間の所要時間を記録
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
         try:
-            dbx = dropbox.Dropbox(access_token)
-            dbx.users_get_current_account()
-            last_refresh_time = now
-            print('✅ Dropboxに接続しました。')
-        except Exception as e:
-            print(f'🚫 Dropbox接続に失敗しました: {e}')
-            exit(1)
-    return dbx
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0, "max": 0.0}
+            hist["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+            hist["max"] = max(hist["max"], seconds)
+            self.samples.setdefault(stage, deque(maxlen=METRICS_QUANTILE_SAMPLES)).append(seconds)
+
+    # ▼ 直近 METRICS_QUANTILE_SAMPLES 件の所要時間の分位点（記録がなければ None）
+    def quantile(self, stage, q):
+        with self.lock:
+            samples = list(self.samples.get(stage, ()))
+        return float(np.quantile(samples, q)) if samples else None
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # ▼ 検出関数ごとの当たり率（シグナル数 / 判定した銘柄数）
+    def hit_rates(self):
+        # ✅ ダウンロードスレッドがカウンターを増やしている最中でも読めるよう、ロックの中で写してから数える
+        with self.lock:
+            counters = list(self.counters.items())
+        evaluated, hits = {}, {}
+        for (name, labels), value in counters:
+            detector = dict(labels).get("detector")
+            if name == "detector_symbols_evaluated":
+                evaluated[detector] = evaluated.get(detector, 0) + value
+            elif name == "detector_hits":
+                hits[detector] = hits.get(detector, 0) + value
+        return {detector: hits.get(detector, 0) / n for detector, n in evaluated.items() if n}
+
+    def to_prometheus(self):
+        def fmt_labels(labels):
+            if not labels:
+                return ""
+            escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+            return "{" + ",".join(escaped) + "}"
+
+        name = f"{METRICS_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} 段階ごとの所要時間", f"# TYPE {name} histogram"]
+        with self.lock:
+            for stage, hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ["+Inf"], hist["buckets"]):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {hist["sum"]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {hist["count"]}')
+
+            quantiles = {stage: list(samples) for stage, samples in sorted(self.samples.items()) if samples}
+
+            counters = sorted(self.counters.items())
+            for counter in sorted({key[0] for key, _ in counters}):
+                lines.append(f"# TYPE {METRICS_PREFIX}_{counter}_total counter")
+                for (key, labels), value in counters:
+                    if key == counter:
+                        lines.append(f"{METRICS_PREFIX}_{counter}_total{fmt_labels(labels)} {value}")
+
+        name = f"{METRICS_PREFIX}_stage_seconds_quantile"
+        lines += [f"# HELP {name} 段階ごとの所要時間の分位点（直近 {METRICS_QUANTILE_SAMPLES} 件）", f"# TYPE {name} gauge"]
+        for stage, samples in quantiles.items():
+            for q in (0.5, 0.99):
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {np.quantile(samples, q):.6f}')
+
+        lines.append(f"# TYPE {METRICS_PREFIX}_csv_cache_total counter")
+        for result, value in csv_cache_stats.items():
+            lines.append(f'{METRICS_PREFIX}_csv_cache_total{{result="{result}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": h["count"], "avg": round(h["sum"] / h["count"], 6), "max": round(h["max"], 6),
+                    "p50": round(float(np.quantile(self.samples[stage], 0.5)), 6),
+                    "p99": round(float(np.quantile(self.samples[stage], 0.99)), 6),
+                }
+                for stage, h in self.histograms.items() if h["count"]
+            }
+            counters = {
+                name + "".join(f"|{k}={v}" for k, v in labels): value for (name, labels), value in self.counters.items()
+            }
+        return {
+            "metrics": "summary",
+            "time": get_japan_time().isoformat(timespec="seconds"),
+            "stages": stages,
+            "counters": counters,
+            "hit_rates": {k: round(v, 6) for k, v in self.hit_rates().items()},
+            "csv_cache": dict(csv_cache_stats),
+            "download_failures": list(download_failures)[-10:],
+        }
+
+    # ▼ サイクルの終わりに呼ぶ（Prometheus ファイルを上書きし、間隔が来ていれば JSON 1行を出力）
+    def export(self):
+        if METRICS_PROMETHEUS_PATH:
+            tmp_path = f"{METRICS_PROMETHEUS_PATH}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, METRICS_PROMETHEUS_PATH)
+        if METRICS_JSON_INTERVAL and time.monotonic() - self.last_summary >= METRICS_JSON_INTERVAL:
+            print(json.dumps(self.summary(), ensure_ascii=False))
+            self.last_summary = time.monotonic()
+
+
+metrics = PipelineMetrics()
+profile_requested = False
+
+
+# ▼ SIGUSR1 を受けたら次のサイクルをプロファイルする
+def request_cycle_profile(signum=None, frame=None):
+    global profile_requested
+    profile_requested = True
+
+
+# ▼ プロファイル要求（SIGUSR1 / PROFILE_TRIGGER_FILE）があれば cProfile を開始して返す
+def start_cycle_profile():
+    global profile_requested
+    triggered = bool(PROFILE_TRIGGER_FILE) and os.path.exists(PROFILE_TRIGGER_FILE)
+    if not (profile_requested or triggered):
+        return None
+    profile_requested = False
+    if triggered:
+        os.remove(PROFILE_TRIGGER_FILE)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+# ▼ プロファイルを止めて .prof に保存し、累積時間の上位をログに出す
+def finish_cycle_profile(profiler):
+    if profiler is None:
+        return
+    profiler.disable()
+    os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_OUTPUT_DIR, f"cycle_{get_japan_time().strftime('%Y%m%d_%H%M%S')}.prof")
+    profiler.dump_stats(path)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(20)
+    print(report.getvalue())
+    print(f"🧭 1サイクルのプロファイルを保存しました → {path}")
+
+
+# ▼ ----- フォルダ一覧の差分取得（カーソル）/ ロングポーリング設定 -----
+
+DROPBOX_FOLDER = "/デイトレファイル"
+
+FILE_PREFIX = "kabuteku"  
+# ✅ 分足CSVのファイル名の接頭辞（{FILE_PREFIX}{YYYYMMDD}_{HHMM}.csv）
+
+USE_INCREMENTAL_LISTING = True  
+# ✅ True ならカーソルを保持して差分だけ取得（False なら毎回フォルダ全体を一覧）
+
+USE_LONGPOLL_WAIT = True  
+# ✅ True なら新しいファイルが届くまでロングポーリングで待機（False なら1秒スリープ）
+
+LONGPOLL_TIMEOUT = 30  
+# ✅ ロングポーリングの最大待機秒数（Dropbox API の制約で 30〜480）
+
+# ▼ フォルダ一覧をカーソルで同期（初回のみ全件、以降は差分のみ）
+#    state は差分取得の状態（folder・cursor・file_index＝ファイル名 → (rev, content_hash)）を持つ DropboxSource
+def sync_folder_listing(dbx, state):
+    if state.cursor is None:
+        state.file_index.clear()
+        res = dbx.files_list_folder(state.folder)
+    else:
+        try:
+            res = dbx.files_list_folder_continue(state.cursor)
+        except dropbox.exceptions.ApiError as e:
+            # カーソルが失効した場合は全件取得からやり直す
+            if isinstance(e.error, dropbox.files.ListFolderContinueError) and e.error.is_reset():
+                print("🔁 フォルダカーソルが失効したため、一覧を再取得します。")
+                state.cursor = None
+                return sync_folder_listing(dbx, state)
+            raise
+
+    while True:
+        for entry in res.entries:
+            if isinstance(entry, dropbox.files.FileMetadata):
+                state.file_index[entry.name] = (entry.rev, entry.content_hash)
+            elif isinstance(entry, dropbox.files.DeletedMetadata):
+                state.file_index.pop(entry.name, None)
+        if not res.has_more:
+            break
+        res = dbx.files_list_folder_continue(res.cursor)
+
+    state.cursor = res.cursor
+    return state.file_index
+
+
+# ▼ フォルダ全体を毎回一覧する（従来方式）
+def list_folder_full(dbx, folder):
+    index = {}
+    res = dbx.files_list_folder(folder)
+    while True:
+        for entry in res.entries:
+            if isinstance(entry, dropbox.files.FileMetadata):
+                index[entry.name] = (entry.rev, entry.content_hash)
+        if not res.has_more:
+            break
+        res = dbx.files_list_folder_continue(res.cursor)
+    return index
+
+
+# ▼ 新しいファイルが届くまで待機（ロングポーリング、使えない場合は1秒スリープ）
+def wait_for_folder_change(cursor):
+    if not (USE_INCREMENTAL_LISTING and USE_LONGPOLL_WAIT and cursor):
+        print("⏲️ 1秒待機中...")
+        time.sleep(1)
+        return
+
+    print(f"⏲️ 新しいファイルを待機中（最大{LONGPOLL_TIMEOUT}秒）...")
+    try:
+        longpoll_folder(cursor)
+    except Exception as e:
+        print(f"⚠️ ロングポーリングに失敗しました: {e}")
+        time.sleep(1)
+
+
+# ▼ cursor 以降にフォルダが変わるまで待つ（Dropbox から待機の指示があれば待ってから戻る）
+def longpoll_folder(cursor):
+    result = get_dropbox_client().files_list_folder_longpoll(cursor, timeout=LONGPOLL_TIMEOUT)
+    if result.changes:
+        print("📬 フォルダの更新を検知しました。")
+    if result.backoff:
+        time.sleep(result.backoff)
+    return result.changes
+
+
+# ▼ ----- 分足CSVの取得元（Dropbox / ローカルフォルダ / メモリ） -----
+
+DATA_SOURCE = "dropbox"  
+# ✅ 分足CSVの取得元："dropbox" / "local"＝LOCAL_SOURCE_DIR のフォルダ / "memory"＝メモリ上のファイル（テスト用）
+
+LOCAL_SOURCE_DIR = "."  
+# ✅ DATA_SOURCE="local" のときに読むフォルダ
+
+LOCAL_SOURCE_MMAP = True  
+# ✅ True ならローカルのCSVをメモリマップで pandas に渡す（読み込み時にバッファへコピーしない）
+
+LOCAL_SOURCE_LATENCY = 0.0  
+LOCAL_SOURCE_JITTER = 0.0  
+# ✅ ローカルの一覧・読み込みに足す疑似的な通信遅延（秒）と、そこへ一様に加えるばらつきの最大値（秒）
+
+class CsvSource:
+    """分足CSVの取得元。list_files() で {ファイル名: rev}、read() で中身の bytes を返す。
+
+    rev が変わらない限り同じ中身とみなしてキャッシュを使い回す。cacheable が True の取得元だけ
+    ダウンロードしたCSVをディスクキャッシュへ保存する。
+    """
+
+    name = "base"
+    cacheable = False
+
+    def list_files(self):
+        raise NotImplementedError
+
+    def read(self, fname):
+        raise NotImplementedError
+
+    def read_frame(self, fname):
+        return read_minute_csv(self.read(fname))
+
+    # ▼ 新しいファイルが届くまで待機（既定は1秒スリープ）
+    def wait_for_change(self):
+        print("⏲️ 1秒待機中...")
+        time.sleep(1)
+
+    # ▼ wait_for_change() が変更を検知して戻るか（False なら CycleScheduler が到着予測で待つ）
+    def supports_push(self):
+        return False
+
+
+class DropboxSource(CsvSource):
+    """Dropbox のフォルダ（既定は DROPBOX_FOLDER）を読む取得元（差分一覧・ロングポーリング・ディスクキャッシュ付き）。
+
+    差分一覧のカーソルとファイルの索引は取得元ごとに持つ（フォルダごとに別の取得元を作る）。
+    """
+
+    name = "dropbox"
+    cacheable = True
+
+    def __init__(self, folder=None):
+        self.dbx = None
+        self.folder = folder or DROPBOX_FOLDER
+        self.cursor = None
+        self.file_index = {}
+
+    def list_files(self):
+        # ✅ 一覧時にクライアントを確定し、同じサイクルのダウンロードスレッドはそれを使う
+        self.dbx = get_dropbox_client()
+        return sync_folder_listing(self.dbx, self) if USE_INCREMENTAL_LISTING else list_folder_full(self.dbx, self.folder)
+
+    def read(self, fname):
+        metadata, res = (self.dbx or get_dropbox_client()).files_download(f"{self.folder}/{fname}")
+        metrics.count("bytes_downloaded", len(res.content), source=self.name)
+        return res.content
+
+    def wait_for_change(self):
+        wait_for_folder_change(self.cursor)
+
+    def supports_push(self):
+        return bool(USE_INCREMENTAL_LISTING and USE_LONGPOLL_WAIT and self.cursor)
+
+
+class LocalSource(CsvSource):
+    """ローカルフォルダの CSV を読む取得元。latency / jitter を指定すると、一覧・読み込みのたびに待ちを入れて通信を模擬する。"""
+
+    name = "local"
+
+    def __init__(self, directory, use_mmap=True, latency=0.0, jitter=0.0, seed=None):
+        self.directory = directory
+        self.use_mmap = use_mmap
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def list_files(self):
+        self._delay()
+        index = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".csv"):
+                    stat = entry.stat()
+                    index[entry.name] = (str(stat.st_mtime_ns), str(stat.st_size))
+        return index
+
+    def read(self, fname):
+        self._delay()
+        with open(os.path.join(self.directory, fname), "rb") as f:
+            content = f.read()
+        metrics.count("bytes_downloaded", len(content), source=self.name)
+        return content
+
+    def read_frame(self, fname):
+        self._delay()
+        path = os.path.join(self.directory, fname)
+        metrics.count("bytes_downloaded", os.path.getsize(path), source=self.name)
+        return read_minute_csv(path, memory_map=self.use_mmap)
+
+
+class MemorySource(CsvSource):
+    """メモリ上の {ファイル名: bytes} を読む取得元（テスト・ベンチマーク用）。put() するたびに rev が進む。"""
+
+    name = "memory"
+
+    def __init__(self, files=None):
+        self.files = {}
+        self.versions = {}
+        for fname, content in (files or {}).items():
+            self.put(fname, content)
+
+    def put(self, fname, content):
+        self.files[fname] = content
+        self.versions[fname] = self.versions.get(fname, 0) + 1
+
+    def remove(self, fname):
+        self.files.pop(fname, None)
+        self.versions.pop(fname, None)
+
+    def list_files(self):
+        return {fname: (str(version), "") for fname, version in self.versions.items()}
+
+    def read(self, fname):
+        metrics.count("bytes_downloaded", len(self.files[fname]), source=self.name)
+        return self.files[fname]
+
+    def wait_for_change(self):
+        pass
+
+
+# ▼ 種類（DATA_SOURCE と同じ値）に応じた取得元を作る
+def make_data_source(kind, folder=None, directory=None, archive_dir=None, prefix=None):
+    if kind == "dropbox":
+        return DropboxSource(folder)
+    if kind == "local":
+        return LocalSource(
+            directory or LOCAL_SOURCE_DIR, use_mmap=LOCAL_SOURCE_MMAP, latency=LOCAL_SOURCE_LATENCY, jitter=LOCAL_SOURCE_JITTER
+        )
+    if kind == "memory":
+        return MemorySource()
+    if kind == "archive":
+        return ArchiveSource(archive_dir, prefix=prefix)
+    raise ValueError(f"未対応の DATA_SOURCE です: {kind}")
+
+
+# ▼ 既定のフィード（DATA_SOURCE の設定）の取得元（初回利用時に作成し、以降は使い回す）
+def get_data_source():
+    return get_default_feed().get_source()
+
+
+# ▼ ----- 日付ごとの分足アーカイブ（Arrow IPC。メモリマップでコピーせずに読む） -----
+
+ARCHIVE_DIR = "minute_archive"  
+# ✅ 取り込んだ分足を保存するフォルダ（空欄なら保存しない）。date=YYYYMMDD/ の下に日付ごとに置く
+
+ARCHIVE_DAY_FILE = "day.arrow"  
+# ✅ 1日分をまとめたファイル名。まとめる前の分足は date=YYYYMMDD/HHMM.arrow
+
+ARCHIVE_RETENTION_DAYS = 0  
+# ✅ アーカイブに残す日数（新しい日付から。0 なら消さない）。起動時と日付が変わったときに古い日付から消す
+
+ARCHIVE_FIELDS = [("現在値", "float32"), ("高値", "float32"), ("安値", "float32"), ("出来高", "int64")]
+# ✅ 保存する数値列と型（銘柄コード・銘柄名称は辞書型、時刻は "HHMM"）
+
+# ▼ (フォルダ, 日付) → {hhmm: rev の JSON}（保存済みの分足。同じ rev なら書き直さない）
+archive_revs = {}
+archive_lock = threading.Lock()
+
+
+# ▼ pyarrow がなければアーカイブは読み書きできないので、分かるように止める
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("分足アーカイブには pyarrow が必要です（pip install pyarrow）")
+
+
+def archive_schema():
+    require_pyarrow()
+    return pa.schema(
+        [("時刻", pa.string()), ("銘柄コード", pa.dictionary(pa.int32(), pa.string())), ("銘柄名称", pa.dictionary(pa.int32(), pa.string()))]
+        + [(field, pa.type_for_alias(dtype)) for field, dtype in ARCHIVE_FIELDS]
+    )
+
+
+def archive_partition(date, directory=None):
+    return os.path.join(directory or ARCHIVE_DIR, f"date={date}")
+
+
+# ▼ IPC ファイルをメモリマップで開く（圧縮しないので列のバッファはファイルを直接指す）
+def read_ipc_file(path):
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def write_ipc_file(path, table):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+# ▼ 1分ぶんの DataFrame → アーカイブの形の Table
+def minute_table(hhmm, df):
+    columns = {"時刻": pa.array([hhmm] * len(df), type=pa.string())}
+    for column in ("銘柄コード", "銘柄名称"):
+        values = df[column].astype(object) if column in df.columns else pd.Series([None] * len(df), dtype=object)
+        columns[column] = pa.array(values, type=pa.string(), from_pandas=True).dictionary_encode()
+    for field, dtype in ARCHIVE_FIELDS:
+        values = df[field] if field in df.columns else pd.Series(np.nan, index=df.index)
+        columns[field] = pa.array(values, from_pandas=True).cast(pa.type_for_alias(dtype))
+    return pa.table(columns, schema=archive_schema())
+
+
+# ▼ 分足ファイルのパス一覧 {hhmm: path}（まとめる前のもの）
+def archive_minute_paths(date, directory=None):
+    partition = archive_partition(date, directory)
+    if not os.path.isdir(partition):
+        return {}
+    return {
+        name[:4]: os.path.join(partition, name)
+        for name in os.listdir(partition)
+        if re.fullmatch(r"\d{4}\.arrow", name)
+    }
+
+
+# ▼ 1日分の Table と {hhmm: (開始行, 行数)}（まとめたファイル＋その後に届いた分足。同じ時刻は分足の方を使う）
+def load_archive_day(date, directory=None):
+    require_pyarrow()
+    day_path = os.path.join(archive_partition(date, directory), ARCHIVE_DAY_FILE)
+    pieces = {}
+    revs = {}
+    if os.path.exists(day_path):
+        table = read_ipc_file(day_path)
+        metadata = json.loads((table.schema.metadata or {}).get(b"minutes", b"{}"))
+        for hhmm, (offset, length, rev) in metadata.items():
+            pieces[hhmm] = table.slice(offset, length)
+            revs[hhmm] = rev
+    for hhmm, path in archive_minute_paths(date, directory).items():
+        table = read_ipc_file(path)
+        pieces[hhmm] = table
+        revs[hhmm] = (table.schema.metadata or {}).get(b"rev", b"null").decode()
+
+    offsets = {}
+    tables = []
+    row = 0
+    for hhmm in sorted(pieces):
+        tables.append(pieces[hhmm].replace_schema_metadata(None))
+        offsets[hhmm] = (row, pieces[hhmm].num_rows, revs[hhmm])
+        row += pieces[hhmm].num_rows
+    table = pa.concat_tables(tables) if tables else archive_schema().empty_table()
+    return table, offsets
+
+
+# ▼ 保存済みの {hhmm: rev}（フォルダ・日付ごとに初回だけファイルから読む）
+def archived_revs(date, directory=None):
+    key = (directory or ARCHIVE_DIR, date)
+    if key not in archive_revs:
+        _, offsets = load_archive_day(date, directory)
+        archive_revs[key] = {hhmm: rev for hhmm, (_, _, rev) in offsets.items()}
+    return archive_revs[key]
+
+
+# ▼ 取り込んだ1分ぶんを date=YYYYMMDD/HHMM.arrow に保存（同じ rev で保存済みなら何もしない）
+def archive_minute(date, hhmm, rev, df, directory=None):
+    if not (directory or ARCHIVE_DIR) or pa is None:
+        return False
+    rev_json = json.dumps(rev)
+    with archive_lock:
+        revs = archived_revs(date, directory)
+        if revs.get(hhmm) == rev_json:
+            return False
+        partition = archive_partition(date, directory)
+        os.makedirs(partition, exist_ok=True)
+        table = minute_table(hhmm, df).replace_schema_metadata({"rev": rev_json})
+        write_ipc_file(os.path.join(partition, f"{hhmm}.arrow"), table)
+        revs[hhmm] = rev_json
+    metrics.count("archived_minutes")
+    return True
+
+
+# ▼ 1日分の分足ファイルを day.arrow にまとめる（時刻順。分足ファイルは削除）
+def compact_archive_day(date, directory=None):
+    minute_paths = archive_minute_paths(date, directory)
+    if not minute_paths:
+        return False
+    table, offsets = load_archive_day(date, directory)
+    # ✅ 辞書は分足ごとに別なので、1つにそろえてから保存する（読むときに毎回そろえずに済む）
+    table = table.unify_dictionaries().combine_chunks()
+    metadata = {hhmm: [offset, length, rev] for hhmm, (offset, length, rev) in offsets.items()}
+    write_ipc_file(
+        os.path.join(archive_partition(date, directory), ARCHIVE_DAY_FILE),
+        table.replace_schema_metadata({"minutes": json.dumps(metadata)}),
+    )
+    for path in minute_paths.values():
+        os.remove(path)
+    print(f"🗄️ アーカイブ {date}: 分足 {len(minute_paths)}件をまとめました（計 {len(offsets)}分 / {table.num_rows}行）")
+    return True
 
 
-# ▼ 🔹修正済：CSVファイル一覧（hhmm順）を取得し、最新90件だけに絞る
-def list_today_csv_files(target_date=None, limit=90, current_hhmm=None):
-    dbx = get_dropbox_client()
+# ▼ アーカイブにある日付（昇順）
+def archive_dates(directory=None):
+    directory = directory or ARCHIVE_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[5:] for name in os.listdir(directory) if re.fullmatch(r"date=\d{8}", name))
+
+
+# ▼ アーカイブの整理: today より前でまとめていない分足を day.arrow にまとめ、ARCHIVE_RETENTION_DAYS より古い日付を消す
+#    （起動時と日付が変わったときに呼ぶ。前日のうちに止まっていても分足ファイルが残り続けない）
+def maintain_archive(today, directory=None):
+    directory = directory or ARCHIVE_DIR
+    if not directory or pa is None:
+        return
+    dates = [date for date in archive_dates(directory) if date < today]
+    expired = dates[:-ARCHIVE_RETENTION_DAYS] if ARCHIVE_RETENTION_DAYS > 0 else []
+    for date in expired:
+        shutil.rmtree(archive_partition(date, directory))
+        with archive_lock:
+            archive_revs.pop((directory, date), None)
+    if expired:
+        print(f"🗄️ アーカイブ: {expired[0]}〜{expired[-1]} の {len(expired)}日分を削除しました（保持 {ARCHIVE_RETENTION_DAYS}日）")
+    for date in dates[len(expired):]:
+        compact_archive_day(date, directory)
+
+
+# ▼ 期間 [start_date, end_date] × 時刻 [start_hhmm, end_hhmm] の分足を Table で返す
+#    日付・時刻で絞るだけならメモリマップしたファイルの切り出しなので、データはコピーしない
+def read_archive(start_date, end_date=None, start_hhmm=None, end_hhmm=None, codes=None, directory=None):
+    require_pyarrow()
+    end_date = end_date or start_date
+    tables = []
+    for date in archive_dates(directory):
+        if not start_date <= date <= end_date:
+            continue
+        table, offsets = load_archive_day(date, directory)
+        minutes = [
+            offsets[hhmm] for hhmm in sorted(offsets)
+            if (start_hhmm is None or hhmm >= start_hhmm) and (end_hhmm is None or hhmm <= end_hhmm)
+        ]
+        if not minutes:
+            continue
+        # ✅ 時刻順に並んでいるので、範囲は先頭と末尾の行番号で切り出せる
+        day = table.slice(minutes[0][0], minutes[-1][0] + minutes[-1][1] - minutes[0][0])
+        tables.append(day.add_column(0, "日付", pa.DictionaryArray.from_arrays(
+            pa.array(np.zeros(day.num_rows, dtype=np.int8)), pa.array([date])
+        )))
+    table = pa.concat_tables(tables) if tables else archive_schema().empty_table()
+    if codes is not None:
+        table = table.filter(pa.compute.is_in(table["銘柄コード"].cast(pa.string()), value_set=pa.array(list(codes), type=pa.string())))
+    return table
+
+
+# ▼ 銘柄 × 時刻の表（行＝銘柄コード、列＝日付・時刻）。field の値を並べる
+def archive_matrix(start_date, end_date=None, field="現在値", start_hhmm=None, end_hhmm=None, codes=None, directory=None):
+    table = read_archive(start_date, end_date, start_hhmm, end_hhmm, codes=codes, directory=directory)
+    df = table.select(["日付", "時刻", "銘柄コード", field]).to_pandas()
+    return df.pivot_table(index="銘柄コード", columns=["日付", "時刻"], values=field, aggfunc="last", observed=True)
+
+
+class ArchiveSource(CsvSource):
+    """分足アーカイブを読む取得元（リプレイ・バックテスト用）。ファイル名は {prefix}{date}_{hhmm}.csv として見せる。"""
+
+    name = "archive"
+
+    def __init__(self, directory=None, prefix=None):
+        require_pyarrow()
+        self.directory = directory or ARCHIVE_DIR
+        self.prefix = prefix or FILE_PREFIX
+        self.days = {}
+
+    def _day(self, date):
+        if date not in self.days:
+            self.days = {date: load_archive_day(date, self.directory)}  # ✅ 読むのは1日ずつなので直近の1日だけ保持
+        return self.days[date]
+
+    # ▼ 1日分の (hhmm, fname, rev)（時刻順）
+    def day_files(self, date):
+        files = []
+        for hhmm, (_, _, rev) in sorted(self._day(date)[1].items()):
+            rev = json.loads(rev)
+            files.append((hhmm, f"{self.prefix}{date}_{hhmm}.csv", tuple(rev) if isinstance(rev, list) else rev))
+        return files
+
+    def list_files(self):
+        return {fname: rev for date in archive_dates(self.directory) for _, fname, rev in self.day_files(date)}
+
+    def read_frame(self, fname):
+        date, hhmm = parse_minute_filename(fname, self.prefix)
+        table, offsets = self._day(date)
+        offset, length, _ = offsets[hhmm]
+        df = table.slice(offset, length).drop_columns(["時刻"]).to_pandas()
+        for column in ("銘柄コード", "銘柄名称"):
+            df[column] = df[column].astype(str).where(df[column].notna())
+        metrics.count("bytes_downloaded", table.slice(offset, length).nbytes, source=self.name)
+        return share_symbol_categories(df)
+
+
+# ▼ 🔹修正済：CSVファイル一覧（hhmm順）を取得し、最新90件だけに絞る（feed を省略すると既定のフィード）
+def list_today_csv_files(target_date=None, limit=90, current_hhmm=None, feed=None):
+    feed = feed or get_default_feed()
     today = target_date if target_date else get_japan_time().strftime("%Y%m%d")
     current_hhmm = current_hhmm if current_hhmm else get_japan_time().strftime("%H%M")
     files = []
+    prefix = f"{feed.prefix}{today}_"
 
     try:
-        all_entries = []
-        res = dbx.files_list_folder("/デイトレファイル")
-        all_entries.extend(res.entries)
-        while res.has_more:
-            res = dbx.files_list_folder_continue(res.cursor)
-            all_entries.extend(res.entries)
-
-        for entry in all_entries:
-            if isinstance(entry, dropbox.files.FileMetadata):
-                fname = entry.name
-                match = re.match(rf"kabuteku{today}_(\d{{4}})\.csv", fname)
-                if match:
-                    hhmm = match.group(1)
-                    files.append((hhmm, fname))
+        index = feed.get_source().list_files()
+
+        for fname, rev in index.items():
+            if not fname.startswith(prefix):
+                continue
+            parsed = parse_minute_filename(fname, feed.prefix)
+            if parsed:
+                files.append((parsed[1], fname, rev))
 
     except Exception as e:
-        print(f"🚫 Dropboxファイル一覧取得エラー: {e}")
+        print(f"🚫 ファイル一覧取得エラー（{feed.get_source().name}）: {e}")
         return []
 
+    return select_recent_files(files, current_hhmm, limit)
+
+
+# ▼ 分足CSVのファイル名 → (日付, hhmm)（接頭辞・形式が違えば None）
+def parse_minute_filename(fname, prefix=None):
+    match = re.fullmatch(rf"{re.escape(prefix if prefix is not None else FILE_PREFIX)}(\d{{8}})_(\d{{4}})\.csv", fname)
+    return (match.group(1), match.group(2)) if match else None
+
+
+# ▼ (hhmm, fname, rev) の一覧から、current_hhmm までの直近 limit 件を hhmm 順で返す
+def select_recent_files(files, current_hhmm, limit=90):
     files_sorted = sorted(files, key=lambda x: x[0])
 
     # 現在hhmmのインデックスを探して、そこまでの過去limit件を取得
@@ -132,33 +928,752 @@ def list_today_csv_files(target_date=None, limit=90, current_hhmm=None):
 
 
 
-def build_intraday_dataframe(target_date=None):
-    now = get_japan_time()
-    current_hhmm = now.strftime("%H%M")
-    dbx = get_dropbox_client()
-    files = list_today_csv_files(target_date=target_date, limit=90, current_hhmm=current_hhmm)
-    combined_df = []
+# ▼ ----- 分足CSVの読み込み（必要な列だけ・型を指定して読む） -----
+
+CSV_ENGINE = "pyarrow"  
+# ✅ read_csv のエンジン。"pyarrow" は pyarrow が入っていなければ "c" で読む
+
+CSV_PRICE_DTYPE = "float32"  
+# ✅ 価格列（現在値・高値・安値）の型。BarStore へは float64 に戻して書き込む
+
+CSV_PRICE_DECIMALS = 1  
+# ✅ float32 の価格を float64 に戻すときに丸める小数桁（呼値の最小単位は 0.1 円）
+
+CSV_COLUMN_DTYPES = {
+    "銘柄コード": str,
+    "銘柄名称": str,
+    "現在値": CSV_PRICE_DTYPE,
+    "高値": CSV_PRICE_DTYPE,
+    "安値": CSV_PRICE_DTYPE,
+    "出来高": "int64",
+}
+# ✅ 読み込む列（正規化後の列名）と型。これ以外の列は読まない
+
+# ▼ ヘッダー行 → (読む列, 型, 正規化後の列名) のキャッシュと、全ファイルで共有する銘柄コード・銘柄名称の辞書
+csv_header_layouts = {}
+csv_symbol_categories = {"銘柄コード": None, "銘柄名称": None}
+csv_categories_lock = threading.Lock()
+
+
+# ▼ 列名の正規化（前後空白・全角/半角スペースを除去）
+def normalize_column_name(name):
+    return name.strip().replace("　", "").replace(" ", "")
+
+
+def csv_engine():
+    if CSV_ENGINE == "pyarrow" and pa is None:
+        return "c"
+    return CSV_ENGINE
+
+
+# ▼ ヘッダー行を一度だけ正規化し、読む列・型・列名の対応を覚えておく
+def csv_header_layout(header_line):
+    layout = csv_header_layouts.get(header_line)
+    if layout is None:
+        rename = {}
+        for raw in next(csv.reader([header_line.decode("utf-8-sig")])):
+            name = normalize_column_name(raw)
+            if name in CSV_COLUMN_DTYPES and name not in rename.values():
+                rename[raw] = name
+        layout = (list(rename), {raw: CSV_COLUMN_DTYPES[name] for raw, name in rename.items()}, rename)
+        csv_header_layouts[header_line] = layout
+    return layout
+
+
+# ▼ 銘柄コード・銘柄名称を全ファイル共通の辞書を持つ category 型にする（文字列は1銘柄につき1つだけ保持）
+def share_symbol_categories(df):
+    for column in csv_symbol_categories:
+        if column not in df.columns:
+            continue
+        values = pd.Index(df[column].str.strip() if column == "銘柄コード" else df[column])
+        with csv_categories_lock:
+            categories = csv_symbol_categories[column]
+            if categories is None:
+                categories = values[:0]
+            codes = categories.get_indexer(values)
+            missing = (codes < 0) & values.notna()
+            if missing.any():
+                categories = categories.append(values[missing].unique())
+                csv_symbol_categories[column] = categories
+                codes = categories.get_indexer(values)
+        df[column] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories))
+    return df
+
+
+# ▼ 分足CSVを1件読む（content は bytes かファイルパス）。列名は正規化済み、必要な列だけを指定の型で返す
+def read_minute_csv(content, memory_map=False):
+    if isinstance(content, bytes):
+        header = content.split(b"\n", 1)[0]
+        open_input = lambda: io.BytesIO(content)
+    else:
+        with open(content, "rb") as f:
+            header = f.readline()
+        open_input = lambda: content
+    usecols, dtypes, rename = csv_header_layout(header.rstrip(b"\r\n"))
+
+    engine = csv_engine()
+    options = {"usecols": usecols, "engine": engine}
+    if memory_map and engine == "c":
+        options["memory_map"] = True  # pyarrow エンジンは自前でまとめて読むので指定しない
+    try:
+        df = pd.read_csv(open_input(), dtype=dtypes, **options)
+    except ValueError:
+        # 欠損や文字の混じった数値列があるときは、すべて文字列で読み直して数値へ変換する
+        df = pd.read_csv(open_input(), dtype={raw: str for raw in dtypes}, **options)
+        for raw, dtype in dtypes.items():
+            if dtype is not str:
+                numbers = pd.to_numeric(df[raw], errors="coerce")
+                df[raw] = numbers.astype(dtype) if dtype == CSV_PRICE_DTYPE else numbers
+
+    df.columns = [rename[raw] for raw in df.columns]
+    return share_symbol_categories(df)
+
+
+# ▼ BarStore に書き込む (行数 × BAR_FIELDS) の float64 配列（float32 で読んだ価格は呼値の桁に丸めて戻す）
+def bar_field_values(df):
+    values = df.reindex(columns=BAR_FIELDS).to_numpy(dtype=float)
+    if CSV_PRICE_DECIMALS is not None:
+        for j, field in enumerate(BAR_FIELDS):
+            if field in df.columns and df[field].dtype == np.float32:
+                values[:, j] = np.round(values[:, j], CSV_PRICE_DECIMALS)
+    return values
+
+
+# ▼ DataFrame 群の使用メモリ（共有している category の辞書は1回だけ数える）
+def frames_memory_bytes(frames):
+    total = 0
+    seen = set()
+    for df in frames:
+        for column in df.columns:
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                total += series.cat.codes.nbytes
+                categories = series.cat.categories
+                if id(categories) not in seen:
+                    seen.add(id(categories))
+                    total += categories.memory_usage(deep=True)
+            else:
+                total += series.memory_usage(index=False, deep=True)
+        total += df.index.memory_usage()
+    return total
+
+
+# ▼ ----- ダウンロード済みCSVのキャッシュ設定 -----
+
+CSV_CACHE_DIR = ".csv_cache"  
+# ✅ ダウンロードしたCSVを保存するディレクトリ（空欄ならディスクキャッシュ無効）
+
+CSV_CACHE_MAX_BYTES = 512 * 1024 * 1024  
+# ✅ ディスクキャッシュの上限サイズ。超えたら最終利用が古いファイルから削除
+
+CSV_CACHE_MEMORY_ENTRIES = 240  
+# ✅ メモリ上に保持するDataFrameの最大件数（LRUで追い出し）
+
+# ▼ キャッシュの統計（メモリキャッシュ本体はフィードごとに Feed.csv_cache が持つ）
+csv_cache_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+
+# ▼ キャッシュファイルのパス（rev が変われば別ファイルになる）
+def csv_cache_path(fname, rev, cache_dir=None):
+    stem, ext = os.path.splitext(fname)
+    return os.path.join(cache_dir or CSV_CACHE_DIR, f"{stem}.{rev[0]}{ext}")
+
 
-    for hhmm, fname in files:
-        dropbox_path = f"/デイトレファイル/{fname}"
+# ▼ ディスクキャッシュが上限を超えたら古いものから削除
+def evict_csv_disk_cache(cache_dir=None):
+    cache_dir = cache_dir or CSV_CACHE_DIR
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= CSV_CACHE_MAX_BYTES:
+            break
         try:
-            metadata, res = dbx.files_download(dropbox_path)
-            df = pd.read_csv(res.raw)
-            df["ファイル時刻"] = hhmm
-            combined_df.append(df)
-        except Exception as e:
-            print(f"⚠️ {fname} の読み込みに失敗しました: {e}")
+            os.remove(path)
+            total -= size
+            csv_cache_stats["evictions"] += 1
+        except OSError:
+            pass
+
+
+# ▼ メモリキャッシュ（ファイル名 → (rev, DataFrame)）へ登録（件数上限を超えたら最も古いものを追い出す）
+def store_csv_memory_cache(cache, fname, rev, df):
+    cache[fname] = (rev, df)
+    cache.move_to_end(fname)
+    while len(cache) > CSV_CACHE_MEMORY_ENTRIES:
+        cache.popitem(last=False)
+        csv_cache_stats["evictions"] += 1
+
+
+# ▼ CSVを1件取得（ディスク → 取得元 の順に探す。ダウンロードスレッドから呼ばれる）
+#    cache_dir は呼び出し元（フィード）のキャッシュフォルダ
+def fetch_csv_frame(source, fname, rev, cache_dir=None):
+    cache_dir = CSV_CACHE_DIR if cache_dir is None else cache_dir
+    path = csv_cache_path(fname, rev, cache_dir) if cache_dir and source.cacheable else None
+    if path and os.path.exists(path):
+        df = read_minute_csv(path)
+        os.utime(path)  # 最終利用時刻を更新（LRU用）
+        return df, "disk"
+    if not path:
+        return source.read_frame(fname), "network"
+
+    content = source.read(fname)
+    df = read_minute_csv(content)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return df, "network"
+
+
+# ▼ ダウンロード用スレッドプール（初回利用時に作成し、以降は使い回す）
+def get_download_executor():
+    global download_executor
+    if download_executor is None:
+        download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY, thread_name_prefix="csv-download")
+    return download_executor
+
+
+# ▼ fork したプロセス（スイープのワーカーなど）には親のダウンロード用スレッドが引き継がれないため、プールを作り直させる
+def forget_download_executor():
+    global download_executor
+    download_executor = None
+
+
+os.register_at_fork(after_in_child=forget_download_executor)
+
+
+# ▼ ----- ダウンロードの期限・再試行・ヘッジ（遅い1ファイルでサイクル全体を待たせない） -----
+
+DOWNLOAD_DEADLINE = 8.0  
+# ✅ 1ファイルあたりの期限（秒。再試行・ヘッジを含めてこの時間で諦め、前回の取得分で代用する）
+
+DOWNLOAD_RETRIES = 2  
+# ✅ 失敗したときの再試行回数（ファイルがない・認証エラーなど、やり直しても同じものは再試行しない）
+
+DOWNLOAD_RETRY_BASE = 0.25  
+# ✅ 再試行待ちの初期値（秒）。失敗のたびに2倍＋ゆらぎ
+
+DOWNLOAD_HEDGE = True  
+# ✅ True なら、遅れているファイルに同じ取得をもう1本並行して出し、先に返った方を使う
+
+DOWNLOAD_HEDGE_QUANTILE = 0.95  
+DOWNLOAD_HEDGE_MIN_DELAY = 0.5  
+# ✅ ヘッジを出すまでの待ち＝直近の1ファイル所要時間のこの分位点（DOWNLOAD_HEDGE_MIN_DELAY 秒以上）
+
+DOWNLOAD_ABANDONED_MAX = 4  
+# ✅ 期限切れ・ヘッジ負けで見捨てたまま実行中の取得がこの数に達したら、ダウンロード用プールを作り直す
+#    （止まった取得がプールのスレッドを塞ぎ、次のサイクルの取得が順番待ちにならないようにする）
+
+DOWNLOAD_FALLBACK_LAST_GOOD = True  
+# ✅ True なら、期限までに取れなかったファイルは前回取得できた版（メモリ / ディスクキャッシュ）で代用する
+
+DOWNLOAD_FAILURE_LOG = "download_failures.jsonl"  
+# ✅ 取得できなかったファイルの記録（1行1件の JSON。分足の時刻・理由・代用の有無。空欄なら記録しない）
+
+download_failures = deque(maxlen=200)
+abandoned_downloads = set()  # 見捨てたまま実行中の取得（Future）
+
+# ▼ CSV の形式不正（書き込み途中のファイルを読んだときにも出るので、1回だけ取り直す）
+CSV_PARSE_ERRORS = (pd.errors.ParserError, pd.errors.EmptyDataError)
+
+
+# ▼ やり直せば取れる見込みのある失敗か（ファイルがない・認証エラー・CSVの形式不正は除く）
+def is_retryable_download_error(error):
+    return not isinstance(error, (dropbox.exceptions.ApiError, dropbox.exceptions.AuthError, FileNotFoundError, ValueError))
+
+
+# ▼ 取得できなかったファイルの代わりに使う、前回取得できた版（(DataFrame, rev)。なければ None）
+def last_good_frame(source, fname, rev, cache, cache_dir):
+    cached = cache.get(fname)
+    if cached is not None:
+        return cached[1].copy(deep=False), cached[0]
+    if cache_dir and source.cacheable and os.path.isdir(cache_dir):
+        stem, ext = os.path.splitext(fname)
+        candidates = [
+            os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+            if name.startswith(f"{stem}.") and name.endswith(ext)
+        ]
+        if candidates:
+            path = max(candidates, key=os.path.getmtime)
+            return read_minute_csv(path), ("stale", os.path.basename(path))
+    return None
+
+
+# ▼ 取得できなかったファイルを分足の時刻つきで記録（ログ・メトリクス・DOWNLOAD_FAILURE_LOG）
+def record_download_failure(hhmm, fname, rev, reason, attempts, fallback):
+    entry = {
+        "time": get_japan_time().isoformat(timespec="seconds"),
+        "minute": hhmm,
+        "file": fname,
+        "rev": rev[0] if isinstance(rev, (tuple, list)) else rev,
+        "reason": reason,
+        "attempts": attempts,
+        "fallback": fallback,
+    }
+    download_failures.append(entry)
+    metrics.count("download_failures", kind=reason.split(":")[0])
+    print(f"⚠️ {fname}（{hhmm}）を取得できませんでした（{attempts}回試行）: {reason}" + (" → 前回取得分で代用" if fallback else ""))
+    if DOWNLOAD_FAILURE_LOG:
+        with open(DOWNLOAD_FAILURE_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# ▼ 取り消せなかった（実行中の）取得を見捨てる。DOWNLOAD_ABANDONED_MAX に達したらプールを作り直す
+#    古いプールのスレッドは取得が終わりしだい抜ける（Dropbox はタイムアウトで必ず終わる）
+def abandon_downloads(futures):
+    global download_executor
+    abandoned_downloads.update(future for future in futures if not future.cancel())
+    abandoned_downloads.difference_update([future for future in abandoned_downloads if future.done()])
+    if len(abandoned_downloads) >= DOWNLOAD_ABANDONED_MAX and download_executor is not None:
+        print(f"⚠️ 見捨てた取得が {len(abandoned_downloads)}件 実行中のため、ダウンロード用プールを作り直します")
+        download_executor.shutdown(wait=False, cancel_futures=True)
+        download_executor = None
+        abandoned_downloads.clear()
+        metrics.count("download_pool_resets")
+
+
+# ▼ 1ファイルぶんの取得の試行（所要時間を記録し、成功なら (DataFrame, 取得元) を返す）
+def timed_fetch(source, fname, rev, cache_dir=None):
+    start = time.perf_counter()
+    result = fetch_csv_frame(source, fname, rev, cache_dir)
+    metrics.observe("download_file", time.perf_counter() - start)
+    return result
+
+
+# ▼ ファイルごとに期限・再試行・ヘッジを管理しながら並列で取得する
+#    {(hhmm, fname, rev): (DataFrame, 取得元) または例外} を返す（期限切れは TimeoutError）
+def fetch_with_deadlines(source, keys, cache_dir=None):
+    cache_dir = CSV_CACHE_DIR if cache_dir is None else cache_dir
+    executor = get_download_executor()
+    now = time.monotonic()
+    hedge_after = max(DOWNLOAD_HEDGE_MIN_DELAY, metrics.quantile("download_file", DOWNLOAD_HEDGE_QUANTILE) or 0.0)
+    state = {
+        key: {"futures": [executor.submit(timed_fetch, source, key[1], key[2], cache_dir)], "started": now,
+              "deadline": now + DOWNLOAD_DEADLINE, "retries": 0, "retry_at": None, "hedged": False, "hedge": None,
+              "parse_retried": False}
+        for key in keys
+    }
+    results = {}
+
+    while len(results) < len(state):
+        active = {future: key for key, s in state.items() if key not in results for future in s["futures"]}
+        events = []
+        for key, s in state.items():
+            if key in results:
+                continue
+            events.append(s["deadline"])
+            if s["retry_at"] is not None:
+                events.append(s["retry_at"])
+            elif DOWNLOAD_HEDGE and not s["hedged"] and len(s["futures"]) == 1:
+                events.append(s["started"] + hedge_after)
+        timeout = max(0.0, min(events) - time.monotonic())
+        done, _ = wait(list(active), timeout=timeout, return_when=FIRST_COMPLETED) if active else (set(), None)
+        if not active:
+            time.sleep(timeout)
+
+        for future in done:
+            key = active[future]
+            s = state[key]
+            s["futures"].remove(future)
+            if key in results:
+                continue
+            try:
+                results[key] = future.result()
+                if future is s["hedge"]:
+                    metrics.count("download_hedge_wins")
+                abandon_downloads(s["futures"])
+            except Exception as e:
+                if s["futures"]:
+                    continue  # ✅ ヘッジの片方が残っていればその結果を待つ
+                # ✅ 形式不正は書き込み途中を読んだだけかもしれないので、再試行回数とは別に1回だけ取り直す
+                parse_retry = isinstance(e, CSV_PARSE_ERRORS) and not s["parse_retried"]
+                if not parse_retry and (s["retries"] >= DOWNLOAD_RETRIES or not is_retryable_download_error(e)):
+                    results[key] = e
+                else:
+                    if parse_retry:
+                        s["parse_retried"] = True
+                    else:
+                        s["retries"] += 1
+                    s["retry_at"] = time.monotonic() + DOWNLOAD_RETRY_BASE * 2 ** max(s["retries"] - 1, 0) * random.uniform(0.5, 1.0)
+
+        now = time.monotonic()
+        for key, s in state.items():
+            if key in results:
+                continue
+            if now >= s["deadline"]:
+                abandon_downloads(s["futures"])
+                results[key] = TimeoutError(f"{DOWNLOAD_DEADLINE:g}秒の期限切れ")
+            elif s["retry_at"] is not None and now >= s["retry_at"]:
+                s["retry_at"] = None
+                s["started"] = now
+                s["futures"].append(get_download_executor().submit(timed_fetch, source, key[1], key[2], cache_dir))
+                metrics.count("download_retries")
+            elif DOWNLOAD_HEDGE and not s["hedged"] and len(s["futures"]) == 1 and now >= s["started"] + hedge_after:
+                s["hedged"] = True
+                s["hedge"] = get_download_executor().submit(timed_fetch, source, key[1], key[2], cache_dir)
+                s["futures"].append(s["hedge"])
+                metrics.count("download_hedges")
+
+    attempts = {key: 1 + s["retries"] + s["hedged"] + s["parse_retried"] for key, s in state.items()}
+    return results, attempts
+
+
+# ▼ 分足CSVをまとめて取得（メモリキャッシュにあるものはそのまま使い、残りだけ並列で取得）
+#    取得できなかった分足は、前回取得できた版があればそれで代用する（DataFrame.attrs["stale_rev"] に元の rev）
+#    キャッシュ（メモリ・ディスク）は feed のものを使う（省略すると既定のフィード）
+def load_minute_frames(source, files, verbose=True, feed=None):
+    feed = feed or get_default_feed()
+    cache, cache_dir = feed.csv_cache, feed.csv_cache_dir
+    frames = {}
+    pending = []
+    for hhmm, fname, rev in files:
+        cached = cache.get(fname)
+        if cached and cached[0] == rev:
+            cache.move_to_end(fname)
+            csv_cache_stats["memory_hits"] += 1
+            frames[hhmm] = cached[1]
+        else:
+            pending.append((hhmm, fname, rev))
+
+    results, attempts = fetch_with_deadlines(source, pending, cache_dir) if pending else ({}, {})
+    for key in pending:
+        hhmm, fname, rev = key
+        result = results[key]
+        if isinstance(result, Exception):
+            fallback = last_good_frame(source, fname, rev, cache, cache_dir) if DOWNLOAD_FALLBACK_LAST_GOOD else None
+            if fallback is not None:
+                df, stale_rev = fallback
+                df.attrs["stale_rev"] = stale_rev
+                frames[hhmm] = df
+                metrics.count("download_fallbacks")
+            record_download_failure(hhmm, fname, rev, f"{type(result).__name__}: {result}", attempts[key], fallback is not None)
             continue
+        df, origin = result
+        csv_cache_stats["disk_hits" if origin == "disk" else "misses"] += 1
+        store_csv_memory_cache(cache, fname, rev, df)
+        frames[hhmm] = df
+
+    if pending and cache_dir and os.path.isdir(cache_dir):
+        evict_csv_disk_cache(cache_dir)
+
+    if verbose:
+        print(
+            f"🗃️ CSVキャッシュ: メモリ {csv_cache_stats['memory_hits']} / ディスク {csv_cache_stats['disk_hits']}"
+            f" / 取得 {csv_cache_stats['misses']} / 追い出し {csv_cache_stats['evictions']}"
+        )
+    return frames
+
+
+# ▼ ----- 分足のリングバッファ（銘柄 × 本数 × 項目） -----
+
+BAR_WINDOW = 90  
+# ✅ 保持する分足の本数（list_today_csv_files の limit と同じ）
+
+BAR_FIELDS = ["現在値", "高値", "安値", "出来高"]
+# ✅ リングバッファに保持する数値項目（検出関数が使う列だけ）
+
+
+class BarStore:
+    """銘柄ごとの直近 capacity 本の分足を NumPy 配列で保持するリングバッファ。
+
+    values は (銘柄数, capacity, len(BAR_FIELDS)) の float64 配列で、新しい分足は
+    head の位置に上書きされる。銘柄コードは文字列に揃えて code_index で行番号を引く。
+    """
+
+    def __init__(self, capacity=BAR_WINDOW, initial_symbols=4096, streaming=None):
+        self.capacity = capacity
+        self.streaming = streaming
+        self.indicators = None
+        if streaming is not None:
+            streaming.resize(initial_symbols)
+            self.indicators = np.full((initial_symbols, capacity, len(INDICATOR_KEYS)), np.nan)
+        self.values = np.full((initial_symbols, capacity, len(BAR_FIELDS)), np.nan)
+        self.present = np.zeros((initial_symbols, capacity), dtype=bool)
+        self.codes = []
+        self.names = np.empty(initial_symbols, dtype=object)
+        self.code_index = {}
+        self.slot_hhmm = [None] * capacity
+        self.slot_rev = [None] * capacity
+        self.head = 0
+        self.count = 0
+        self.date = None
+        self.window_start = None
+        self.warm = 0
+        self._code_order = None
+        self._category_rows = (None, None)
+
+    # ▼ 日付が変わったときなどに中身を空にする（銘柄の索引は使い回す）
+    def reset(self, date=None):
+        self.present[:] = False
+        self.values[:] = np.nan
+        self.slot_hhmm = [None] * self.capacity
+        self.slot_rev = [None] * self.capacity
+        self.head = 0
+        self.count = 0
+        self.warm = 0
+        self.date = date
+        if self.streaming is not None:
+            self.streaming.reset()
+            self.indicators[:] = np.nan
+
+    # ▼ 古い順のスロット番号
+    def slots(self):
+        start = self.head - self.count
+        return [(start + i) % self.capacity for i in range(self.count)]
+
+    # ▼ 判定に使うスロット（前営業日の分足はすべて、当日の分足は since_hhmm 以降）
+    def window_slots(self, since_hhmm=None):
+        slots = self.slots()
+        return slots[:self.warm] + [s for s in slots[self.warm:] if since_hhmm is None or self.slot_hhmm[s] >= since_hhmm]
+
+    # ▼ 保持している当日の (hhmm, rev) の並び（古い順。ウォームスタートの分足は含めない）
+    def sequence(self):
+        return [(self.slot_hhmm[s], self.slot_rev[s]) for s in self.slots()[self.warm:]]
+
+    def last_hhmm(self):
+        return self.slot_hhmm[(self.head - 1) % self.capacity] if self.count > self.warm else None
+
+    # ▼ ファイル一覧の先頭側が保持済みの内容と一致しているか（一致すれば差分追記でよい）
+    def matches(self, files):
+        if self.count == self.warm:
+            return True
+        last = self.last_hhmm()
+        stored = [(h, r) for h, r in self.sequence() if files and h >= files[0][0]]
+        expected = [(hhmm, rev) for hhmm, _, rev in files if hhmm <= last]
+        return stored == expected
+
+    # ▼ files の分足をすべて保持しているか（読み込みに失敗した分足があれば False）
+    def covers(self, files):
+        return bool(files) and self.last_hhmm() == files[-1][0] and self.matches(files)
+
+    # ▼ 銘柄コード → 行番号（新しい銘柄は行を追加し、足りなければ配列を拡張）
+    def _rows_for(self, codes, names):
+        rows = np.empty(len(codes), dtype=np.intp)
+        for i, code in enumerate(codes):
+            row = self.code_index.get(code)
+            if row is None:
+                row = len(self.codes)
+                self.code_index[code] = row
+                self.codes.append(code)
+                self._code_order = None
+            rows[i] = row
+
+        needed = len(self.codes)
+        if needed > self.values.shape[0]:
+            size = max(needed, self.values.shape[0] * 2)
+            values = np.full((size, self.capacity, len(BAR_FIELDS)), np.nan)
+            present = np.zeros((size, self.capacity), dtype=bool)
+            names_all = np.empty(size, dtype=object)
+            values[:self.values.shape[0]] = self.values
+            present[:self.present.shape[0]] = self.present
+            names_all[:self.names.shape[0]] = self.names
+            self.values, self.present, self.names = values, present, names_all
+            if self.streaming is not None:
+                self.streaming.resize(size)
+                indicators = np.full((size, self.capacity, len(INDICATOR_KEYS)), np.nan)
+                indicators[:self.indicators.shape[0]] = self.indicators
+                self.indicators = indicators
+
+        if names is not None:
+            self.names[rows] = names
+        return rows
+
+    # ▼ category 型の銘柄コード → 行番号（共有辞書が変わったときだけ辞書全体を引き直す）
+    def _rows_for_categories(self, codes, names):
+        categories = codes.cat.categories
+        if self._category_rows[0] is not categories:
+            category_codes = np.asarray(categories.astype(str).str.strip(), dtype=object)
+            self._category_rows = (categories, self._rows_for(category_codes, None))
+        rows = self._category_rows[1][codes.cat.codes.to_numpy()]
+        if names is not None:
+            self.names[rows] = names
+        return rows
+
+    # ▼ 前営業日の分足 [(hhmm, rev, DataFrame)] を当日の分足より前に入れる（空のときだけ）
+    def seed(self, frames):
+        for hhmm, rev, df in frames[-self.capacity:]:
+            self.append(hhmm, rev, df)
+        self.warm = self.count
+
+    # ▼ 1分ぶんのCSVを head の位置に書き込む（満杯なら最も古い分足を上書き）
+    def append(self, hhmm, rev, df):
+        if self.count == self.capacity and self.warm:
+            self.warm -= 1
+        names = df["銘柄名称"].to_numpy(dtype=object) if "銘柄名称" in df.columns else None
+        if isinstance(df["銘柄コード"].dtype, pd.CategoricalDtype) and (df["銘柄コード"].cat.codes >= 0).all():
+            rows = self._rows_for_categories(df["銘柄コード"], names)
+        else:
+            rows = self._rows_for(df["銘柄コード"].astype(str).str.strip().to_numpy(), names)
+
+        slot = self.head
+        self.present[:, slot] = False
+        self.values[:, slot, :] = np.nan
+        self.present[rows, slot] = True
+        bar_values = bar_field_values(df)
+        self.values[rows, slot, :] = bar_values
+
+        # ▼ 逐次計算が有効なら、この1本ぶんのインジケーターを同じスロットに書き込む
+        if self.streaming is not None:
+            self.indicators[:, slot, :] = np.nan
+            self.indicators[rows, slot, :] = self.streaming.update(rows, bar_values)
+
+        self.slot_hhmm[slot] = hhmm
+        self.slot_rev[slot] = rev
+        self.head = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    # ▼ 銘柄コード順の行番号
+    def code_order(self):
+        if self._code_order is None:
+            self._code_order = np.argsort(np.asarray(self.codes, dtype=str), kind="stable")
+        return self._code_order
+
+    # ▼ 対象スロットと、欠けた分足を詰めて右寄せするための並び替え
+    def _aligned_layout(self, since_hhmm=None):
+        slots = self.window_slots(since_hhmm)
+        order = self.code_order()
+        present = self.present[order][:, slots]
+        active = present.any(axis=1)
+        order, present = order[active], present[active]
+        pack = np.argsort(present, axis=1, kind="stable")
+        return order, slots, pack, np.take_along_axis(present, pack, axis=1)
+
+    # ▼ 一括計算向けに（銘柄 × 本数）の配列を返す。欠けた分足は詰めて右寄せし、末尾を最新にそろえる
+    def aligned_window(self, since_hhmm=None):
+        order, slots, pack, present = self._aligned_layout(since_hhmm)
+        values = np.take_along_axis(self.values[order][:, slots, :], pack[:, :, None], axis=1)
+        values[~present] = np.nan
+        codes = np.asarray(self.codes, dtype=object)[order]
+        return codes, self.names[order], values, present
+
+    # ▼ 逐次計算したインジケーターを aligned_window と同じ並びで返す
+    def aligned_indicators(self, since_hhmm=None):
+        order, slots, pack, present = self._aligned_layout(since_hhmm)
+        indicators = np.take_along_axis(self.indicators[order][:, slots, :], pack[:, :, None], axis=1)
+        indicators[~present] = np.nan
+        codes = np.asarray(self.codes, dtype=object)[order]
+        return codes, {key: indicators[:, :, j] for j, key in enumerate(INDICATOR_KEYS)}
+
+    # ▼ since_hhmm 以降に判定できる分足があるか
+    def has_bars(self, since_hhmm=None):
+        slots = self.window_slots(since_hhmm)
+        return bool(slots) and bool(self.present[:, slots].any())
+
+    # ▼ 検出関数向けに「銘柄コード → 時刻」順の縦持ち DataFrame を組み立てる
+    #    （銘柄ごとの判定・pandas での計算用。一括判定は aligned_window の配列をそのまま使う）
+    def to_frame(self, since_hhmm=None):
+        slots = self.window_slots(since_hhmm)
+        if not slots or not self.codes:
+            return pd.DataFrame()
+
+        order = self.code_order()
+        k = len(slots)
+        values = self.values[order][:, slots, :]
+        mask = self.present[order][:, slots].reshape(-1)
+        times = np.array([datetime.strptime(self.slot_hhmm[s], "%H%M").time() for s in slots], dtype=object)
+
+        data = {
+            "銘柄コード": np.repeat(np.asarray(self.codes, dtype=object)[order], k)[mask],
+            "銘柄名称": np.repeat(self.names[order], k)[mask],
+        }
+        for j, field in enumerate(BAR_FIELDS):
+            data[field] = values[:, :, j].reshape(-1)[mask]
+        data["ファイル時刻"] = np.tile(times, len(order))[mask]
+        return pd.DataFrame(data)
+
+
+# ▼ 既定のフィードのリングバッファ（初回利用時に作成。逐次計算が有効ならその状態も持たせる）
+def get_bar_store():
+    return get_default_feed().get_bar_store()
+
+
+# ▼ 保持済みの分足と食い違いがなければ、新しい分足だけを load_frames で読み込んで追記し、リングバッファを返す
+#    （判定する窓は window_start 以降。DataFrame は組み立てない）
+#    warm_source を渡すと、当日の分足が窓に満たない間は前営業日の最後の分足で窓を埋める（WARM_START）
+#    archive=True のときだけ feed の分足アーカイブへ保存する（ライブの監視ループ用。リプレイでは書かない）
+#    保持先・アーカイブは feed のもの（省略すると既定のフィード）
+def update_bar_store(today, files, load_frames, warm_source=None, archive=False, feed=None):
+    feed = feed or get_default_feed()
+    bar_store = feed.get_bar_store()
+    if archive and bar_store.date != today and bar_store.date and feed.archive_dir:
+        maintain_archive(today, feed.archive_dir)  # ✅ 日付が変わったら前日の分足を1ファイルにまとめる
+    if bar_store.date != today or not bar_store.matches(files):
+        bar_store.reset(today)
+    if WARM_START and warm_source is not None and not bar_store.count and len(files) < bar_store.capacity:
+        with metrics.time("warm_start"):
+            bar_store.seed(load_warm_start_frames(today, warm_source, archive=archive, feed=feed))
+    last = bar_store.last_hhmm()
+    new_files = [f for f in files if last is None or f[0] > last]
+
+    with metrics.time("download"):
+        frames = load_frames(new_files)
+    metrics.count("files_loaded", len(frames))
+
+    # ✅ 前回取得分で代用した分足は元の rev で保持し、次のサイクルで一覧と食い違って取り直されるようにする
+    with metrics.time("ingest"):
+        for hhmm, fname, rev in new_files:
+            if hhmm in frames:
+                bar_store.append(hhmm, frames[hhmm].attrs.get("stale_rev", rev), frames[hhmm])
+
+    if archive:
+        with metrics.time("archive"):
+            for hhmm, fname, rev in new_files:
+                if hhmm in frames and "stale_rev" not in frames[hhmm].attrs:
+                    archive_minute(today, hhmm, rev, frames[hhmm], feed.archive_dir)
+
+    if STREAMING_VALIDATE and bar_store.streaming is not None:
+        validate_streaming_indicators(bar_store, since_hhmm=files[0][0])
+
+    bar_store.window_start = files[0][0]
+    return bar_store
+
+
+# ▼ 現在時刻までの直近 BAR_WINDOW 件の分足ファイル（hhmm, fname, rev）
+def list_intraday_files(target_date=None, feed=None):
+    current_hhmm = get_japan_time().strftime("%H%M")
+    with metrics.time("listing"):
+        return list_today_csv_files(target_date=target_date, limit=BAR_WINDOW, current_hhmm=current_hhmm, feed=feed)
+
+
+# ▼ 分足ファイルを読み込んで、判定する窓を持ったリングバッファを返す（分足がなければ None）
+#    files を渡せば一覧を取り直さない。archive・feed は update_bar_store と同じ
+def build_intraday_window(target_date=None, files=None, archive=False, feed=None):
+    feed = feed or get_default_feed()
+    today = target_date if target_date else get_japan_time().strftime("%Y%m%d")
+    source = feed.get_source()
+    if files is None:
+        files = list_intraday_files(target_date, feed=feed)
 
-    if not combined_df:
+    if not files:
         print("📭 有効なCSVファイルが見つかりませんでした。")
-        return pd.DataFrame()
+        return None
+
+    bar_store = update_bar_store(
+        today, files, lambda new_files: load_minute_frames(source, new_files, feed=feed), warm_source=source,
+        archive=archive, feed=feed,
+    )
+    if not bar_store.has_bars(bar_store.window_start):
+        print("📭 有効なCSVファイルが見つかりませんでした。")
+        return None
+    return bar_store
 
-    df_all = pd.concat(combined_df, ignore_index=True)
-    df_all["ファイル時刻"] = pd.to_datetime(df_all["ファイル時刻"], format="%H%M").dt.time
-    df_all = df_all.sort_values(by=["銘柄コード", "ファイル時刻"]).reset_index(drop=True)
 
-    return df_all
+# ▼ build_intraday_window の窓を縦持ちの DataFrame で返す（分足がなければ空の DataFrame）
+def build_intraday_dataframe(target_date=None, files=None, archive=False, feed=None):
+    bar_store = build_intraday_window(target_date=target_date, files=files, archive=archive, feed=feed)
+    if bar_store is None:
+        return pd.DataFrame()
+    return bar_store.to_frame(since_hhmm=bar_store.window_start)
 
 
 
@@ -274,12 +1789,13 @@ BOX_BREAKOUT_VOLATILITY_RATIO = 1.2  # ボラが過去比で何倍以上か
 
 
 
-# ▼ MACDヒストグラム計算関数
-def calculate_macd_hist(prices: pd.Series) -> pd.Series:
-    ema_short = prices.ewm(span=MACD_SHORT, adjust=False).mean()
-    ema_long = prices.ewm(span=MACD_LONG, adjust=False).mean()
+# ▼ MACDヒストグラム計算関数（期間は params のもの。省略時はモジュールの設定値）
+def calculate_macd_hist(prices: pd.Series, params=None) -> pd.Series:
+    params = detector_parameters(params)
+    ema_short = prices.ewm(span=params["MACD_SHORT"], adjust=False).mean()
+    ema_long = prices.ewm(span=params["MACD_LONG"], adjust=False).mean()
     macd = ema_short - ema_long
-    macd_signal = macd.ewm(span=MACD_SIGNAL, adjust=False).mean()
+    macd_signal = macd.ewm(span=params["MACD_SIGNAL"], adjust=False).mean()
     return macd - macd_signal
 
 # ▼ RSI 計算関数
@@ -293,44 +1809,505 @@ def calculate_rsi(series: pd.Series, period: int = RSI_PERIOD) -> pd.Series:
     rsi = 100 - (100 / (1 + rs))
     return rsi
 
-# ▼ トレンド判定共通関数
-def detect_trend(df_group, trend_type="up"):
-    df = df_group.tail(90).copy()
-    if len(df) < UPTREND_LOOKBACK:
+# ▼ ----- 全銘柄一括のインジケーター計算（銘柄 × 時刻の2次元配列、末尾が最新） -----
+
+# ▼ 移動平均（rolling(window).mean() と同じく、本数不足や窓内の NaN は NaN）
+#   pandas と同じ「補正付きの足し引き」で計算し、丸め（round(x, 2)）の結果まで一致させる
+def rolling_mean_2d(matrix, window):
+    n, width = matrix.shape
+    out = np.full((n, width), np.nan)
+    total = np.zeros(n)
+    comp_add = np.zeros(n)
+    comp_remove = np.zeros(n)
+    nobs = np.zeros(n, dtype=np.int64)
+    neg_ct = np.zeros(n, dtype=np.int64)
+    same_ct = np.zeros(n, dtype=np.int64)
+    prev = matrix[:, 0].copy() if width else np.zeros(n)
+
+    for t in range(width):
+        if t >= window:
+            old = matrix[:, t - window]
+            ok = ~np.isnan(old)
+            y = -old - comp_remove
+            s = total + y
+            comp_remove = np.where(ok, s - total - y, comp_remove)
+            total = np.where(ok, s, total)
+            nobs -= ok
+            neg_ct -= ok & np.signbit(old)
+
+        cur = matrix[:, t]
+        ok = ~np.isnan(cur)
+        y = cur - comp_add
+        s = total + y
+        comp_add = np.where(ok, s - total - y, comp_add)
+        total = np.where(ok, s, total)
+        nobs += ok
+        neg_ct += ok & np.signbit(cur)
+        same_ct = np.where(ok, np.where(cur == prev, same_ct + 1, 1), same_ct)
+        prev = np.where(ok, cur, prev)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / nobs
+        mean = np.where(same_ct >= nobs, prev, mean)
+        mean = np.where((neg_ct == 0) & (mean < 0), 0.0, mean)
+        mean = np.where((neg_ct == nobs) & (mean > 0), 0.0, mean)
+        out[:, t] = np.where(nobs >= window, mean, np.nan)
+    return out
+
+# ▼ 移動標準偏差（rolling(window).std() と同じく不偏標準偏差）
+def rolling_std_2d(matrix, window):
+    out = np.full(matrix.shape, np.nan)
+    if matrix.shape[1] >= window:
+        out[:, window - 1:] = sliding_window_view(matrix, window, axis=1).std(axis=2, ddof=1)
+    return out
+
+# ▼ 時刻方向に periods 本ずらす（shift(periods) と同じ）
+def shift_2d(matrix, periods):
+    out = np.full(matrix.shape, np.nan)
+    if periods < matrix.shape[1]:
+        out[:, periods:] = matrix[:, :matrix.shape[1] - periods]
+    return out
+
+# ▼ 指数移動平均を1本進める（ewm(adjust=False, ignore_na=False) の漸化式。NaN の扱いも pandas に合わせる）
+def ewm_step(weighted, old_wt, cur, alpha):
+    is_obs = ~np.isnan(cur)
+    has_prev = ~np.isnan(weighted)
+    old_wt = np.where(has_prev, old_wt * (1 - alpha), old_wt)
+    blended = old_wt * weighted + (1 - old_wt) * cur
+    weighted = np.where(has_prev & is_obs & (weighted != cur), blended, weighted)
+    old_wt = np.where(has_prev & is_obs, 1.0, old_wt)
+    weighted = np.where(~has_prev & is_obs, cur, weighted)
+    return weighted, old_wt
+
+# ▼ 指数移動平均（ewm(span=span, adjust=False).mean() の一括版）
+def ewm_mean_2d(matrix, span):
+    alpha = 2 / (span + 1)
+    out = np.empty(matrix.shape)
+    weighted = np.full(matrix.shape[0], np.nan)
+    old_wt = np.ones(matrix.shape[0])
+    for t in range(matrix.shape[1]):
+        weighted, old_wt = ewm_step(weighted, old_wt, matrix[:, t], alpha)
+        out[:, t] = weighted
+    return out
+
+# ▼ MACDヒストグラム（calculate_macd_hist の一括版）
+def macd_hist_2d(prices, short=MACD_SHORT, long=MACD_LONG, signal=MACD_SIGNAL):
+    macd = ewm_mean_2d(prices, short) - ewm_mean_2d(prices, long)
+    return macd - ewm_mean_2d(macd, signal)
+
+# ▼ RSI（calculate_rsi の一括版。present が False の位置は系列の外として扱う）
+def rsi_2d(prices, present, period=RSI_PERIOD):
+    delta = np.full(prices.shape, np.nan)
+    delta[:, 1:] = np.diff(prices, axis=1)
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    gain[~present] = np.nan
+    loss[~present] = np.nan
+    rs = rolling_mean_2d(gain, period) / rolling_mean_2d(loss, period)
+    return 100 - (100 / (1 + rs))
+
+# ▼ インジケーターの列名（各検出関数が使う列名と同じ）
+INDICATOR_KEYS = [
+    "MA_5", "MA_25", "MA_60", "標準偏差", "RSI",
+    "MACDヒストグラム", "出来高平均_直近", "出来高平均_過去",
+]
+
+# ▼ 全銘柄ぶんのインジケーターをまとめて計算（INDICATOR_KEYS をキーにした辞書で返す。期間は params のもの）
+def compute_indicator_matrix(values, present, keys=None, params=None):
+    params = detector_parameters(params)
+    prices = np.ascontiguousarray(values[:, :, BAR_FIELDS.index("現在値")])
+    volumes = np.ascontiguousarray(values[:, :, BAR_FIELDS.index("出来高")])
+    formulas = {
+        "MA_5": lambda: rolling_mean_2d(prices, params["MA_SHORT_WINDOW"]),
+        "MA_25": lambda: rolling_mean_2d(prices, params["MA_MID_WINDOW"]),
+        "MA_60": lambda: rolling_mean_2d(prices, params["MA_LONG_WINDOW"]),
+        "標準偏差": lambda: rolling_std_2d(prices, params["STD_WINDOW"]),
+        "RSI": lambda: rsi_2d(prices, present, period=params["RSI_PERIOD"]),
+        "MACDヒストグラム": lambda: macd_hist_2d(prices, params["MACD_SHORT"], params["MACD_LONG"], params["MACD_SIGNAL"]),
+        "出来高平均_直近": lambda: rolling_mean_2d(volumes, params["VOLUME_RECENT_WINDOW"]),
+        "出来高平均_過去": lambda: rolling_mean_2d(
+            shift_2d(volumes, params["VOLUME_RECENT_WINDOW"]), params["VOLUME_PAST_WINDOW"]
+        ),
+    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {key: formulas[key]() for key in (keys or INDICATOR_KEYS)}
+
+# ▼ ----- 銘柄ごとの逐次インジケーター（新しい1本ごとに O(1) で更新） -----
+
+USE_STREAMING_INDICATORS = True  
+# ✅ True なら分足の追記時にインジケーターを逐次更新する（False なら毎回一括計算）
+
+STREAMING_VALIDATE = False  
+# ✅ True なら毎サイクル、逐次計算の結果を一括計算（pandas と同じ式）と突き合わせてログ出力
+
+STREAMING_VALIDATE_TOLERANCE = 1e-6  
+# ✅ 突き合わせで許容する相対誤差（移動平均・標準偏差・RSI・出来高平均）
+
+STREAMING_VALIDATE_BARS = 10  
+# ✅ 突き合わせる本数（末尾から。クロス判定などが参照する範囲をカバーする）
+
+
+class RollingWindowState:
+    """銘柄ごとに直近 window 本を保持し、合計・NaN 数・Welford の平均/M2 を1本ずつ更新する。
+
+    window 本ごとにバッファから合計と M2 を計算し直し、浮動小数点の誤差の蓄積を防ぐ。
+    """
+
+    def __init__(self, window, size=0):
+        self.window = window
+        self.buffer = np.full((size, window), np.nan)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size)
+        self.nans = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def resize(self, size):
+        old = self.count.shape[0]
+        if size <= old:
+            return
+        self.buffer = np.vstack([self.buffer, np.full((size - old, self.window), np.nan)])
+        self.count = np.concatenate([self.count, np.zeros(size - old, dtype=np.int64)])
+        self.total = np.concatenate([self.total, np.zeros(size - old)])
+        self.nans = np.concatenate([self.nans, np.zeros(size - old, dtype=np.int64)])
+        self.mean = np.concatenate([self.mean, np.zeros(size - old)])
+        self.m2 = np.concatenate([self.m2, np.zeros(size - old)])
+
+    def reset(self):
+        self.buffer[:] = np.nan
+        self.count[:] = 0
+        self.total[:] = 0
+        self.nans[:] = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+
+    # ▼ rows の各銘柄に1本追加し、窓から押し出された値（窓が埋まる前は NaN）を返す
+    def push(self, rows, x):
+        count = self.count[rows]
+        pos = count % self.window
+        full = count >= self.window
+        old = np.where(full, self.buffer[rows, pos], np.nan)
+        self.buffer[rows, pos] = x
+        self.count[rows] = count + 1
+
+        old_nan = full & np.isnan(old)
+        new_nan = np.isnan(x)
+        self.nans[rows] += new_nan.astype(np.int64) - old_nan.astype(np.int64)
+        self.total[rows] += np.where(new_nan, 0.0, x) - np.where(full & ~old_nan, old, 0.0)
+
+        # ▼ Welford：窓が埋まる前は追加、埋まった後は入れ替えで平均と M2 を更新
+        mean, m2 = self.mean[rows], self.m2[rows]
+        n = np.minimum(count + 1, self.window)
+        with np.errstate(invalid="ignore"):
+            delta = x - mean
+            add_mean = mean + delta / n
+            add_m2 = m2 + delta * (x - add_mean)
+            swap_mean = mean + (x - old) / self.window
+            swap_m2 = m2 + (x - old) * (x - swap_mean + old - mean)
+        self.mean[rows] = np.where(full, swap_mean, add_mean)
+        self.m2[rows] = np.where(full, swap_m2, add_m2)
+
+        # ▼ NaN が絡んだ銘柄と、一巡した銘柄はバッファから計算し直す
+        resync = rows[new_nan | old_nan | (self.nans[rows] > 0) | ((count + 1) % self.window == 0)]
+        if len(resync):
+            filled = np.minimum(self.count[resync], self.window)
+            buf = self.buffer[resync]
+            valid = np.arange(self.window)[None, :] < filled[:, None]
+            finite = valid & ~np.isnan(buf)
+            k = np.maximum(finite.sum(axis=1), 1)
+            vals = np.where(finite, buf, 0.0)
+            self.total[resync] = vals.sum(axis=1)
+            self.nans[resync] = (valid & np.isnan(buf)).sum(axis=1)
+            self.mean[resync] = self.total[resync] / k
+            self.m2[resync] = (np.where(finite, buf - self.mean[resync][:, None], 0.0) ** 2).sum(axis=1)
+        return old
+
+    # ▼ rolling(window).mean() 相当（本数不足・窓内 NaN は NaN）
+    def rolling_mean(self, rows):
+        ok = (self.count[rows] >= self.window) & (self.nans[rows] == 0)
+        return np.where(ok, self.total[rows] / self.window, np.nan)
+
+    # ▼ rolling(window).std() 相当（不偏標準偏差）
+    def rolling_std(self, rows):
+        ok = (self.count[rows] >= self.window) & (self.nans[rows] == 0)
+        return np.where(ok, np.sqrt(np.maximum(self.m2[rows], 0.0) / (self.window - 1)), np.nan)
+
+
+class StreamingIndicators:
+    """全銘柄の EMA / RSI / 移動平均 / 標準偏差 / 出来高平均を1本ずつ更新する状態。
+
+    行番号は BarStore と共通。EMA（MACD）はリセット以降の全系列で持ち越すため、
+    BAR_WINDOW 本を超えると窓内で計算し直す pandas 版とは初期値の影響ぶんだけ差が出る。
+    """
+
+    def __init__(self, size=0):
+        self.ma_short = RollingWindowState(MA_SHORT_WINDOW)
+        self.ma_mid = RollingWindowState(MA_MID_WINDOW)
+        self.ma_long = RollingWindowState(MA_LONG_WINDOW)
+        self.std = RollingWindowState(STD_WINDOW)
+        self.gain = RollingWindowState(RSI_PERIOD)
+        self.loss = RollingWindowState(RSI_PERIOD)
+        self.volume_recent = RollingWindowState(VOLUME_RECENT_WINDOW)
+        self.volume_past = RollingWindowState(VOLUME_PAST_WINDOW)
+        self.windows = [
+            self.ma_short, self.ma_mid, self.ma_long, self.std,
+            self.gain, self.loss, self.volume_recent, self.volume_past,
+        ]
+        self.size = 0
+        self.prev_price = np.empty(0)
+        self.ema = {}
+        self.resize(size)
+
+    def resize(self, size):
+        if size <= self.size:
+            return
+        for window in self.windows:
+            window.resize(size)
+        grow = size - self.size
+        self.prev_price = np.concatenate([self.prev_price, np.full(grow, np.nan)])
+        for key in ["short", "long", "signal"]:
+            weighted, old_wt = self.ema.get(key, (np.empty(0), np.empty(0)))
+            self.ema[key] = (np.concatenate([weighted, np.full(grow, np.nan)]), np.concatenate([old_wt, np.ones(grow)]))
+        self.size = size
+
+    def reset(self):
+        for window in self.windows:
+            window.reset()
+        self.prev_price[:] = np.nan
+        for key, (weighted, old_wt) in self.ema.items():
+            weighted[:] = np.nan
+            old_wt[:] = 1.0
+
+    # ▼ EMA を1本進める（rows の銘柄だけ）
+    def _ema(self, key, rows, cur, span):
+        weighted, old_wt = self.ema[key]
+        weighted[rows], old_wt[rows] = ewm_step(weighted[rows], old_wt[rows], cur, 2 / (span + 1))
+        return weighted[rows]
+
+    # ▼ rows の銘柄に1本（BAR_FIELDS の並び）を追加し、その時点のインジケーターを INDICATOR_KEYS の並びで返す
+    def update(self, rows, bar_values):
+        price = bar_values[:, BAR_FIELDS.index("現在値")]
+        volume = bar_values[:, BAR_FIELDS.index("出来高")]
+
+        for window in [self.ma_short, self.ma_mid, self.ma_long, self.std]:
+            window.push(rows, price)
+
+        # ▼ RSI：calculate_rsi と同じく、差分が NaN の本は上昇幅・下落幅とも 0 として数える
+        delta = price - self.prev_price[rows]
+        self.prev_price[rows] = price
+        self.gain.push(rows, np.where(delta > 0, delta, 0.0))
+        self.loss.push(rows, np.where(delta < 0, -delta, 0.0))
+
+        # ▼ 直近窓から押し出された出来高が、shift(VOLUME_RECENT_WINDOW) した系列の新しい1本になる
+        shifted_volume = self.volume_recent.push(rows, volume)
+        self.volume_past.push(rows, shifted_volume)
+
+        macd = self._ema("short", rows, price, MACD_SHORT) - self._ema("long", rows, price, MACD_LONG)
+        macd_signal = self._ema("signal", rows, macd, MACD_SIGNAL)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rs = self.gain.rolling_mean(rows) / self.loss.rolling_mean(rows)
+            rsi = 100 - (100 / (1 + rs))
+
+        return np.column_stack([
+            self.ma_short.rolling_mean(rows),
+            self.ma_mid.rolling_mean(rows),
+            self.ma_long.rolling_mean(rows),
+            self.std.rolling_std(rows),
+            rsi,
+            macd - macd_signal,
+            self.volume_recent.rolling_mean(rows),
+            self.volume_past.rolling_mean(rows),
+        ])
+
+
+# ▼ 逐次計算の結果を一括計算（pandas と同じ式）と突き合わせてログに出す
+def validate_streaming_indicators(store, since_hhmm=None):
+    codes, names, values, present = store.aligned_window(since_hhmm)
+    expected = compute_indicator_matrix(values, present)
+    _, actual = store.aligned_indicators(since_hhmm)
+
+    # 一括計算は窓の先頭から計算し直すため、窓の前半は逐次計算と一致しない。検出関数が参照する末尾だけを比べる
+    for key in INDICATOR_KEYS:
+        a, b = actual[key][:, -STREAMING_VALIDATE_BARS:], expected[key][:, -STREAMING_VALIDATE_BARS:]
+        nan_mismatch = int((np.isnan(a) != np.isnan(b)).sum())
+        both = ~np.isnan(a) & ~np.isnan(b)
+        diff = np.abs(a[both] - b[both]) / np.maximum(np.abs(b[both]), 1.0) if both.any() else np.zeros(1)
+        max_diff = float(diff.max())
+        # MACD は EMA を持ち越すため、窓を超えた後の差は参考値として表示するだけ
+        ok = key == "MACDヒストグラム" or (nan_mismatch == 0 and max_diff <= STREAMING_VALIDATE_TOLERANCE)
+        mark = "✅" if ok else "⚠️"
+        print(f"{mark} 逐次インジケーター検証 {key}: 最大相対誤差 {max_diff:.2e} / NaN不一致 {nan_mismatch}")
+
+# ▼ ----- 銘柄ごとの特徴量フレーム（インジケーターを1サイクル1回だけ計算して各検出関数で共有） -----
+
+TREND_TAIL = 90  
+CROSS_TAIL = 60  
+# ✅ detect_trend / クロス判定がインジケーターを計算する本数（tail(90) / tail(60)）
+
+
+# ▼ 検出関数ごとの「計算に使う本数 → 必要なインジケーター」（本数が重なったら列名をまとめる）
+def detector_indicator_tails(params=None):
+    params = detector_parameters(params)
+    tails = {}
+    for tail, keys in [
+        (TREND_TAIL, INDICATOR_KEYS),
+        (CROSS_TAIL, ["MA_5", "MA_25", "RSI", "標準偏差"]),
+        (params["DOUBLE_PATTERN_LOOKBACK"], ["標準偏差"]),
+    ]:
+        tails[tail] = tails.get(tail, []) + [key for key in keys if key not in tails.get(tail, [])]
+    return tails
+
+
+class FeatureFrame:
+    """1銘柄ぶんの分足と、検出関数が使うインジケーターを遅延計算・メモ化して保持する。
+
+    features.indicator("MA_5", tail=60) のように参照すると、初回だけ計算して以降は使い回す。
+    rolling の値は計算を始める位置で末尾の桁が変わるため、各検出関数が従来 tail(n) で
+    切り出していた本数ごとに別々に持つ（本数が足りていれば tail は None と同じ扱い）。
+    precomputed に {(列名, tail): 配列} を渡せば、pandas での再計算をせずにその値を使う。
+    インジケーターの期間は params（detector_parameters() の戻り値）のもの。
+    """
+
+    def __init__(self, df_group, precomputed=None, params=None):
+        self.df = df_group
+        self.precomputed = precomputed or {}
+        self.params = detector_parameters(params)
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    # ▼ 元の列（現在値・高値・安値・出来高など）
+    def __getitem__(self, column):
+        return self.df[column]
+
+    def indicator(self, key, tail=None):
+        if tail is not None and tail >= len(self.df):
+            tail = None
+        if (key, tail) not in self.cache:
+            self.cache[(key, tail)] = self._compute(key, tail)
+        return self.cache[(key, tail)]
+
+    def _compute(self, key, tail):
+        df = self.df if tail is None else self.df.tail(tail)
+        if (key, tail) in self.precomputed:
+            return pd.Series(self.precomputed[(key, tail)][-len(df):], index=df.index)
+
+        price = df["現在値"]
+        params = self.params
+        if key == "MA_5":
+            return price.rolling(window=params["MA_SHORT_WINDOW"]).mean()
+        if key == "MA_25":
+            return price.rolling(window=params["MA_MID_WINDOW"]).mean()
+        if key == "MA_60":
+            return price.rolling(window=params["MA_LONG_WINDOW"]).mean()
+        if key == "標準偏差":
+            return price.rolling(window=params["STD_WINDOW"]).std()
+        if key == "RSI":
+            return calculate_rsi(price, period=params["RSI_PERIOD"])
+        if key == "MACDヒストグラム":
+            return calculate_macd_hist(price, params)
+        if key == "出来高平均_直近":
+            return df["出来高"].rolling(window=params["VOLUME_RECENT_WINDOW"]).mean()
+        if key == "出来高平均_過去":
+            return df["出来高"].shift(params["VOLUME_RECENT_WINDOW"]).rolling(window=params["VOLUME_PAST_WINDOW"]).mean()
+        raise KeyError(key)
+
+    # ▼ 末尾からの区間 [start:stop] の平均・標準偏差（同じ区間は1回だけ計算）
+    def window_mean(self, column, start, stop=None):
+        key = ("mean", column, start, stop)
+        if key not in self.cache:
+            self.cache[key] = self.df[column].iloc[start:stop].mean()
+        return self.cache[key]
+
+    def window_std(self, column, start, stop=None):
+        key = ("std", column, start, stop)
+        if key not in self.cache:
+            self.cache[key] = self.df[column].iloc[start:stop].std()
+        return self.cache[key]
+
+
+# ▼ 検出関数には DataFrame と FeatureFrame のどちらでも渡せる
+def as_features(df_group, params=None):
+    return df_group if isinstance(df_group, FeatureFrame) else FeatureFrame(df_group, params=params)
+
+
+INDICATOR_SOURCE = "batch"  
+# ✅ インジケーターの計算元："batch"＝全銘柄一括 / "stream"＝逐次計算 / "pandas"＝銘柄ごとに pandas で計算
+#    "stream" は丸め誤差の範囲で pandas と異なり、MACD は窓を超えて持ち越す（逐次インジケーターの説明を参照）
+
+# ▼ 検出関数が tail(n) で切り出した区間ぶんのインジケーター（{(列名, tail): 2次元配列}）
+def compute_tail_indicators(values, present, params=None):
+    width = values.shape[1]
+    matrices = {}
+    for tail, keys in detector_indicator_tails(params).items():
+        if tail < width:
+            tail_matrices = compute_indicator_matrix(values[:, -tail:], present[:, -tail:], keys=keys, params=params)
+            matrices.update({(key, tail): matrix for key, matrix in tail_matrices.items()})
+    return matrices
+
+
+# ▼ 一括計算で、検出関数ごとの本数ぶんのインジケーターを用意
+def compute_detector_indicators(values, present, params=None):
+    matrices = {(key, None): matrix for key, matrix in compute_indicator_matrix(values, present, params=params).items()}
+    matrices.update(compute_tail_indicators(values, present, params))
+    return matrices
+
+
+# ▼ リングバッファからインジケーターを用意（銘柄コード → {(列名, tail): 配列}。"pandas" なら None）
+#    bar_store を省略すると既定のフィードのもの。インジケーターの期間は params のもの
+def current_indicator_source(bar_store=None, params=None):
+    if bar_store is None:
+        bar_store = get_default_feed().bar_store
+    if INDICATOR_SOURCE == "pandas" or bar_store is None or not bar_store.count:
         return None
+    params = detector_parameters(params)
+    codes, names, values, present = bar_store.aligned_window(bar_store.window_start)
+    # ✅ 逐次計算はモジュールの期間で作ってあるため、期間を変えたフィードでは一括計算に切り替える
+    if INDICATOR_SOURCE == "stream" and bar_store.streaming is not None and not indicator_parameters_changed(params):
+        # ✅ 窓全体は逐次計算の値、tail(n) の区間は計算し始めが変わるため一括計算で求める
+        _, streamed = bar_store.aligned_indicators(bar_store.window_start)
+        matrices = {(key, None): matrix for key, matrix in streamed.items()}
+        matrices.update(compute_tail_indicators(values, present, params))
+    else:
+        matrices = compute_detector_indicators(values, present, params)
+    return {code: {key: matrix[i] for key, matrix in matrices.items()} for i, code in enumerate(codes)}
+
 
-    df["MA_5"] = df["現在値"].rolling(window=MA_SHORT_WINDOW).mean()
-    df["MA_25"] = df["現在値"].rolling(window=MA_MID_WINDOW).mean()
-    df["MA_60"] = df["現在値"].rolling(window=MA_LONG_WINDOW).mean()
-    df["出来高平均_直近"] = df["出来高"].rolling(window=VOLUME_RECENT_WINDOW).mean()
-    df["出来高平均_過去"] = df["出来高"].shift(VOLUME_RECENT_WINDOW).rolling(window=VOLUME_PAST_WINDOW).mean()
-    df["標準偏差"] = df["現在値"].rolling(window=STD_WINDOW).std()
-    df["MACDヒストグラム"] = calculate_macd_hist(df["現在値"])
-    df["RSI"] = calculate_rsi(df["現在値"], period=RSI_PERIOD)
+# ▼ トレンド判定共通関数
+def detect_trend(df_group, trend_type="up", params=None):
+    params = detector_parameters(params)
+    features = as_features(df_group, params)
+    if min(len(features), TREND_TAIL) < params["UPTREND_LOOKBACK"]:
+        return None
 
-    latest = df.iloc[-1]
-    highs = df["高値"].tail(UPTREND_HIGH_LOW_LENGTH).values
-    lows = df["安値"].tail(UPTREND_HIGH_LOW_LENGTH).values
+    price = features["現在値"]
+    ma_5, ma_25 = features.indicator("MA_5", tail=TREND_TAIL), features.indicator("MA_25", tail=TREND_TAIL)
+    latest = {key: features.indicator(key, tail=TREND_TAIL).iloc[-1] for key in INDICATOR_KEYS}
+    latest["現在値"] = price.iloc[-1]
+    highs = features["高値"].tail(params["UPTREND_HIGH_LOW_LENGTH"]).values
+    lows = features["安値"].tail(params["UPTREND_HIGH_LOW_LENGTH"]).values
 
     if trend_type == "up":
         trend_ok = all(x < y for x, y in zip(highs, highs[1:])) and all(x < y for x, y in zip(lows, lows[1:]))
         ma_ok = latest["MA_5"] > latest["MA_25"] > latest["MA_60"]
-        rsi_ok = latest["RSI"] > RSI_UP_THRESHOLD
+        rsi_ok = latest["RSI"] > params["RSI_UP_THRESHOLD"]
         macd_ok = latest["MACDヒストグラム"] > 0
-        trigger_cross = df["MA_5"].iloc[-2] < df["MA_25"].iloc[-2] and df["MA_5"].iloc[-1] > df["MA_25"].iloc[-1]
-        recent_prices = df["現在値"].tail(PULLBACK_LOOKBACK)
+        trigger_cross = ma_5.iloc[-2] < ma_25.iloc[-2] and ma_5.iloc[-1] > ma_25.iloc[-1]
+        recent_prices = price.tail(params["PULLBACK_LOOKBACK"])
         trigger_pullback = recent_prices.min() < recent_prices.iloc[-1] and recent_prices.iloc[-2] < recent_prices.iloc[-1]
     else:
         trend_ok = all(x > y for x, y in zip(highs, highs[1:])) and all(x > y for x, y in zip(lows, lows[1:]))
         ma_ok = latest["MA_5"] < latest["MA_25"] < latest["MA_60"]
-        rsi_ok = latest["RSI"] < RSI_DOWN_THRESHOLD
+        rsi_ok = latest["RSI"] < params["RSI_DOWN_THRESHOLD"]
         macd_ok = latest["MACDヒストグラム"] < 0
-        trigger_cross = df["MA_5"].iloc[-2] > df["MA_25"].iloc[-2] and df["MA_5"].iloc[-1] < df["MA_25"].iloc[-1]
-        recent_prices = df["現在値"].tail(PULLBACK_LOOKBACK)
+        trigger_cross = ma_5.iloc[-2] > ma_25.iloc[-2] and ma_5.iloc[-1] < ma_25.iloc[-1]
+        recent_prices = price.tail(params["PULLBACK_LOOKBACK"])
         trigger_pullback = recent_prices.max() > recent_prices.iloc[-1] and recent_prices.iloc[-2] > recent_prices.iloc[-1]
 
     volume_ok = latest["出来高平均_直近"] > latest["出来高平均_過去"]
-    std_ok = latest["標準偏差"] < VOLATILITY_THRESHOLD
+    std_ok = latest["標準偏差"] < params["VOLATILITY_THRESHOLD"]
 
     if trend_ok and ma_ok and rsi_ok and macd_ok and volume_ok and std_ok and (trigger_cross or trigger_pullback):
         return {
@@ -350,108 +2327,110 @@ def detect_trend(df_group, trend_type="up"):
     return None
 
 # ▼ ラッパー関数（トレンド）
-def detect_uptrend(df_group):
-    return detect_trend(df_group, trend_type="up")
+def detect_uptrend(df_group, params=None):
+    return detect_trend(df_group, trend_type="up", params=params)
 
-def detect_downtrend(df_group):
-    return detect_trend(df_group, trend_type="down")
+def detect_downtrend(df_group, params=None):
+    return detect_trend(df_group, trend_type="down", params=params)
 
-def detect_golden_cross(df_group):
-    df = df_group.tail(60).copy()
-    if len(df) < max(CROSS_SLOPE_LOOKBACK + 2, CROSS_PREV_ORDER_LOOKBACK + 2):
+def detect_golden_cross(df_group, params=None):
+    params = detector_parameters(params)
+    features = as_features(df_group, params)
+    if min(len(features), CROSS_TAIL) < max(params["CROSS_SLOPE_LOOKBACK"] + 2, params["CROSS_PREV_ORDER_LOOKBACK"] + 2):
         return None
 
-    df["MA_5"] = df["現在値"].rolling(window=MA_SHORT_WINDOW).mean()
-    df["MA_25"] = df["現在値"].rolling(window=MA_MID_WINDOW).mean()
-    df["RSI"] = calculate_rsi(df["現在値"], period=RSI_PERIOD)
-    df["標準偏差"] = df["現在値"].rolling(window=STD_WINDOW).std()
+    ma_5 = features.indicator("MA_5", tail=CROSS_TAIL)
+    ma_25 = features.indicator("MA_25", tail=CROSS_TAIL)
+    rsi = features.indicator("RSI", tail=CROSS_TAIL)
 
     volatility_ok = (
-        df["標準偏差"].iloc[-1] < CROSS_VOLATILITY_THRESHOLD
-        if CROSS_USE_VOLATILITY_FILTER else True
+        features.indicator("標準偏差", tail=CROSS_TAIL).iloc[-1] < params["CROSS_VOLATILITY_THRESHOLD"]
+        if params["CROSS_USE_VOLATILITY_FILTER"] else True
     )
 
-    slope_short = df["MA_5"].iloc[-1] - df["MA_5"].iloc[-CROSS_SLOPE_LOOKBACK]
-    slope_mid = df["MA_25"].iloc[-1] - df["MA_25"].iloc[-CROSS_SLOPE_LOOKBACK]
+    slope_short = ma_5.iloc[-1] - ma_5.iloc[-params["CROSS_SLOPE_LOOKBACK"]]
+    slope_mid = ma_25.iloc[-1] - ma_25.iloc[-params["CROSS_SLOPE_LOOKBACK"]]
 
     prev_order_ok = all(
-        df["MA_5"].iloc[-i] < df["MA_25"].iloc[-i]
-        for i in range(2, 2 + CROSS_PREV_ORDER_LOOKBACK)
+        ma_5.iloc[-i] < ma_25.iloc[-i]
+        for i in range(2, 2 + params["CROSS_PREV_ORDER_LOOKBACK"])
     )
 
     rsi_ok = (
-        df["RSI"].iloc[-1] > CROSS_RSI_THRESHOLD_BUY
-        if USE_RSI_FOR_CROSS else True
+        rsi.iloc[-1] > params["CROSS_RSI_THRESHOLD_BUY"]
+        if params["USE_RSI_FOR_CROSS"] else True
     )
 
     if (
-        df["MA_5"].iloc[-2] < df["MA_25"].iloc[-2] and
-        df["MA_5"].iloc[-1] > df["MA_25"].iloc[-1] and
+        ma_5.iloc[-2] < ma_25.iloc[-2] and
+        ma_5.iloc[-1] > ma_25.iloc[-1] and
         slope_short > 0 and slope_mid > 0 and
         prev_order_ok and volatility_ok and rsi_ok
     ):
         return {
             "シグナル": "【買い目】ゴールデンクロス",
-            "現在値": df["現在値"].iloc[-1],
-            "MA_5": round(df["MA_5"].iloc[-1], 2),
-            "MA_25": round(df["MA_25"].iloc[-1], 2),
-            "RSI": round(df["RSI"].iloc[-1], 1)
+            "現在値": features["現在値"].iloc[-1],
+            "MA_5": round(ma_5.iloc[-1], 2),
+            "MA_25": round(ma_25.iloc[-1], 2),
+            "RSI": round(rsi.iloc[-1], 1)
         }
     return None
 
 
 
-def detect_dead_cross(df_group):
-    df = df_group.tail(60).copy()
-    if len(df) < max(CROSS_SLOPE_LOOKBACK + 2, CROSS_PREV_ORDER_LOOKBACK + 2):
+def detect_dead_cross(df_group, params=None):
+    params = detector_parameters(params)
+    features = as_features(df_group, params)
+    if min(len(features), CROSS_TAIL) < max(params["CROSS_SLOPE_LOOKBACK"] + 2, params["CROSS_PREV_ORDER_LOOKBACK"] + 2):
         return None
 
-    df["MA_5"] = df["現在値"].rolling(window=MA_SHORT_WINDOW).mean()
-    df["MA_25"] = df["現在値"].rolling(window=MA_MID_WINDOW).mean()
-    df["RSI"] = calculate_rsi(df["現在値"], period=RSI_PERIOD)
-    df["標準偏差"] = df["現在値"].rolling(window=STD_WINDOW).std()
+    ma_5 = features.indicator("MA_5", tail=CROSS_TAIL)
+    ma_25 = features.indicator("MA_25", tail=CROSS_TAIL)
+    rsi = features.indicator("RSI", tail=CROSS_TAIL)
 
     volatility_ok = (
-        df["標準偏差"].iloc[-1] < CROSS_VOLATILITY_THRESHOLD
-        if CROSS_USE_VOLATILITY_FILTER else True
+        features.indicator("標準偏差", tail=CROSS_TAIL).iloc[-1] < params["CROSS_VOLATILITY_THRESHOLD"]
+        if params["CROSS_USE_VOLATILITY_FILTER"] else True
     )
 
-    slope_short = df["MA_5"].iloc[-1] - df["MA_5"].iloc[-CROSS_SLOPE_LOOKBACK]
-    slope_mid = df["MA_25"].iloc[-1] - df["MA_25"].iloc[-CROSS_SLOPE_LOOKBACK]
+    slope_short = ma_5.iloc[-1] - ma_5.iloc[-params["CROSS_SLOPE_LOOKBACK"]]
+    slope_mid = ma_25.iloc[-1] - ma_25.iloc[-params["CROSS_SLOPE_LOOKBACK"]]
 
     prev_order_ok = all(
-        df["MA_5"].iloc[-i] > df["MA_25"].iloc[-i]
-        for i in range(2, 2 + CROSS_PREV_ORDER_LOOKBACK)
+        ma_5.iloc[-i] > ma_25.iloc[-i]
+        for i in range(2, 2 + params["CROSS_PREV_ORDER_LOOKBACK"])
     )
 
     rsi_ok = (
-        df["RSI"].iloc[-1] < CROSS_RSI_THRESHOLD_SELL
-        if USE_RSI_FOR_CROSS else True
+        rsi.iloc[-1] < params["CROSS_RSI_THRESHOLD_SELL"]
+        if params["USE_RSI_FOR_CROSS"] else True
     )
 
     if (
-        df["MA_5"].iloc[-2] > df["MA_25"].iloc[-2] and
-        df["MA_5"].iloc[-1] < df["MA_25"].iloc[-1] and
+        ma_5.iloc[-2] > ma_25.iloc[-2] and
+        ma_5.iloc[-1] < ma_25.iloc[-1] and
         slope_short < 0 and slope_mid < 0 and
         prev_order_ok and volatility_ok and rsi_ok
     ):
         return {
             "シグナル": "【売り目】デッドクロス",
-            "現在値": df["現在値"].iloc[-1],
-            "MA_5": round(df["MA_5"].iloc[-1], 2),
-            "MA_25": round(df["MA_25"].iloc[-1], 2),
-            "RSI": round(df["RSI"].iloc[-1], 1)
+            "現在値": features["現在値"].iloc[-1],
+            "MA_5": round(ma_5.iloc[-1], 2),
+            "MA_25": round(ma_25.iloc[-1], 2),
+            "RSI": round(rsi.iloc[-1], 1)
         }
     return None
 
 
-def detect_box_breakout(df_group):
-    required_len = BOX_BREAKOUT_LOOKBACK + VOLUME_RECENT_WINDOW + VOLUME_PAST_WINDOW
-    if len(df_group) < required_len:
+def detect_box_breakout(df_group, params=None):
+    params = detector_parameters(params)
+    features = as_features(df_group, params)
+    lookback, recent, past = params["BOX_BREAKOUT_LOOKBACK"], params["VOLUME_RECENT_WINDOW"], params["VOLUME_PAST_WINDOW"]
+    required_len = lookback + recent + past
+    if len(features) < required_len:
         return None
 
-    df = df_group.tail(required_len).copy()
-    price_series = df["現在値"].iloc[-BOX_BREAKOUT_LOOKBACK:]
+    price_series = features["現在値"].iloc[-lookback:]
     current = price_series.iloc[-1]
     high = price_series.max()
     low = price_series.min()
@@ -460,22 +2439,22 @@ def detect_box_breakout(df_group):
         return None
 
     # ブレイク判定（±BOX_BREAKOUT_TOLERANCE）
-    breakout_up = current > high * (1 + BOX_BREAKOUT_TOLERANCE)
-    breakout_down = current < low * (1 - BOX_BREAKOUT_TOLERANCE)
+    breakout_up = current > high * (1 + params["BOX_BREAKOUT_TOLERANCE"])
+    breakout_down = current < low * (1 - params["BOX_BREAKOUT_TOLERANCE"])
 
     # 出来高急増チェック
     volume_ok = True
-    if BOX_BREAKOUT_USE_VOLUME_SPIKE:
-        recent_vol = df["出来高"].iloc[-VOLUME_RECENT_WINDOW:].mean()
-        past_vol = df["出来高"].iloc[-(VOLUME_RECENT_WINDOW + VOLUME_PAST_WINDOW):-VOLUME_RECENT_WINDOW].mean()
-        volume_ok = recent_vol > past_vol * BOX_BREAKOUT_VOLUME_RATIO
+    if params["BOX_BREAKOUT_USE_VOLUME_SPIKE"]:
+        recent_vol = features.window_mean("出来高", -recent)
+        past_vol = features.window_mean("出来高", -(recent + past), -recent)
+        volume_ok = recent_vol > past_vol * params["BOX_BREAKOUT_VOLUME_RATIO"]
 
     # ボラティリティ急増チェック
     volatility_ok = True
-    if BOX_BREAKOUT_USE_VOLATILITY_SPIKE:
-        std_now = price_series.std()
-        std_past = df["現在値"].iloc[-(VOLUME_RECENT_WINDOW + VOLUME_PAST_WINDOW):-VOLUME_RECENT_WINDOW].std()
-        volatility_ok = std_now > std_past * BOX_BREAKOUT_VOLATILITY_RATIO
+    if params["BOX_BREAKOUT_USE_VOLATILITY_SPIKE"]:
+        std_now = features.window_std("現在値", -lookback)
+        std_past = features.window_std("現在値", -(recent + past), -recent)
+        volatility_ok = std_now > std_past * params["BOX_BREAKOUT_VOLATILITY_RATIO"]
 
     if breakout_up and volume_ok and volatility_ok:
         return {
@@ -494,31 +2473,33 @@ def detect_box_breakout(df_group):
 
 
 
-def detect_breakout(df_group):
-    required_len = BREAKOUT_LOOKBACK + VOLUME_RECENT_WINDOW + VOLUME_PAST_WINDOW
-    if len(df_group) < required_len:
+def detect_breakout(df_group, params=None):
+    params = detector_parameters(params)
+    features = as_features(df_group, params)
+    lookback = params["BREAKOUT_LOOKBACK"]
+    required_len = lookback + params["VOLUME_RECENT_WINDOW"] + params["VOLUME_PAST_WINDOW"]
+    if len(features) < required_len:
         return None
 
-    df = df_group.tail(required_len).copy()
-    price_series = df["現在値"]
-    volume_series = df["出来高"]
+    price_series = features["現在値"]
+    volume_series = features["出来高"]
     current = price_series.iloc[-1]
 
     # 高値・安値ブレイク判定
-    high_max = df["高値"].iloc[-(BREAKOUT_LOOKBACK+1):-1].max()
-    low_min = df["安値"].iloc[-(BREAKOUT_LOOKBACK+1):-1].min()
+    high_max = features["高値"].iloc[-(lookback+1):-1].max()
+    low_min = features["安値"].iloc[-(lookback+1):-1].min()
 
     # 出来高急増チェック
     recent_volume = volume_series.iloc[-1]
-    avg_volume = volume_series.iloc[-(BREAKOUT_LOOKBACK+1):-1].mean()
-    volume_ok = recent_volume > avg_volume * BREAKOUT_VOLUME_RATIO
+    avg_volume = features.window_mean("出来高", -(lookback+1), -1)
+    volume_ok = recent_volume > avg_volume * params["BREAKOUT_VOLUME_RATIO"]
 
     # ボラティリティ急増チェック
     volatility_ok = True
-    if BREAKOUT_USE_VOLATILITY_SPIKE:
-        std_now = price_series.iloc[-BREAKOUT_LOOKBACK:].std()
-        std_past = price_series.iloc[-(BREAKOUT_LOOKBACK + VOLUME_PAST_WINDOW):-BREAKOUT_LOOKBACK].std()
-        volatility_ok = std_now > std_past * BREAKOUT_VOLATILITY_RATIO
+    if params["BREAKOUT_USE_VOLATILITY_SPIKE"]:
+        std_now = features.window_std("現在値", -lookback)
+        std_past = features.window_std("現在値", -(lookback + params["VOLUME_PAST_WINDOW"]), -lookback)
+        volatility_ok = std_now > std_past * params["BREAKOUT_VOLATILITY_RATIO"]
 
     # 判定
     if current > high_max and volume_ok and volatility_ok:
@@ -537,36 +2518,58 @@ def detect_breakout(df_group):
     return None
 
 
+# ▼ 山と谷の位置（1階差分の符号が + → - なら山、- → + なら谷。行ごとに独立して判定）
+def find_local_extrema(highs, lows):
+    high_diff = np.diff(highs, axis=-1)
+    low_diff = np.diff(lows, axis=-1)
+    peaks = np.zeros(highs.shape, dtype=bool)
+    valleys = np.zeros(lows.shape, dtype=bool)
+    peaks[..., 1:-1] = (high_diff[..., :-1] > 0) & (high_diff[..., 1:] < 0)
+    valleys[..., 1:-1] = (low_diff[..., :-1] < 0) & (low_diff[..., 1:] > 0)
+    return peaks, valleys
+
+
+# ▼ 行ごとに True の最後の2か所（足りなければ -1）
+def last_two_indices(mask):
+    positions = np.arange(mask.shape[-1])
+    last = np.where(mask, positions, -1).max(axis=-1, initial=-1)
+    before_last = np.where(mask & (positions < last[..., None]), positions, -1).max(axis=-1, initial=-1)
+    return before_last, last
+
+
 # ▼ ダブルトップ・ボトム検出（ピーク自動判定付き）
-def detect_double_pattern(df_group):
-    if len(df_group) < DOUBLE_PATTERN_LOOKBACK:
+def detect_double_pattern(df_group, params=None):
+    params = detector_parameters(params)
+    features = as_features(df_group, params)
+    lookback = params["DOUBLE_PATTERN_LOOKBACK"]
+    if len(features) < lookback:
         return None
 
-    df = df_group.tail(DOUBLE_PATTERN_LOOKBACK).copy()
-    price = df["現在値"].iloc[-1]
-    highs = df["高値"].values
-    lows = df["安値"].values
-    volumes = df["出来高"].values
-    std_series = df["現在値"].rolling(window=STD_WINDOW).std()
+    price = features["現在値"].iloc[-1]
+    highs = features["高値"].values[-lookback:]
+    lows = features["安値"].values[-lookback:]
+    volumes = features["出来高"].values[-lookback:]
+
+    std_series = features.indicator("標準偏差", tail=lookback)
     std_now = std_series.iloc[-1]
     std_avg = std_series.mean()
+    volume_avg = features.window_mean("出来高", -lookback)
 
-    peaks_high = [i for i in range(1, len(highs)-1) if highs[i-1] < highs[i] > highs[i+1]]
-    valleys_low = [i for i in range(1, len(lows)-1) if lows[i-1] > lows[i] < lows[i+1]]
+    peaks_high, valleys_low = find_local_extrema(highs, lows)
+    peaks_high, valleys_low = np.flatnonzero(peaks_high), np.flatnonzero(valleys_low)
 
     # ▼ ダブルトップ検出
-    if len(peaks_high) >= DOUBLE_PATTERN_MIN_PEAKS:
+    if len(peaks_high) >= params["DOUBLE_PATTERN_MIN_PEAKS"]:
         i1, i2 = peaks_high[-2], peaks_high[-1]
         high1, high2 = highs[i1], highs[i2]
         mid_low = lows[min(i1+1, i2-1):max(i1, i2)].min()
-        volume_avg = df["出来高"].mean()
 
         price_diff_ratio = abs(high1 - high2) / high1
-        volume_spike = volumes[i1] > volume_avg * DOUBLE_PATTERN_VOLUME_SPIKE_RATIO and \
-                       volumes[i2] > volume_avg * DOUBLE_PATTERN_VOLUME_SPIKE_RATIO
-        volatility_jump = std_now > std_avg * DOUBLE_PATTERN_VOLATILITY_RATIO if DOUBLE_PATTERN_VOLATILITY_JUMP else True
+        volume_spike = volumes[i1] > volume_avg * params["DOUBLE_PATTERN_VOLUME_SPIKE_RATIO"] and \
+                       volumes[i2] > volume_avg * params["DOUBLE_PATTERN_VOLUME_SPIKE_RATIO"]
+        volatility_jump = std_now > std_avg * params["DOUBLE_PATTERN_VOLATILITY_RATIO"] if params["DOUBLE_PATTERN_VOLATILITY_JUMP"] else True
 
-        if price_diff_ratio < DOUBLE_PATTERN_TOLERANCE and price < mid_low and volume_spike and volatility_jump:
+        if price_diff_ratio < params["DOUBLE_PATTERN_TOLERANCE"] and price < mid_low and volume_spike and volatility_jump:
             return {
                 "シグナル": "【売り目】ダブルトップ",
                 "現在値": price,
@@ -578,18 +2581,17 @@ def detect_double_pattern(df_group):
             }
 
     # ▼ ダブルボトム検出
-    if len(valleys_low) >= DOUBLE_PATTERN_MIN_PEAKS:
+    if len(valleys_low) >= params["DOUBLE_PATTERN_MIN_PEAKS"]:
         i1, i2 = valleys_low[-2], valleys_low[-1]
         low1, low2 = lows[i1], lows[i2]
         mid_high = highs[min(i1+1, i2-1):max(i1, i2)].max()
-        volume_avg = df["出来高"].mean()
 
         price_diff_ratio = abs(low1 - low2) / low1
-        volume_spike = volumes[i1] > volume_avg * DOUBLE_PATTERN_VOLUME_SPIKE_RATIO and \
-                       volumes[i2] > volume_avg * DOUBLE_PATTERN_VOLUME_SPIKE_RATIO
-        volatility_jump = std_now > std_avg * DOUBLE_PATTERN_VOLATILITY_RATIO if DOUBLE_PATTERN_VOLATILITY_JUMP else True
+        volume_spike = volumes[i1] > volume_avg * params["DOUBLE_PATTERN_VOLUME_SPIKE_RATIO"] and \
+                       volumes[i2] > volume_avg * params["DOUBLE_PATTERN_VOLUME_SPIKE_RATIO"]
+        volatility_jump = std_now > std_avg * params["DOUBLE_PATTERN_VOLATILITY_RATIO"] if params["DOUBLE_PATTERN_VOLATILITY_JUMP"] else True
 
-        if price_diff_ratio < DOUBLE_PATTERN_TOLERANCE and price > mid_high and volume_spike and volatility_jump:
+        if price_diff_ratio < params["DOUBLE_PATTERN_TOLERANCE"] and price > mid_high and volume_spike and volatility_jump:
             return {
                 "シグナル": "【買い目】ダブルボトム",
                 "現在値": price,
@@ -606,9 +2608,703 @@ def detect_double_pattern(df_group):
 
 
 
+# ▼ ----- 全銘柄一括のシグナル判定（銘柄 × 時刻の配列に対するブール配列） -----
+
+DETECTOR_MODE = "vectorized"  
+# ✅ シグナル判定方式："vectorized"＝全銘柄を配列でまとめて判定 / "per_symbol"＝銘柄ごとに detect_* を呼ぶ
+
+CROSS_PREFILTER_MARGIN = 1e-6  
+# ✅ クロスの事前条件で、単純平均の差がこの比率（現在値に対して）以内なら入れ替わりとみなして通す
+
+
+# ▼ 縦持ちの分足（銘柄コード → 時刻順）を、末尾が最新の（銘柄 × 本数）配列に並べ替える
+def frame_to_aligned_window(df, max_bars=TREND_TAIL):
+    codes_col = df["銘柄コード"].to_numpy()
+    order = np.argsort(codes_col, kind="stable")
+    codes, first, counts = np.unique(codes_col[order], return_index=True, return_counts=True)
+    width = int(counts.max()) if len(counts) else 0
+
+    group = np.repeat(np.arange(len(codes)), counts)
+    pos = np.arange(len(order)) - np.repeat(first, counts) + (width - np.repeat(counts, counts))
+    values = np.full((len(codes), width, len(BAR_FIELDS)), np.nan)
+    present = np.zeros((len(codes), width), dtype=bool)
+    values[group, pos] = df.reindex(columns=BAR_FIELDS).to_numpy(dtype=float)[order]
+    present[group, pos] = True
+    names = df["銘柄名称"].to_numpy()[order][first + counts - 1]
+
+    # detect_trend の tail(TREND_TAIL) と同じく、末尾 max_bars 本だけを使う
+    return codes, names, values[:, -max_bars:], present[:, -max_bars:]
+
+
+# ▼ 末尾から i 本目の列（本数が足りなければ NaN）
+def last_col(matrix, i=1):
+    if matrix.shape[1] < i:
+        return np.full(matrix.shape[0], np.nan)
+    return matrix[:, -i]
+
+
+# ▼ 末尾からの区間 [start:stop] の列（NaN を無視する集計用）
+def tail_cols(matrix, start, stop=None):
+    width = matrix.shape[1]
+    begin = max(width + start, 0)
+    end = width if stop is None else max(width + stop, 0)
+    return matrix[:, begin:end]
+
+
+# ▼ NaN を無視した集計（pandas の Series.mean()/std()/max()/min() と同じ扱い）
+def nan_stat(func, matrix, **kwargs):
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if matrix.shape[1] == 0:
+            return np.full(matrix.shape[0], np.nan)
+        return func(matrix, axis=1, **kwargs)
+
+
+# ▼ 上昇 / 下降トレンド（detect_trend の一括版）
+def trend_masks(prices, highs, lows, ind, lengths, params=None):
+    params = detector_parameters(params)
+    len_ok = np.minimum(lengths, TREND_TAIL) >= params["UPTREND_LOOKBACK"]
+    h = tail_cols(highs, -params["UPTREND_HIGH_LOW_LENGTH"])
+    l = tail_cols(lows, -params["UPTREND_HIGH_LOW_LENGTH"])
+    ma_5, ma_25, ma_60 = last_col(ind["MA_5"]), last_col(ind["MA_25"]), last_col(ind["MA_60"])
+    ma_5_prev, ma_25_prev = last_col(ind["MA_5"], 2), last_col(ind["MA_25"], 2)
+    recent = tail_cols(prices, -params["PULLBACK_LOOKBACK"])
+    current, prev = last_col(prices), last_col(prices, 2)
+    volume_ok = last_col(ind["出来高平均_直近"]) > last_col(ind["出来高平均_過去"])
+    std_ok = last_col(ind["標準偏差"]) < params["VOLATILITY_THRESHOLD"]
+    rsi, macd = last_col(ind["RSI"]), last_col(ind["MACDヒストグラム"])
+
+    up = (
+        len_ok & np.all(np.diff(h, axis=1) > 0, axis=1) & np.all(np.diff(l, axis=1) > 0, axis=1)
+        & (ma_5 > ma_25) & (ma_25 > ma_60) & (rsi > params["RSI_UP_THRESHOLD"]) & (macd > 0)
+        & volume_ok & std_ok
+    )
+    up_cross = (ma_5_prev < ma_25_prev) & (ma_5 > ma_25)
+    up &= up_cross | ((nan_stat(np.nanmin, recent) < current) & (prev < current))
+
+    down = (
+        len_ok & np.all(np.diff(h, axis=1) < 0, axis=1) & np.all(np.diff(l, axis=1) < 0, axis=1)
+        & (ma_5 < ma_25) & (ma_25 < ma_60) & (rsi < params["RSI_DOWN_THRESHOLD"]) & (macd < 0)
+        & volume_ok & std_ok
+    )
+    down_cross = (ma_5_prev > ma_25_prev) & (ma_5 < ma_25)
+    down &= down_cross | ((nan_stat(np.nanmax, recent) > current) & (prev > current))
+    return up, up_cross, down, down_cross
+
+
+# ▼ ゴールデン / デッドクロス（detect_golden_cross / detect_dead_cross の一括版）
+def cross_masks(ind, lengths, params=None):
+    params = detector_parameters(params)
+    len_ok = np.minimum(lengths, CROSS_TAIL) >= max(params["CROSS_SLOPE_LOOKBACK"] + 2, params["CROSS_PREV_ORDER_LOOKBACK"] + 2)
+    ma_5, ma_25 = ind["MA_5"], ind["MA_25"]
+    volatility_ok = last_col(ind["標準偏差"]) < params["CROSS_VOLATILITY_THRESHOLD"] if params["CROSS_USE_VOLATILITY_FILTER"] else True
+    slope_short = last_col(ma_5) - last_col(ma_5, params["CROSS_SLOPE_LOOKBACK"])
+    slope_mid = last_col(ma_25) - last_col(ma_25, params["CROSS_SLOPE_LOOKBACK"])
+    prev_5 = np.column_stack([last_col(ma_5, i) for i in range(2, 2 + params["CROSS_PREV_ORDER_LOOKBACK"])])
+    prev_25 = np.column_stack([last_col(ma_25, i) for i in range(2, 2 + params["CROSS_PREV_ORDER_LOOKBACK"])])
+    rsi = last_col(ind["RSI"])
+
+    golden = (
+        len_ok & (last_col(ma_5, 2) < last_col(ma_25, 2)) & (last_col(ma_5) > last_col(ma_25))
+        & (slope_short > 0) & (slope_mid > 0) & np.all(prev_5 < prev_25, axis=1) & volatility_ok
+        & ((rsi > params["CROSS_RSI_THRESHOLD_BUY"]) if params["USE_RSI_FOR_CROSS"] else True)
+    )
+    dead = (
+        len_ok & (last_col(ma_5, 2) > last_col(ma_25, 2)) & (last_col(ma_5) < last_col(ma_25))
+        & (slope_short < 0) & (slope_mid < 0) & np.all(prev_5 > prev_25, axis=1) & volatility_ok
+        & ((rsi < params["CROSS_RSI_THRESHOLD_SELL"]) if params["USE_RSI_FOR_CROSS"] else True)
+    )
+    return golden, dead
+
+
+# ▼ ボックス上抜け / 下抜け（detect_box_breakout の一括版）
+def box_breakout_masks(prices, volumes, lengths, params=None):
+    params = detector_parameters(params)
+    lookback, recent, past = params["BOX_BREAKOUT_LOOKBACK"], params["VOLUME_RECENT_WINDOW"], params["VOLUME_PAST_WINDOW"]
+    required_len = lookback + recent + past
+    window = tail_cols(prices, -lookback)
+    current = last_col(prices)
+    high, low = nan_stat(np.nanmax, window), nan_stat(np.nanmin, window)
+    base = (lengths >= required_len) & ~(high - low == 0)
+
+    volume_ok = True
+    if params["BOX_BREAKOUT_USE_VOLUME_SPIKE"]:
+        recent_vol = nan_stat(np.nanmean, tail_cols(volumes, -recent))
+        past_vol = nan_stat(np.nanmean, tail_cols(volumes, -(recent + past), -recent))
+        volume_ok = recent_vol > past_vol * params["BOX_BREAKOUT_VOLUME_RATIO"]
+
+    volatility_ok = True
+    if params["BOX_BREAKOUT_USE_VOLATILITY_SPIKE"]:
+        std_now = nan_stat(np.nanstd, window, ddof=1)
+        std_past = nan_stat(np.nanstd, tail_cols(prices, -(recent + past), -recent), ddof=1)
+        volatility_ok = std_now > std_past * params["BOX_BREAKOUT_VOLATILITY_RATIO"]
+
+    ok = base & volume_ok & volatility_ok
+    up = ok & (current > high * (1 + params["BOX_BREAKOUT_TOLERANCE"]))
+    down = ok & ~up & (current < low * (1 - params["BOX_BREAKOUT_TOLERANCE"]))
+    return up, down, high, low
+
+
+# ▼ ブレイクアウト（detect_breakout の一括版）
+def breakout_masks(prices, highs, lows, volumes, lengths, params=None):
+    params = detector_parameters(params)
+    lookback = params["BREAKOUT_LOOKBACK"]
+    required_len = lookback + params["VOLUME_RECENT_WINDOW"] + params["VOLUME_PAST_WINDOW"]
+    current = last_col(prices)
+    high_max = nan_stat(np.nanmax, tail_cols(highs, -(lookback + 1), -1))
+    low_min = nan_stat(np.nanmin, tail_cols(lows, -(lookback + 1), -1))
+    avg_volume = nan_stat(np.nanmean, tail_cols(volumes, -(lookback + 1), -1))
+    volume_ok = last_col(volumes) > avg_volume * params["BREAKOUT_VOLUME_RATIO"]
+
+    volatility_ok = True
+    if params["BREAKOUT_USE_VOLATILITY_SPIKE"]:
+        std_now = nan_stat(np.nanstd, tail_cols(prices, -lookback), ddof=1)
+        std_past = nan_stat(np.nanstd, tail_cols(prices, -(lookback + params["VOLUME_PAST_WINDOW"]), -lookback), ddof=1)
+        volatility_ok = std_now > std_past * params["BREAKOUT_VOLATILITY_RATIO"]
+
+    ok = (lengths >= required_len) & volume_ok & volatility_ok
+    up = ok & (current > high_max)
+    down = ok & ~up & (current < low_min)
+    return up, down, high_max, low_min
+
+
+# ▼ ダブルトップ / ボトム（detect_double_pattern の一括版。std は tail(DOUBLE_PATTERN_LOOKBACK) で計算した標準偏差）
+def double_pattern_masks(prices, highs, lows, volumes, std, lengths, params=None):
+    params = detector_parameters(params)
+    rows = np.arange(len(lengths))
+    lookback = params["DOUBLE_PATTERN_LOOKBACK"]
+    ok = lengths >= lookback
+    current = last_col(prices)
+    h = np.ascontiguousarray(tail_cols(highs, -lookback))
+    l = np.ascontiguousarray(tail_cols(lows, -lookback))
+    v = np.ascontiguousarray(tail_cols(volumes, -lookback))
+    std = tail_cols(std, -lookback)
+    if h.shape[1] < lookback:
+        empty = np.zeros(len(lengths), dtype=bool)
+        return empty, empty, {}
+
+    std_now = last_col(std)
+    std_avg = nan_stat(np.nanmean, std)
+    volume_avg = nan_stat(np.nanmean, v)
+    if params["DOUBLE_PATTERN_VOLATILITY_JUMP"]:
+        volatility_jump = std_now > std_avg * params["DOUBLE_PATTERN_VOLATILITY_RATIO"]
+    else:
+        volatility_jump = np.ones(len(lengths), dtype=bool)
+
+    peaks, valleys = find_local_extrema(h, l)
+    positions = np.arange(lookback)
+
+    # ▼ 直近2つの山（谷）の値・その間の安値の最小（高値の最大）＝ネックライン・出来高急増を配列でまとめて求める
+    def pattern(mask, edge, between, reduce, fill):
+        i1, i2 = last_two_indices(mask)
+        enough = ok & (mask.sum(axis=1) >= params["DOUBLE_PATTERN_MIN_PEAKS"])
+        i1, i2 = np.where(enough, i1, 0), np.where(enough, i2, 0)
+        first, second = edge[rows, i1], edge[rows, i2]
+        inside = (positions > i1[:, None]) & (positions < i2[:, None])
+        neckline = reduce(np.where(inside, between, fill), axis=1)
+        neckline[(inside & np.isnan(between)).any(axis=1)] = np.nan  # ndarray.min()/max() と同じく NaN を伝播
+        with np.errstate(invalid="ignore", divide="ignore"):
+            similar = np.abs(first - second) / first < params["DOUBLE_PATTERN_TOLERANCE"]
+        spike = (v[rows, i1] > volume_avg * params["DOUBLE_PATTERN_VOLUME_SPIKE_RATIO"]) & \
+                (v[rows, i2] > volume_avg * params["DOUBLE_PATTERN_VOLUME_SPIKE_RATIO"])
+        return enough & similar & spike & volatility_jump, first, second, neckline
+
+    top, high1, high2, mid_low = pattern(peaks, h, l, np.min, np.inf)
+    bottom, low1, low2, mid_high = pattern(valleys, l, h, np.max, -np.inf)
+    with np.errstate(invalid="ignore"):
+        top &= current < mid_low
+        bottom &= ~top & (current > mid_high)
+
+    detail = {
+        "high1": high1, "high2": high2, "mid_low": mid_low,
+        "low1": low1, "low2": low2, "mid_high": mid_high,
+        "volatility_jump": volatility_jump,
+    }
+    return top, bottom, detail
+
+
+# ▼ ----- 検出関数の登録表（必要本数・安い事前条件・優先順・重さ） -----
+
+# ▼ 一括判定・事前条件で使う分足の配列（末尾が最新。"本数" は銘柄ごとの本数）
+def window_bars(values, present):
+    bars = {f: np.ascontiguousarray(values[:, :, BAR_FIELDS.index(f)]) for f in ["現在値", "高値", "安値", "出来高"]}
+    bars["本数"] = present.sum(axis=1)
+    return bars
+
+
+def take_rows(bars, rows):
+    return {key: matrix[rows] for key, matrix in bars.items()}
+
+
+# ▼ 上昇 / 下降トレンドの事前条件：直近の高値・安値が切り上がっている（切り下がっている）
+def trend_prefilter(bars, trend_type, params=None):
+    params = detector_parameters(params)
+    h = np.diff(tail_cols(bars["高値"], -params["UPTREND_HIGH_LOW_LENGTH"]), axis=1)
+    l = np.diff(tail_cols(bars["安値"], -params["UPTREND_HIGH_LOW_LENGTH"]), axis=1)
+    if trend_type == "up":
+        return np.all(h > 0, axis=1) & np.all(l > 0, axis=1)
+    return np.all(h < 0, axis=1) & np.all(l < 0, axis=1)
+
+
+# ▼ ゴールデン / デッドクロスの事前条件：単純平均で見て MA_5 と MA_25 の上下が直近1本で入れ替わっている
+def cross_prefilter(bars, cross_type, params=None):
+    params = detector_parameters(params)
+    prices = bars["現在値"]
+    short, mid = params["MA_SHORT_WINDOW"], params["MA_MID_WINDOW"]
+    with np.errstate(invalid="ignore"):
+        gap_now = tail_cols(prices, -short).mean(axis=1) - tail_cols(prices, -mid).mean(axis=1)
+        gap_prev = tail_cols(prices, -(short + 1), -1).mean(axis=1) - tail_cols(prices, -(mid + 1), -1).mean(axis=1)
+        # ✅ rolling の計算とは末尾の桁が違うため、境界付近（CROSS_PREFILTER_MARGIN 以内）は通す
+        margin = np.abs(last_col(prices)) * CROSS_PREFILTER_MARGIN
+        if cross_type == "golden":
+            return (gap_prev < margin) & (gap_now > -margin)
+        return (gap_prev > -margin) & (gap_now < margin)
+
+
+# ▼ ボックス上抜け / 下抜けの事前条件：現在値がボックスの上限・下限を許容比率ぶん超えている
+def box_breakout_prefilter(bars, params=None):
+    params = detector_parameters(params)
+    window = tail_cols(bars["現在値"], -params["BOX_BREAKOUT_LOOKBACK"])
+    current = last_col(bars["現在値"])
+    high, low = nan_stat(np.nanmax, window), nan_stat(np.nanmin, window)
+    with np.errstate(invalid="ignore"):
+        return ~(high - low == 0) & (
+            (current > high * (1 + params["BOX_BREAKOUT_TOLERANCE"])) | (current < low * (1 - params["BOX_BREAKOUT_TOLERANCE"]))
+        )
+
+
+# ▼ ブレイクアウトの事前条件：現在値が直前 BREAKOUT_LOOKBACK 本の高値を上抜け / 安値を下抜けている
+def breakout_prefilter(bars, params=None):
+    params = detector_parameters(params)
+    current = last_col(bars["現在値"])
+    high_max = nan_stat(np.nanmax, tail_cols(bars["高値"], -(params["BREAKOUT_LOOKBACK"] + 1), -1))
+    low_min = nan_stat(np.nanmin, tail_cols(bars["安値"], -(params["BREAKOUT_LOOKBACK"] + 1), -1))
+    with np.errstate(invalid="ignore"):
+        return (current > high_max) | (current < low_min)
+
+
+# ▼ ダブルトップ / ボトムの事前条件：山か谷が DOUBLE_PATTERN_MIN_PEAKS 個以上ある
+def double_pattern_prefilter(bars, params=None):
+    params = detector_parameters(params)
+    lookback = params["DOUBLE_PATTERN_LOOKBACK"]
+    peaks, valleys = find_local_extrema(tail_cols(bars["高値"], -lookback), tail_cols(bars["安値"], -lookback))
+    return (peaks.sum(axis=1) >= params["DOUBLE_PATTERN_MIN_PEAKS"]) | (valleys.sum(axis=1) >= params["DOUBLE_PATTERN_MIN_PEAKS"])
+
+
+# ▼ 一括判定（detect_* と同じ条件。params は detector_parameters() で解決済みの閾値）。[(当たりのブール配列, 行番号 → 出力の dict)] を返す
+def trend_signals(bars, ind, trend_type, params):
+    trend = {key: ind[(key, None)] for key in INDICATOR_KEYS}
+    up, up_cross, down, down_cross = trend_masks(bars["現在値"], bars["高値"], bars["安値"], trend, bars["本数"], params)
+    mask, trigger = (up, up_cross) if trend_type == "up" else (down, down_cross)
+    latest = {key: last_col(matrix) for key, matrix in trend.items()}
+    current = last_col(bars["現在値"])
+
+    def row(j):
+        return {
+            "シグナル": "【買い目】上昇トレンド" if trend_type == "up" else "【売り目】下降トレンド",
+            "現在値": current[j],
+            "MA_5": round(latest["MA_5"][j], 2),
+            "MA_25": round(latest["MA_25"][j], 2),
+            "MA_60": round(latest["MA_60"][j], 2),
+            "MACDヒストグラム": round(latest["MACDヒストグラム"][j], 4),
+            "RSI": round(latest["RSI"][j], 1),
+            "標準偏差": round(latest["標準偏差"][j], 4),
+            "出来高平均_直近": round(latest["出来高平均_直近"][j], 2),
+            "出来高平均_過去": round(latest["出来高平均_過去"][j], 2),
+            "出来高勢い": "増加" if latest["出来高平均_直近"][j] > latest["出来高平均_過去"][j] else "弱含み",
+            "トリガー": "クロス" if trigger[j] else "戻り"
+        }
+    return [(mask, row)]
+
+
+def cross_signals(bars, ind, cross_type, params):
+    golden, dead = cross_masks({key: ind[(key, CROSS_TAIL)] for key in detector_indicator_tails(params)[CROSS_TAIL]}, bars["本数"], params)
+    latest = {key: last_col(ind[(key, None)]) for key in ["MA_5", "MA_25", "RSI"]}
+    current = last_col(bars["現在値"])
+
+    def row(j):
+        return {
+            "シグナル": "【買い目】ゴールデンクロス" if cross_type == "golden" else "【売り目】デッドクロス",
+            "現在値": current[j],
+            "MA_5": round(latest["MA_5"][j], 2),
+            "MA_25": round(latest["MA_25"][j], 2),
+            "RSI": round(latest["RSI"][j], 1)
+        }
+    return [(golden if cross_type == "golden" else dead, row)]
+
+
+def box_breakout_signals(bars, ind, params):
+    up, down, high, low = box_breakout_masks(bars["現在値"], bars["出来高"], bars["本数"], params)
+    current = last_col(bars["現在値"])
+    return [
+        (up, lambda j: {"シグナル": "【買い目】ボックス上抜け", "現在値": current[j], "上限ブレイク基準": round(high[j], 2)}),
+        (down, lambda j: {"シグナル": "【売り目】ボックス下抜け", "現在値": current[j], "下限ブレイク基準": round(low[j], 2)}),
+    ]
+
+
+def breakout_signals(bars, ind, params):
+    up, down, high_max, low_min = breakout_masks(bars["現在値"], bars["高値"], bars["安値"], bars["出来高"], bars["本数"], params)
+    current = last_col(bars["現在値"])
+    return [
+        (up, lambda j: {"シグナル": "【買い目】ブレイクアウト", "現在値": current[j], "高値上抜け基準": round(high_max[j], 2)}),
+        (down, lambda j: {"シグナル": "【売り目】ブレイクアウト", "現在値": current[j], "安値下抜け基準": round(low_min[j], 2)}),
+    ]
+
+
+def double_pattern_signals(bars, ind, params):
+    top, bottom, double = double_pattern_masks(
+        bars["現在値"], bars["高値"], bars["安値"], bars["出来高"],
+        ind[("標準偏差", params["DOUBLE_PATTERN_LOOKBACK"])], bars["本数"], params
+    )
+    current = last_col(bars["現在値"])
+
+    def top_row(j):
+        return {
+            "シグナル": "【売り目】ダブルトップ",
+            "現在値": current[j],
+            "ネックライン": round(double["mid_low"][j], 2),
+            "高値1": round(double["high1"][j], 2),
+            "高値2": round(double["high2"][j], 2),
+            "出来高急増": True,
+            "ボラ急増": double["volatility_jump"][j]
+        }
+
+    def bottom_row(j):
+        return {
+            "シグナル": "【買い目】ダブルボトム",
+            "現在値": current[j],
+            "ネックライン": round(double["mid_high"][j], 2),
+            "安値1": round(double["low1"][j], 2),
+            "安値2": round(double["low2"][j], 2),
+            "出来高急増": True,
+            "ボラ急増": double["volatility_jump"][j]
+        }
+    return [(top, top_row), (bottom, bottom_row)]
+
+
+class SignalDetector:
+    """検出関数1つぶんの登録情報（銘柄ごとの判定と一括判定の両方がこれを見る）。
+
+    lookback(params): 判定に必要な最低本数を返す関数（本数も params で変えられるため関数で持つ）
+    prefilter(bars, params): 全銘柄の配列に対する安い必要条件。False の銘柄ではこの検出関数は必ず外れる
+    priority: 採用の優先順（小さいほど優先。複数当たったら最小のものを採用）
+    cost: 1銘柄あたりの相対的な重さ（銘柄ごとの判定では軽いものから評価する）
+    indicators(params): 一括判定で使うインジケーターを返す関数（{tail: [列名]}。None は窓全体）
+    vector(bars, ind, params): 一括判定。[(当たりのブール配列, 行番号 → 出力の dict)] を返す
+    各関数の params は検出の設定値（detector_parameters() の戻り値）
+    """
+
+    def __init__(self, detect, signals, priority, cost, lookback, prefilter, indicators, vector):
+        self.detect = detect
+        self.name = detect.__name__
+        self.signals = signals
+        self.priority = priority
+        self.cost = cost
+        self.lookback = lookback
+        self.prefilter = prefilter
+        self.indicators = indicators
+        self.vector = vector
+
+
+# ▼ 検出関数の登録表（priority の順が従来の first-match の順。cost は detect_trend の MACD 等が最も重い）
+SIGNAL_DETECTORS = [
+    SignalDetector(
+        detect_uptrend, ["【買い目】上昇トレンド"], priority=0, cost=5,
+        lookback=lambda params: params["UPTREND_LOOKBACK"],
+        prefilter=lambda bars, params: trend_prefilter(bars, "up", params),
+        indicators=lambda params: {None: INDICATOR_KEYS},
+        vector=lambda bars, ind, params: trend_signals(bars, ind, "up", params),
+    ),
+    SignalDetector(
+        detect_downtrend, ["【売り目】下降トレンド"], priority=1, cost=5,
+        lookback=lambda params: params["UPTREND_LOOKBACK"],
+        prefilter=lambda bars, params: trend_prefilter(bars, "down", params),
+        indicators=lambda params: {None: INDICATOR_KEYS},
+        vector=lambda bars, ind, params: trend_signals(bars, ind, "down", params),
+    ),
+    SignalDetector(
+        detect_golden_cross, ["【買い目】ゴールデンクロス"], priority=2, cost=4,
+        lookback=lambda params: max(params["CROSS_SLOPE_LOOKBACK"] + 2, params["CROSS_PREV_ORDER_LOOKBACK"] + 2),
+        prefilter=lambda bars, params: cross_prefilter(bars, "golden", params),
+        indicators=lambda params: {CROSS_TAIL: detector_indicator_tails(params)[CROSS_TAIL], None: ["MA_5", "MA_25", "RSI"]},
+        vector=lambda bars, ind, params: cross_signals(bars, ind, "golden", params),
+    ),
+    SignalDetector(
+        detect_dead_cross, ["【売り目】デッドクロス"], priority=3, cost=4,
+        lookback=lambda params: max(params["CROSS_SLOPE_LOOKBACK"] + 2, params["CROSS_PREV_ORDER_LOOKBACK"] + 2),
+        prefilter=lambda bars, params: cross_prefilter(bars, "dead", params),
+        indicators=lambda params: {CROSS_TAIL: detector_indicator_tails(params)[CROSS_TAIL], None: ["MA_5", "MA_25", "RSI"]},
+        vector=lambda bars, ind, params: cross_signals(bars, ind, "dead", params),
+    ),
+    SignalDetector(
+        detect_box_breakout, ["【買い目】ボックス上抜け", "【売り目】ボックス下抜け"], priority=4, cost=1,
+        lookback=lambda params: params["BOX_BREAKOUT_LOOKBACK"] + params["VOLUME_RECENT_WINDOW"] + params["VOLUME_PAST_WINDOW"],
+        prefilter=box_breakout_prefilter,
+        indicators=lambda params: {},
+        vector=box_breakout_signals,
+    ),
+    SignalDetector(
+        detect_breakout, ["【買い目】ブレイクアウト", "【売り目】ブレイクアウト"], priority=5, cost=1,
+        lookback=lambda params: params["BREAKOUT_LOOKBACK"] + params["VOLUME_RECENT_WINDOW"] + params["VOLUME_PAST_WINDOW"],
+        prefilter=breakout_prefilter,
+        indicators=lambda params: {},
+        vector=breakout_signals,
+    ),
+    SignalDetector(
+        detect_double_pattern, ["【売り目】ダブルトップ", "【買い目】ダブルボトム"], priority=6, cost=3,
+        lookback=lambda params: params["DOUBLE_PATTERN_LOOKBACK"],
+        prefilter=double_pattern_prefilter,
+        indicators=lambda params: {params["DOUBLE_PATTERN_LOOKBACK"]: ["標準偏差"]},
+        vector=double_pattern_signals,
+    ),
+]
+
+
+# ▼ シグナル名 → そのシグナルを出す検出関数（計測の当たり数に使う）
+SIGNAL_DETECTOR_NAMES = {signal_name: detector.name for detector in SIGNAL_DETECTORS for signal_name in detector.signals}
+
+
+def detectors_by_priority():
+    return sorted(SIGNAL_DETECTORS, key=lambda detector: detector.priority)
+
+
+def detectors_by_cost():
+    return sorted(SIGNAL_DETECTORS, key=lambda detector: (detector.cost, detector.priority))
+
+
+# ▼ 事前条件の判定に要る本数（どの検出関数の必要本数も切り捨てない幅）
+def detector_window(params=None):
+    params = detector_parameters(params)
+    return max([TREND_TAIL] + [detector.lookback(params) for detector in SIGNAL_DETECTORS])
+
+
+# ▼ 検出関数ごとの候補銘柄（必要本数を満たし、事前条件を通った銘柄）
+def detector_candidates(bars, params=None):
+    params = detector_parameters(params)
+    candidates = {}
+    for detector in SIGNAL_DETECTORS:
+        mask = bars["本数"] >= detector.lookback(params)
+        if mask.any():
+            mask &= detector.prefilter(bars, params)
+        candidates[detector.name] = mask
+    return candidates
+
+
+# ▼ 候補の銘柄だけについて、検出関数が使うインジケーターを用意（{(列名, tail): 2次元配列}。候補外の行は NaN）
+#    同じ区間を使う検出関数の候補はまとめて1回で計算する（一括計算は本数ぶんのループが主なので、回数を減らす）
+def detector_indicators(values, present, candidates, indicators=None, params=None):
+    params = detector_parameters(params)
+    width = values.shape[1]
+    groups = {}
+    for detector in SIGNAL_DETECTORS:
+        for tail, keys in detector.indicators(params).items():
+            use_tail = tail if tail is not None and tail < width else None
+            rows, group_keys = groups.get(use_tail, (np.zeros(len(values), dtype=bool), []))
+            groups[use_tail] = (rows | candidates[detector.name], group_keys + [k for k in keys if k not in group_keys])
+
+    matrices = {}
+    for use_tail, (rows, keys) in groups.items():
+        if indicators is not None:
+            matrices.update({(key, use_tail): indicators[(key, use_tail)] for key in keys})
+            continue
+        rows = np.flatnonzero(rows)
+        v, p = values[rows], present[rows]
+        if use_tail is not None:
+            v, p = v[:, -use_tail:], p[:, -use_tail:]
+        for key, matrix in (compute_indicator_matrix(v, p, keys=keys, params=params).items() if len(rows) else []):
+            full = np.full((len(values), matrix.shape[1]), np.nan)
+            full[rows] = matrix
+            matrices[(key, use_tail)] = full
+    return matrices
+
+
+# ▼ 検出関数に渡すインジケーター（rows の行だけ。tail が窓の本数以上なら窓全体の値を使う）
+def rows_indicators(matrices, detector, rows, width, params):
+    ind = {}
+    for tail, keys in detector.indicators(params).items():
+        use_tail = tail if tail is not None and tail < width else None
+        ind.update({(key, tail): matrices[(key, use_tail)][rows] for key in keys})
+    return ind
+
+
+# ▼ 全銘柄のシグナルを配列でまとめて判定し、send_output_dataframe_via_email が受け取る形で返す
+#    安い事前条件で候補を絞り、優先順の高い検出関数から、まだ当たっていない候補だけを判定する
+#    （インジケーターも候補の銘柄についてだけ計算する。evaluated には検出関数ごとの判定銘柄数を足す）
+#    params は検出の閾値の上書き（フィード・スイープの組み合わせごと。省略時はモジュールの設定値）
+def detect_signals_vectorized(codes, names, values, present, indicators=None, evaluated=None, params=None):
+    params = detector_parameters(params)
+    bars = window_bars(values, present)
+    candidates = detector_candidates(bars, params)
+    matrices = detector_indicators(values, present, candidates, indicators, params)
+    assigned = np.zeros(len(codes), dtype=bool)
+    results = {}
+
+    for detector in detectors_by_priority():
+        rows = np.flatnonzero(candidates[detector.name] & ~assigned)
+        if evaluated is not None:
+            evaluated[detector.name] = evaluated.get(detector.name, 0) + len(rows)
+        if not len(rows):
+            continue
+        ind = rows_indicators(matrices, detector, rows, values.shape[1], params)
+        for mask, row in detector.vector(take_rows(bars, rows), ind, params):
+            for j in np.flatnonzero(mask & ~assigned[rows]):
+                assigned[rows[j]] = True
+                results[rows[j]] = row(j)
+
+    output_data = []
+    for i in sorted(results):
+        result = results[i]
+        result.update({"銘柄コード": codes[i], "銘柄名称": names[i]})
+        output_data.append(result)
+    return output_data
+
+
+# ▼ ダブルトップ / ボトム判定1回あたりの所要時間を、銘柄ごとの detect_double_pattern と一括版で比べる
+def benchmark_double_pattern(codes, names, values, present, repeat=3):
+    prices, highs, lows, volumes = (
+        np.ascontiguousarray(values[:, :, BAR_FIELDS.index(f)]) for f in ["現在値", "高値", "安値", "出来高"]
+    )
+    lengths = present.sum(axis=1)
+    frames = [pd.DataFrame(values[i, present[i]], columns=BAR_FIELDS) for i in range(len(codes))]
+
+    def per_symbol():
+        return [detect_double_pattern(frame) for frame in frames]
+
+    def batched():
+        std = compute_tail_indicators(values, present).get(("標準偏差", DOUBLE_PATTERN_LOOKBACK))
+        if std is None:
+            std = compute_indicator_matrix(values, present, keys=["標準偏差"])["標準偏差"]
+        return double_pattern_masks(prices, highs, lows, volumes, std, lengths)
+
+    timings = {}
+    for label, func in [("per_symbol", per_symbol), ("batched", batched)]:
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed.append(time.perf_counter() - start)
+        timings[label] = min(elapsed)
+
+    print(
+        f"⏱️ ダブルトップ/ボトム判定（{len(codes)}銘柄）: 銘柄ごと {timings['per_symbol']:.3f}秒 / "
+        f"一括 {timings['batched']:.3f}秒（1サイクルあたり {timings['per_symbol'] - timings['batched']:.3f}秒短縮）"
+    )
+    return timings
+
+
+# ▼ ----- 複数プロセスでのシグナル判定（銘柄を分割し、分足配列は共有メモリで渡す） -----
+
+SIGNAL_WORKERS = 0  
+# ✅ シグナル判定に使うプロセス数（0 や 1 なら単一プロセス。DETECTOR_MODE="vectorized" のときのみ有効）
+
+SIGNAL_SHARD_MIN_SYMBOLS = 200  
+# ✅ 1プロセスに割り当てる最低銘柄数（銘柄が少ないときはプロセス起動・結果受け渡しの方が高くつく）
+
+SIGNAL_SPEEDUP_REPORT = False  
+# ✅ True なら最初の判定時に、単一プロセスとの所要時間を比べて表示する
+
+signal_executor = None
+signal_executor_workers = 0  # signal_executor を作ったときのプロセス数
+signal_speedup_reported = False
+
+
+def get_signal_executor(workers):
+    global signal_executor, signal_executor_workers
+    if signal_executor is not None and signal_executor_workers != workers:
+        signal_executor.shutdown()
+        signal_executor = None
+    if signal_executor is None:
+        signal_executor = ProcessPoolExecutor(max_workers=workers)
+        signal_executor_workers = workers
+    return signal_executor
+
+
+# ▼ 共有メモリ上の values（float64）と present（bool）を ndarray として参照する（コピーしない）
+def shared_window_views(shm, shape, start=None, stop=None):
+    values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    present = np.ndarray(shape[:2], dtype=bool, buffer=shm.buf, offset=values.nbytes)
+    return values[start:stop], present[start:stop]
+
+
+# ▼ ワーカープロセス側：共有メモリの [start:stop] 行だけを判定する（params はフィードごとの検出パラメータ）
+def detect_signals_shard(shm_name, shape, start, stop, codes, names, params=None):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        evaluated = {}
+        output_data = detect_signals_vectorized(
+            codes, names, *shared_window_views(shm, shape, start, stop), evaluated=evaluated, params=params
+        )
+        return output_data, evaluated
+    finally:
+        shm.close()
+
+
+# ▼ 銘柄を連続した区間に分けてプロセスプールで判定し、結果を銘柄順に連結する
+#    params は検出の閾値（ワーカープロセスのモジュール定数は親と同じとは限らないため、解決済みの値を渡す）
+def detect_signals_sharded(codes, names, values, present, workers=None, evaluated=None, params=None):
+    params = detector_parameters(params)
+    workers = workers or SIGNAL_WORKERS
+    shards = min(workers, len(codes) // SIGNAL_SHARD_MIN_SYMBOLS)
+    if shards <= 1:
+        return detect_signals_vectorized(codes, names, values, present, evaluated=evaluated, params=params)
+
+    # ✅ 分足配列は共有メモリに1回だけ書き込み、ワーカーへは名前と形だけを渡す（DataFrame を pickle しない）
+    shm = shared_memory.SharedMemory(create=True, size=values.nbytes + present.nbytes)
+    try:
+        shared_values, shared_present = shared_window_views(shm, values.shape)
+        shared_values[:] = values
+        shared_present[:] = present
+        del shared_values, shared_present
+
+        executor = get_signal_executor(workers)
+        bounds = np.linspace(0, len(codes), shards + 1).astype(int)
+        futures = [
+            executor.submit(
+                detect_signals_shard, shm.name, values.shape, start, stop, codes[start:stop], names[start:stop], params
+            )
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+
+        # ▼ 区間は銘柄コード順に並んでいるので、区間順に連結すれば単一プロセスと同じ並び・同じ優先順になる
+        output_data = []
+        for future in futures:
+            shard_output, shard_evaluated = future.result()
+            output_data.extend(shard_output)
+            if evaluated is not None:
+                for name, n in shard_evaluated.items():
+                    evaluated[name] = evaluated.get(name, 0) + n
+        return output_data
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# ▼ 単一プロセスと複数プロセスの所要時間を比べて表示（結果が一致するかも確認。params は判定と同じ検出パラメータ）
+def report_signal_speedup(codes, names, values, present, workers=None, repeat=3, params=None):
+    workers = workers or max(SIGNAL_WORKERS, os.cpu_count() or 1)
+    params = detector_parameters(params)
+    detect_signals_sharded(codes, names, values, present, workers=workers, params=params)  # プロセス起動ぶんを計測から除く
+
+    def best_of(func):
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed.append(time.perf_counter() - start)
+        return min(elapsed), [(row["銘柄コード"], row["シグナル"]) for row in result]
+
+    single, single_signals = best_of(lambda: detect_signals_vectorized(codes, names, values, present, params=params))
+    sharded, sharded_signals = best_of(lambda: detect_signals_sharded(codes, names, values, present, workers=workers, params=params))
+    print(
+        f"⏱️ シグナル判定（{len(codes)}銘柄）: 単一プロセス {single:.3f}秒 / {workers}プロセス {sharded:.3f}秒"
+        f"（{single / sharded:.2f}倍、結果{'一致' if single_signals == sharded_signals else '不一致'}）"
+    )
+    return {"symbols": len(codes), "workers": workers, "single": single, "sharded": sharded, "speedup": single / sharded}
+
+
 # ▼ 出力データから HTML テーブルを生成
 
-def format_output_html(df):
+def format_output_html(df, cleared=None):
     signal_order = [
         "【買い目】上昇トレンド", "【売り目】下降トレンド",
         "【買い目】ゴールデンクロス", "【売り目】デッドクロス",
@@ -628,12 +3324,12 @@ def format_output_html(df):
         <table>
         """]
 
-    for signal in signal_order:
-        group = df[df["シグナル"] == signal]
+    for signal_name in signal_order:
+        group = df[df["シグナル"] == signal_name]
         if group.empty:
             continue  # ⚠️ シグナルがない場合はそのセクションごとスキップ
 
-        html.append(f"<tr><td colspan='5'><h3>■ {signal}</h3></td></tr>")
+        html.append(f"<tr><td colspan='5'><h3>■ {signal_name}</h3></td></tr>")
         for _, row in group.iterrows():
             code = str(row["銘柄コード"])
             name_full = str(row["銘柄名称"])
@@ -651,6 +3347,19 @@ def format_output_html(df):
                 <td style='padding-left: 16px;'><a href="{x_url}" target="_blank">X検索</a></td>
             </tr>""")
 
+    # ▼ 解除されたシグナル（NOTIFY_MODE="changed" のとき）
+    if cleared:
+        html.append("<tr><td colspan='5'><h3>■ 解除されたシグナル</h3></td></tr>")
+        for row in cleared:
+            name_full = str(row["銘柄名称"])
+            name = name_full[:8] + "..." if len(name_full) > 8 else name_full
+            html.append(f"""
+            <tr>
+                <td>{row['銘柄コード']}</td>
+                <td>{name}</td>
+                <td colspan='3'>{row['シグナル']}（{row['発生']}〜{row['解除']}）</td>
+            </tr>""")
+
     html.append("</table>")
     html.append("""
                     <br><br>
@@ -710,75 +3419,512 @@ def format_output_html(df):
     return "\n".join(html)
 
 
-# ▼ SendGridでHTMLメール送信（BCCモード）
-def send_output_dataframe_via_email(output_data, current_time):
+# ▼ シグナル一覧をメールの並び（シグナルの優先順 → 現在値の高い順）の DataFrame にする
+def signals_to_dataframe(output_data):
+    output_df = pd.DataFrame(output_data, columns=None if output_data else ["シグナル", "現在値", "銘柄コード", "銘柄名称"])
+    signal_priority = [
+        "【買い目】上昇トレンド", "【売り目】下降トレンド",
+        "【買い目】ゴールデンクロス", "【売り目】デッドクロス",
+        "【買い目】ボックスレンジ", "【売り目】ボックスレンジ",
+        "【買い目】ブレイクアウト", "【売り目】ブレイクアウト",
+        "【買い目】ダブルボトム", "【売り目】ダブルトップ"
+    ]
+    output_df["シグナル"] = pd.Categorical(output_df["シグナル"], categories=signal_priority, ordered=True)
+    return output_df.sort_values(by=["シグナル", "現在値"], ascending=[True, False])
+
+
+# ▼ 通知メールを組み立てる（送信はしない）
+def build_signal_email(html_content, current_time, sender_email, recipient_emails, label=""):
+    formatted_time = f"{current_time[:2]}:{current_time[2:]}"
+    email_subject = f"【{formatted_time}】株式 - テクニカルシグナル通知" + (f"（{label}）" if label else "")
+
+    message = Mail(
+        from_email=Email(sender_email),
+        to_emails=To(sender_email),
+        subject=email_subject,
+        html_content=html_content
+    )
+    message.bcc = [Bcc(email) for email in recipient_emails]
+    return message
+
+
+# ▼ ----- メール送信（バックグラウンドの送信キュー・リトライ・BCC分割） -----
+
+EMAIL_LIST_PATH = "email_list.txt"  
+# ✅ 宛先リスト（1行1アドレス）。更新時刻が変わったときだけ読み直す
+
+EMAIL_ASYNC = True  
+# ✅ True なら送信をバックグラウンドのスレッドに任せ、監視ループはメール送信を待たない
+
+EMAIL_QUEUE_SIZE = 10  
+# ✅ 送信待ちの上限。あふれたら一番古い通知を捨てる（古いシグナルより新しいシグナルを優先）
+
+EMAIL_BCC_CHUNK = 500  
+# ✅ 1通あたりの BCC の最大件数。これを超える宛先は分けて送る
+
+EMAIL_SEND_WORKERS = 4  
+# ✅ 分けた BCC を同時に送る数
+
+EMAIL_MIN_INTERVAL = 0.2  
+# ✅ SendGrid への送信の最小間隔（秒）。同時送信でもこの間隔以上あける
+
+EMAIL_MAX_RETRIES = 4  
+# ✅ 429・5xx・通信エラーのときのリトライ回数（4xx の設定ミスはリトライしない）
+
+EMAIL_RETRY_BASE = 2.0  
+# ✅ リトライ待ちの初期値（秒）。失敗のたびに2倍（最大 EMAIL_RETRY_MAX）＋ゆらぎ
+
+EMAIL_RETRY_MAX = 60.0
+
+SENDGRID_HOST = os.environ.get("SENDGRID_HOST", "https://api.sendgrid.com")  
+# ✅ 送信先 API。テストでは fake-sendgrid サブコマンドのアドレス（例: http://127.0.0.1:8025）にする
+
+
+# ▼ 宛先リストのキャッシュ（ファイルの更新時刻・サイズが変わったときだけ読み直す）
+class RecipientList:
+    def __init__(self, path=EMAIL_LIST_PATH):
+        self.path = path
+        self.stamp = None
+        self.emails = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if stamp != self.stamp:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.emails = list(dict.fromkeys(email.strip() for email in f if email.strip()))
+                self.stamp = stamp
+                metrics.count("recipient_list_loads")
+            return self.emails
+
+
+# ▼ 送信間隔の下限を守る（複数スレッドから呼ばれる）
+class RateLimiter:
+    def __init__(self, min_interval=EMAIL_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+
+sendgrid_rate_limiter = RateLimiter()
+
+
+# ▼ リトライしてよい失敗か（429・5xx・ステータスのない通信エラー）
+def is_retryable_email_error(error):
+    status = getattr(error, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+# ▼ 1通（BCC の1かたまり）をリトライ付きで送る
+def send_with_retry(sg, message, label):
+    for attempt in range(EMAIL_MAX_RETRIES + 1):
+        sendgrid_rate_limiter.wait()
+        try:
+            response = sg.send(message)
+            metrics.count("emails_sent")
+            return response
+        except Exception as e:
+            if attempt == EMAIL_MAX_RETRIES or not is_retryable_email_error(e):
+                metrics.count("emails_failed")
+                raise
+            delay = min(EMAIL_RETRY_MAX, EMAIL_RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            metrics.count("email_retries")
+            print(f"⚠️ メール送信リトライ {attempt + 1}/{EMAIL_MAX_RETRIES}（{label}）: {e} → {delay:.1f}秒後")
+            time.sleep(delay)
+
+
+# ▼ SendGridでHTMLメール送信（BCCモード。宛先が多ければ EMAIL_BCC_CHUNK 件ずつ同時に送る）
+#    recipients（RecipientList）/ label はフィードの宛先・件名（省略すると既定のフィードの宛先）
+def send_output_dataframe_via_email(output_data, current_time, cleared=None, recipients=None, label=""):
     try:
-        output_df = pd.DataFrame(output_data)
-        signal_priority = [
-            "【買い目】上昇トレンド", "【売り目】下降トレンド",
-            "【買い目】ゴールデンクロス", "【売り目】デッドクロス",
-            "【買い目】ボックスレンジ", "【売り目】ボックスレンジ",
-            "【買い目】ブレイクアウト", "【売り目】ブレイクアウト",
-            "【買い目】ダブルボトム", "【売り目】ダブルトップ"
-        ]
-        output_df["シグナル"] = pd.Categorical(output_df["シグナル"], categories=signal_priority, ordered=True)
-        output_df = output_df.sort_values(by=["シグナル", "現在値"], ascending=[True, False])
-
-        html_content = format_output_html(output_df)
-        sendgrid_api_key = os.environ.get("SENDGRID_API_KEY")
-        sender_email = os.environ.get("SENDER_EMAIL")
-        email_list_path = "email_list.txt"
-        formatted_time = f"{current_time[:2]}:{current_time[2:]}"
-        email_subject = f"【{formatted_time}】株式 - テクニカルシグナル通知"
-
-        with open(email_list_path, "r", encoding="utf-8") as f:
-            recipient_emails = [email.strip() for email in f if email.strip()]
-
-        message = Mail(
-            from_email=Email(sender_email),
-            to_emails=To(sender_email),
-            subject=email_subject,
-            html_content=html_content
-        )
-        message.bcc = [Bcc(email) for email in recipient_emails]
-        sg = SendGridAPIClient(sendgrid_api_key)
-        response = sg.send(message)
-        print(f"✅ HTMLメール送信完了（BCCモード）: ステータスコード = {response.status_code}")
+        with metrics.time("email"):
+            html_content = format_output_html(signals_to_dataframe(output_data), cleared=cleared)
+            sendgrid_api_key = os.environ.get("SENDGRID_API_KEY")
+            sender_email = os.environ.get("SENDER_EMAIL")
+            recipient_emails = (recipients or get_default_feed().recipients).get()
+            chunks = [recipient_emails[i:i + EMAIL_BCC_CHUNK] for i in range(0, len(recipient_emails), EMAIL_BCC_CHUNK)] or [[]]
+
+            sg = SendGridAPIClient(sendgrid_api_key, host=SENDGRID_HOST)
+            messages = [build_signal_email(html_content, current_time, sender_email, chunk, label=label) for chunk in chunks]
+            labels = [f"{current_time} {i + 1}/{len(chunks)}" for i in range(len(chunks))]
+            with ThreadPoolExecutor(max_workers=min(EMAIL_SEND_WORKERS, len(chunks))) as pool:
+                futures = [pool.submit(send_with_retry, sg, message, label) for message, label in zip(messages, labels)]
+            for future, chunk, label in zip(futures, chunks, labels):
+                try:
+                    response = future.result()
+                    print(f"✅ HTMLメール送信完了（BCCモード {label}, {len(chunk)}件）: ステータスコード = {response.status_code}")
+                except Exception as e:
+                    print(f"🚫 メール送信エラー（{label}, {len(chunk)}件）: {e}")
     except Exception as e:
         print(f"🚫 メール送信エラー: {e}")
 
 
-# ▼ ファイルを分析してメール送信する関数（修正済み: dfを直接渡す）
-def analyze_and_display_filtered_signals(df, current_time):
-    try:
-        df.columns = df.columns.str.strip().str.replace("　", "").str.replace(" ", "")
+class EmailDispatcher:
+    """送信待ちキューと送信スレッド。submit() はすぐ戻り、送信は順番にバックグラウンドで行う。"""
 
-        output_data = []
-        for code, df_group in df.groupby("銘柄コード"):
+    def __init__(self, maxsize=EMAIL_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self.run, name="email-dispatch", daemon=True)
+        self.thread.start()
+
+    def submit(self, output_data, current_time, cleared=None, recipients=None, label=""):
+        job = (output_data, current_time, cleared, recipients, label)
+        while True:
             try:
-                name = df_group["銘柄名称"].iloc[-1]
-                signal = None
-
-                # 各シグナルの評価
-                for detector in [
-                    detect_uptrend, detect_downtrend,
-                    detect_golden_cross, detect_dead_cross,
-                    detect_box_breakout,
-                    detect_breakout, detect_double_pattern
-                ]:
-
-                    result = detector(df_group)
-                    if result:
-                        result.update({"銘柄コード": code, "銘柄名称": name})
-                        output_data.append(result)
-                        break
+                self.queue.put_nowait(job)
+                break
+            except queue.Full:
+                try:
+                    dropped = self.queue.get_nowait()
+                    self.queue.task_done()
+                    metrics.count("emails_dropped")
+                    print(f"⚠️ メール送信待ちがあふれたため {dropped[1]} の通知を破棄")
+                except queue.Empty:
+                    pass
+        metrics.count("emails_queued")
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                send_output_dataframe_via_email(*job)
+            finally:
+                self.queue.task_done()
+
+    # ▼ 送信待ちがなくなるまで待つ（終了時用。timeout 秒で打ち切る）
+    def flush(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self.queue.unfinished_tasks
+
+
+email_dispatcher = None
+
+
+def get_email_dispatcher():
+    global email_dispatcher
+    if email_dispatcher is None:
+        email_dispatcher = EmailDispatcher()
+        atexit.register(email_dispatcher.flush)
+    return email_dispatcher
 
-            except Exception as e:
-                print(f"⚠️ シグナル処理エラー（{code}）: {e}")
 
-        # メール送信
-        if output_data:
-            send_output_dataframe_via_email(output_data, current_time)
+# ▼ 通知メールを送る（EMAIL_ASYNC なら送信キューに積むだけ。宛先・件名は積んだ時点のフィードのものを送信スレッドへ渡す）
+def dispatch_signal_email(output_data, current_time, cleared=None, recipients=None, label=""):
+    if EMAIL_ASYNC:
+        get_email_dispatcher().submit(output_data, current_time, cleared, recipients=recipients, label=label)
+    else:
+        send_output_dataframe_via_email(output_data, current_time, cleared=cleared, recipients=recipients, label=label)
+
+
+# ▼ テスト用の SendGrid もどき（/v3/mail/send を受けて 202 を返す。失敗・遅延も混ぜられる）
+def run_fake_sendgrid(port=8025, fail_rate=0.0, latency=0.0, log_path=None):
+    log_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            if random.random() < fail_rate:
+                self.send_response(random.choice([429, 500, 503]))
+                self.end_headers()
+                return
+            payload = json.loads(body or b"{}")
+            personalization = (payload.get("personalizations") or [{}])[0]
+            record = {
+                "received": datetime.now().isoformat(timespec="milliseconds"),
+                "subject": payload.get("subject"),
+                "to": [entry.get("email") for entry in personalization.get("to", [])],
+                "bcc": len(personalization.get("bcc", [])),
+            }
+            print(f"📨 {record}")
+            if log_path:
+                with log_lock, open(log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"📮 fake SendGrid: http://127.0.0.1:{port}（失敗率 {fail_rate}, 遅延 {latency}秒）")
+    server.serve_forever()
+
+
+# ▼ ----- シグナルの状態管理（発生・解除を記録し、変化したものだけ通知） -----
+
+SIGNAL_STORE_PATH = "signal_state.sqlite3"  
+# ✅ シグナルの履歴を保存する SQLite ファイル（":memory:" ならメモリ上のみ。空欄なら記録せず毎回すべて通知）
+
+NOTIFY_MODE = "all"  
+# ✅ メール通知の対象："all"＝毎回すべて（従来どおり） / "new"＝新しく出たシグナルのみ
+#    "changed"＝新しく出たシグナルと解除されたシグナル / "digest"＝NOTIFY_DIGEST_MINUTES ごとにまとめて
+
+NOTIFY_DIGEST_MINUTES = 30  
+# ✅ NOTIFY_MODE="digest" の送信間隔（分）。時計の区切りにそろえる（30 なら 9:30, 10:00, 10:30 ...）
+
+# ▼ シグナル1件のうち、銘柄コード・銘柄名称・シグナル以外の項目（JSON に保存できる型にそろえる）
+def signal_fields(row):
+    return {
+        key: value.item() if isinstance(value, np.generic) else value
+        for key, value in row.items() if key not in ("銘柄コード", "銘柄名称", "シグナル")
+    }
+
+
+class SignalStateStore:
+    """日付・銘柄コード・シグナルごとに、発生（first_fired）から解除（cleared_at）までを1行として記録する。
+
+    同じシグナルが解除後にまた出た場合は（同じ分のうちでも）別の行になる。notifications には送信した通知を記録する。
+    """
+
+    def __init__(self, path=SIGNAL_STORE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signal_episodes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                code TEXT NOT NULL,
+                signal TEXT NOT NULL,
+                name TEXT,
+                first_fired TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                cleared_at TEXT,
+                fire_count INTEGER NOT NULL DEFAULT 1,
+                fields TEXT
+            );
+            CREATE INDEX IF NOT EXISTS signal_episodes_active ON signal_episodes (date, cleared_at);
+            CREATE INDEX IF NOT EXISTS signal_episodes_fired ON signal_episodes (date, first_fired);
+            CREATE TABLE IF NOT EXISTS notifications (
+                date TEXT NOT NULL,
+                hhmm TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                signals INTEGER NOT NULL
+            );
+        """)
+
+    # ▼ 今回の判定結果を記録し、(新しく出たシグナル, 解除されたシグナル) を返す
+    def record(self, date, hhmm, output_data):
+        current = {(str(row["銘柄コード"]), row["シグナル"]): row for row in output_data}
+        active = {
+            (code, signal_name): (first_fired, name, episode)
+            for code, signal_name, first_fired, name, episode in self.conn.execute(
+                "SELECT code, signal, first_fired, name, rowid FROM signal_episodes WHERE date = ? AND cleared_at IS NULL", (date,)
+            )
+        }
+        new_keys = [key for key in current if key not in active]
+        kept_keys = [key for key in current if key in active]
+        cleared_keys = [key for key in active if key not in current]
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO signal_episodes (date, code, signal, name, first_fired, last_seen, fields) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (date, code, signal_name, str(current[(code, signal_name)]["銘柄名称"]), hhmm, hhmm,
+                     json.dumps(signal_fields(current[(code, signal_name)]), ensure_ascii=False))
+                    for code, signal_name in new_keys
+                ],
+            )
+            self.conn.executemany(
+                "UPDATE signal_episodes SET last_seen = ?, fire_count = fire_count + 1, fields = ? WHERE rowid = ?",
+                [
+                    (hhmm, json.dumps(signal_fields(current[key]), ensure_ascii=False), active[key][2])
+                    for key in kept_keys
+                ],
+            )
+            self.conn.executemany(
+                "UPDATE signal_episodes SET cleared_at = ? WHERE rowid = ?",
+                [(hhmm, active[key][2]) for key in cleared_keys],
+            )
+
+        new = [current[key] for key in new_keys]
+        cleared = [
+            {"銘柄コード": code, "銘柄名称": active[(code, signal_name)][1], "シグナル": signal_name, "発生": active[(code, signal_name)][0], "解除": hhmm}
+            for code, signal_name in cleared_keys
+        ]
+        return new, cleared
+
+    # ▼ since より後（inclusive なら since を含む）、until までに発生したシグナルを、判定結果と同じ形で返す（ダイジェスト用）
+    def fired_between(self, date, since, until, inclusive=False):
+        rows = self.conn.execute(
+            f"SELECT code, name, signal, fields FROM signal_episodes WHERE date = ? AND first_fired {'>=' if inclusive else '>'} ? "
+            "AND first_fired <= ? ORDER BY first_fired, code",
+            (date, since, until),
+        )
+        return [{"シグナル": signal_name, **json.loads(fields), "銘柄コード": code, "銘柄名称": name} for code, name, signal_name, fields in rows]
+
+    # ▼ 1日分の履歴（発生順。active_only なら未解除のものだけ）
+    def history(self, date, active_only=False):
+        query = (
+            "SELECT code AS 銘柄コード, name AS 銘柄名称, signal AS シグナル, first_fired AS 発生, "
+            "last_seen AS 最終確認, cleared_at AS 解除, fire_count AS 回数, fields AS 項目 "
+            "FROM signal_episodes WHERE date = ?" + (" AND cleared_at IS NULL" if active_only else "") +
+            " ORDER BY first_fired, code"
+        )
+        return pd.read_sql_query(query, self.conn, params=(date,))
+
+    def last_notification(self, date, mode):
+        row = self.conn.execute("SELECT MAX(hhmm) FROM notifications WHERE date = ? AND mode = ?", (date, mode)).fetchone()
+        return row[0]
+
+    def first_notification(self, date, mode):
+        row = self.conn.execute("SELECT MIN(hhmm) FROM notifications WHERE date = ? AND mode = ?", (date, mode)).fetchone()
+        return row[0]
+
+    def record_notification(self, date, hhmm, mode, signals):
+        with self.conn:
+            self.conn.execute("INSERT INTO notifications (date, hhmm, mode, signals) VALUES (?, ?, ?, ?)", (date, hhmm, mode, signals))
+
+
+# ▼ 既定のフィードのシグナル履歴（SIGNAL_STORE_PATH が空欄なら None）
+def get_signal_store():
+    return get_default_feed().get_signal_store()
+
+
+# ▼ hhmm が属するダイジェストの区切り（0時からの分 // NOTIFY_DIGEST_MINUTES）
+def digest_slot(hhmm):
+    return (int(hhmm[:2]) * 60 + int(hhmm[2:])) // NOTIFY_DIGEST_MINUTES
+
+
+# ▼ 判定結果を store（フィードのシグナル履歴。省略すると既定のフィード）に記録し、
+#    NOTIFY_MODE に応じて (メールで送るシグナル, 解除されたシグナル) を返す
+def select_notifications(output_data, target_date, current_time, store=None):
+    store = store or get_signal_store()
+    if store is None:
+        return output_data, []
+
+    new, cleared = store.record(target_date, current_time, output_data)
+    metrics.count("signals_new", len(new))
+    metrics.count("signals_cleared", len(cleared))
+
+    if NOTIFY_MODE == "all":
+        selected, gone = output_data, []
+    elif NOTIFY_MODE == "new":
+        selected, gone = new, []
+    elif NOTIFY_MODE == "changed":
+        selected, gone = new, cleared
+    elif NOTIFY_MODE == "digest":
+        last = store.last_notification(target_date, "digest")
+        if last is None or digest_slot(current_time) == digest_slot(last):
+            if last is None:
+                store.record_notification(target_date, current_time, "digest", 0)  # 当日の起点
+            return [], []
+        # ✅ 最初の区切りは起点（当日最初の判定）の分を含める。含めないと起点で出たシグナルがどのダイジェストにも載らない
+        inclusive = last == store.first_notification(target_date, "digest")
+        selected, gone = store.fired_between(target_date, last, current_time, inclusive=inclusive), []
+        store.record_notification(target_date, current_time, "digest", len(selected))
+        return selected, gone
+    else:
+        raise ValueError(f"未対応の NOTIFY_MODE です: {NOTIFY_MODE}")
+
+    if selected or gone:
+        store.record_notification(target_date, current_time, NOTIFY_MODE, len(selected))
+    return selected, gone
+
+
+# ▼ 判定する窓の（銘柄 × 本数）配列。リングバッファなら DataFrame を介さずに window_start 以降を並べる
+def window_arrays(window, max_bars=TREND_TAIL):
+    if isinstance(window, BarStore):
+        codes, names, values, present = window.aligned_window(window.window_start)
+        return codes, names, values[:, -max_bars:], present[:, -max_bars:]
+    return frame_to_aligned_window(window, max_bars=max_bars)
+
+
+# ▼ シグナル判定（メール送信はしない。send_output_dataframe_via_email が受け取る形のリストを返す）
+#    window は update_bar_store のリングバッファか、縦持ちの分足 DataFrame。
+#    DataFrame は銘柄ごとの判定（DETECTOR_MODE="per_symbol"）のときだけ組み立てる
+def evaluate_signals(window, indicator_source=None, params=None):
+    global signal_speedup_reported
+    evaluated = {detector.name: 0 for detector in SIGNAL_DETECTORS}
+    # ✅ フィードの閾値はモジュール定数を書き換えず、解決した値を検出関数へ引数で渡す
+    params = detector_parameters(params)
+
+    if DETECTOR_MODE == "vectorized":
+        with metrics.time("align"):
+            codes, names, values, present = window_arrays(window)
+        if SIGNAL_SPEEDUP_REPORT and not signal_speedup_reported:
+            report_signal_speedup(codes, names, values, present, params=params)
+            signal_speedup_reported = True
+        with metrics.time("detect"):
+            output_data = detect_signals_sharded(codes, names, values, present, evaluated=evaluated, params=params)
+    else:
+        # ▼ 事前条件は全銘柄まとめて配列で判定し、通った検出関数だけを軽い順に呼ぶ
+        with metrics.time("to_frame"):
+            df = window.to_frame(since_hhmm=window.window_start) if isinstance(window, BarStore) else window
+        with metrics.time("prefilter"):
+            codes, _, values, present = frame_to_aligned_window(df, max_bars=detector_window(params))
+            candidates = detector_candidates(window_bars(values, present), params)
+            row_of = {code: i for i, code in enumerate(codes)}
+        detectors = detectors_by_cost()
+
+        output_data = []
+        with metrics.time("detect"):
+            for code, df_group in df.groupby("銘柄コード"):
+                try:
+                    i = row_of[code]
+                    todo = [detector for detector in detectors if candidates[detector.name][i]]
+                    if not todo:
+                        continue
+                    name = df_group["銘柄名称"].iloc[-1]
+                    precomputed = indicator_source.get(code) if indicator_source else None
+                    features = FeatureFrame(df_group, precomputed=precomputed, params=params)
+
+                    # 各シグナルの評価（当たりが出たら、それより優先順の低い検出関数は呼ばない）
+                    best = None
+                    for detector in todo:
+                        if best is not None and detector.priority > best[0]:
+                            continue
+                        evaluated[detector.name] += 1
+                        result = detector.detect(features, params)
+                        if result:
+                            best = (detector.priority, result)
+
+                    if best is not None:
+                        best[1].update({"銘柄コード": code, "銘柄名称": name})
+                        output_data.append(best[1])
+
+                except Exception as e:
+                    print(f"⚠️ シグナル処理エラー（{code}）: {e}")
+
+    hits = {}
+    for row in output_data:
+        detector_name = SIGNAL_DETECTOR_NAMES.get(row["シグナル"], "unknown")
+        hits[detector_name] = hits.get(detector_name, 0) + 1
+        metrics.count("signals", signal=row["シグナル"])
+    for detector_name, n in evaluated.items():
+        metrics.count("detector_symbols_evaluated", n, detector=detector_name)
+        metrics.count("detector_hits", hits.get(detector_name, 0), detector=detector_name)
+    metrics.count("symbols_evaluated", len(codes))
+
+    return output_data
+
+
+# ▼ ファイルを分析してメール送信する関数（window は evaluate_signals と同じ。閾値・履歴・宛先は feed のもの）
+def analyze_and_display_filtered_signals(window, current_time, indicator_source=None, target_date=None, feed=None):
+    try:
+        feed = feed or get_default_feed()
+        output_data = evaluate_signals(window, indicator_source=indicator_source, params=feed.params)
+        target_date = target_date or get_japan_time().strftime("%Y%m%d")
+        notify_data, cleared = select_notifications(output_data, target_date, current_time, store=feed.get_signal_store())
+
+        # メール送信（NOTIFY_MODE に応じて、新しく出た / 変化したシグナルだけ）
+        if notify_data or cleared:
+            dispatch_signal_email(notify_data, current_time, cleared=cleared, recipients=feed.recipients, label=feed.name)
+        elif output_data:
+            print(f"ℹ️ 新しいシグナルなし（{len(output_data)}件は通知済み）。メール送信スキップ")
         else:
             print("ℹ️ シグナルなし。メール送信スキップ")
 
@@ -786,40 +3932,1006 @@ def analyze_and_display_filtered_signals(df, current_time):
         print(f"🚫 データ処理エラー: {e}")
 
 
-# ▼ 修正済み：監視ループ本体（build_intraday_dataframe() で当日CSVを全件取得）
-while True:
-    try:
-        now = get_japan_time()
-
-        # ▼ テスト日・テスト時刻があればそれを使う
-        check_date = datetime.strptime(TEST_DATE, "%Y%m%d").date() if TEST_DATE else now.date()
-        check_time = datetime.strptime(TEST_TIME, "%H%M").time() if TEST_TIME else now.time()
-        current_time_str = TEST_TIME if TEST_TIME else now.strftime("%H%M")
-        today_date_str = TEST_DATE if TEST_DATE else now.strftime("%Y%m%d")
-
-        # ▼ 稼働条件チェック
-        is_weekday = check_date.weekday() < 5
-        is_not_holiday = not jpholiday.is_holiday(check_date)
-        is_within_trading_time = (
-            datetime.strptime("09:02", "%H:%M").time() <= check_time <= datetime.strptime("11:30", "%H:%M").time()
-            or datetime.strptime("12:30", "%H:%M").time() <= check_time <= datetime.strptime("15:00", "%H:%M").time()
-        )
+# ▼ ----- 稼働カレンダーと判定スケジューラ -----
+
+TRADING_SESSIONS = [("0902", "1130"), ("1230", "1500")]
+# ✅ 監視ループの稼働時間帯（前場・後場）。リプレイもこの範囲を1分ずつ進める
+
+SCHEDULER_SKIP_UNCHANGED = True  
+# ✅ 入力ファイルの集合（ファイル名と rev）が前回の判定時と同じなら、判定・メール送信をしない
+
+SCHEDULER_ARRIVAL_SAMPLES = 10  
+# ✅ 分足ファイルが届いた時刻（分の中の秒）を何件覚えて、次の到着を予測するか
 
-        if is_weekday and is_not_holiday and is_within_trading_time:
-            print(f"📂 処理対象日: {today_date_str}（時刻: {current_time_str}）")
+SCHEDULER_EARLY_WAKE = 2.0  
+# ✅ 予測した到着時刻の何秒前に起きて確認を始めるか
 
-            # ▼ 当日の全CSVを結合して分析
-            df_all = build_intraday_dataframe(target_date=today_date_str)
-            if not df_all.empty:
+SCHEDULER_POLL_INTERVAL = 1.0  
+# ✅ 到着の予測がないとき・予測を過ぎても届かないときの確認間隔（秒）
+
+SCHEDULER_IDLE_MAX_SLEEP = 60  
+# ✅ 非稼働時間に一度に待機する最大秒数
+
+
+MARKET_YEAR_END_HOLIDAYS = {(12, 31), (1, 2), (1, 3)}
+# ✅ 祝日以外で取引所が休みになる日（年末年始。(月, 日)）
+
+
+# ▼ 営業日か（土日・祝日・年末年始の休場日以外）
+def is_business_day(day):
+    return day.weekday() < 5 and not jpholiday.is_holiday(day) and (day.month, day.day) not in MARKET_YEAR_END_HOLIDAYS
+
+
+# ▼ 前営業日（YYYYMMDD → YYYYMMDD）
+def previous_business_day(date):
+    day = datetime.strptime(date, "%Y%m%d").date() - timedelta(days=1)
+    while not is_business_day(day):
+        day -= timedelta(days=1)
+    return day.strftime("%Y%m%d")
+
+
+class TradingCalendar:
+    """1日分の稼働判定（営業日かどうかと、前場・後場の時間帯）。
+
+    日付ごとに1回だけ作り、ループのたびに時刻文字列を strptime したり祝日判定をしたりしない。
+    """
+
+    def __init__(self, day):
+        self.date = day
+        self.is_business_day = is_business_day(day)
+        self.sessions = [
+            (datetime.strptime(start, "%H%M").time(), datetime.strptime(end, "%H%M").time())
+            for start, end in TRADING_SESSIONS
+        ]
+
+    def is_open(self, t):
+        return self.is_business_day and any(start <= t <= end for start, end in self.sessions)
+
+    # ▼ 当日の次の取引開始までの秒数（当日はもう開かなければ None）
+    def seconds_until_open(self, t):
+        if not self.is_business_day:
+            return None
+        for start, _ in self.sessions:
+            if t < start:
+                return (datetime.combine(self.date, start) - datetime.combine(self.date, t)).total_seconds()
+        return None
+
+
+trading_calendars = {}
+
+
+# ▼ 日付ごとの稼働カレンダー（当日分だけ保持）
+def get_trading_calendar(day):
+    calendar = trading_calendars.get(day)
+    if calendar is None:
+        trading_calendars.clear()
+        calendar = trading_calendars[day] = TradingCalendar(day)
+    return calendar
+
+
+# ▼ ----- 寄り付きのウォームスタート（前営業日の最後の分足で窓を埋める） -----
+
+WARM_START = False  
+# ✅ True にすると、当日の分足が BAR_WINDOW 本に満たない間、前営業日の最後の分足を窓の先頭に入れて判定する
+#    （寄り付き直後から UPTREND_LOOKBACK などの本数がそろう。当日の分足が増えるたびに古い順に押し出される）
+#    寄り付きから BAR_WINDOW 分ほどはインジケーターに前日の分足が混ざるため、出るシグナルが従来と変わる
+
+WARM_START_BARS = BAR_WINDOW  
+# ✅ 前営業日から使う分足の本数
+
+# ▼ 前営業日の最後の WARM_START_BARS 本（archive=True ならアーカイブにあればそこから読み、取得元から読んだ分は保存する）
+#    読み込んだ分足は feed（省略すると既定のフィード）に前営業日ごと保持する
+def load_warm_start_frames(today, source, archive=False, feed=None):
+    feed = feed or get_default_feed()
+    previous = previous_business_day(today)
+    frames = feed.warm_start_frames.get(previous)
+    if frames is not None:
+        return frames
+
+    frames = []
+    origin = "アーカイブ"
+    if archive and feed.archive_dir and pa is not None and previous in archive_dates(feed.archive_dir):
+        archive_source = ArchiveSource(feed.archive_dir, prefix=feed.prefix)
+        files = archive_source.day_files(previous)[-WARM_START_BARS:]
+        frames = [(hhmm, rev, archive_source.read_frame(fname)) for hhmm, fname, rev in files]
+    if not frames:
+        origin = source.name
+        files = sorted(group_files_by_date(source.list_files(), feed.prefix).get(previous, []))[-WARM_START_BARS:]
+        loaded = load_minute_frames(source, files, verbose=False, feed=feed)
+        frames = [(hhmm, rev, loaded[hhmm]) for hhmm, _, rev in files if hhmm in loaded]
+        if archive:
+            for hhmm, rev, df in frames:
+                archive_minute(previous, hhmm, rev, df, feed.archive_dir)
+
+    feed.warm_start_frames.clear()
+    feed.warm_start_frames[previous] = frames
+    if frames:
+        print(f"🔥 ウォームスタート: {previous} の {frames[0][0]}〜{frames[-1][0]}（{len(frames)}本）を {origin} から読み込みました")
+    else:
+        print(f"ℹ️ ウォームスタート: {previous} の分足が見つかりませんでした")
+    return frames
+
+
+# ▼ 入力ファイル集合の指紋（hhmm・ファイル名・rev が同じなら同じ値）
+def file_set_fingerprint(files):
+    return hashlib.sha1("\n".join(f"{hhmm}\t{fname}\t{rev}" for hhmm, fname, rev in files).encode("utf-8")).hexdigest()
+
+
+class CycleScheduler:
+    """入力ファイル集合の指紋で判定の要否を決め、次の分足が届きそうな時刻に合わせて待機する。"""
+
+    def __init__(self):
+        self.last_fingerprint = None
+        self.last_arrival = None
+        self.arrival_offsets = deque(maxlen=SCHEDULER_ARRIVAL_SAMPLES)
+
+    def is_unchanged(self, fingerprint):
+        return SCHEDULER_SKIP_UNCHANGED and fingerprint == self.last_fingerprint
+
+    # ▼ 判定を終えた指紋を記録し、新しいファイルに気付いた時刻（分の中の秒）を到着予測に使う
+    def mark_processed(self, fingerprint, seen_at):
+        if self.last_fingerprint is not None and fingerprint != self.last_fingerprint:
+            self.arrival_offsets.append(seen_at.second + seen_at.microsecond / 1e6)
+            self.last_arrival = seen_at
+        self.last_fingerprint = fingerprint
+
+    # ▼ 到着時刻（分の中の秒）の中央値。59秒台と0秒台が混ざる場合は分をまたいで数える
+    def expected_offset(self):
+        offsets = sorted(self.arrival_offsets)
+        if offsets[-1] - offsets[0] > 30:
+            offsets = sorted(o + 60 if o < 30 else o for o in offsets)
+        return offsets[len(offsets) // 2] % 60
+
+    # ▼ 次に起きるまでの秒数（前回の到着の次の分の予測時刻まで。予測を過ぎていれば確認間隔）
+    def next_delay(self, now):
+        if not self.arrival_offsets or self.last_arrival is None:
+            return SCHEDULER_POLL_INTERVAL
+        minute_start = self.last_arrival.replace(second=0, microsecond=0)
+        wake = minute_start + timedelta(minutes=1, seconds=self.expected_offset() - SCHEDULER_EARLY_WAKE)
+        delay = (wake - now).total_seconds()
+        return min(delay, 60) if delay > SCHEDULER_POLL_INTERVAL else SCHEDULER_POLL_INTERVAL
+
+    # ▼ 取得元が変更通知（ロングポーリング）に対応していればそれを待ち、なければ到着予測に合わせて眠る
+    def wait(self, source):
+        if source.supports_push():
+            source.wait_for_change()
+            return
+        delay = self.next_delay(get_japan_time())
+        print(f"⏲️ {delay:.1f}秒待機中...")
+        time.sleep(delay)
+
+
+# ▼ 取引時間中の1サイクル（入力ファイルが前回の判定時から変わっていなければ、判定・メール送信をしない）
+def run_cycle(feed, today_date_str, current_time_str, now):
+    files = list_intraday_files(target_date=today_date_str, feed=feed)
+    fingerprint = file_set_fingerprint(files)
+    if files and feed.scheduler.is_unchanged(fingerprint):
+        metrics.count("cycles_skipped")
+        return
+
+    feed_note = f"・{feed.name}" if feed.name else ""
+    print(f"📂 処理対象日: {today_date_str}（時刻: {current_time_str}{feed_note}）")
+
+    # ▼ 当日の全CSVを結合して分析（要求があればこのサイクルを cProfile で計測）
+    profiler = start_cycle_profile()
+    try:
+        with metrics.time("cycle"):
+            window = build_intraday_window(target_date=today_date_str, files=files, archive=True, feed=feed)
+            if window is not None:
                 print("🔎 データ結合完了。全銘柄分析を開始...")
-                analyze_and_display_filtered_signals(df_all, current_time_str)
+                with metrics.time("indicator_source"):
+                    indicator_source = current_indicator_source(feed.bar_store, feed.params) if DETECTOR_MODE != "vectorized" else None
+                with metrics.time("analyze"):
+                    analyze_and_display_filtered_signals(
+                        window, current_time_str, indicator_source=indicator_source, target_date=today_date_str, feed=feed
+                    )
             else:
                 print("📭 データが存在しないため、処理をスキップします。")
+        metrics.count("cycles")
+        # ✅ 読み込めなかった分足があれば、次のサイクルで取り直せるよう指紋を記録しない
+        if feed.get_bar_store().covers(files):
+            feed.scheduler.mark_processed(fingerprint, now)
+    finally:
+        finish_cycle_profile(profiler)
+        metrics.export()
+
+
+# ▼ ----- フィード（監視対象ごとの設定と判定状態。複数のフィードを1プロセスで監視する） -----
+
+FEEDS_CONFIG = os.environ.get("FEEDS_CONFIG", "feeds.json")  
+# ✅ フィード設定（JSON の配列）。ファイルがなければ DROPBOX_FOLDER / FILE_PREFIX の1フィードで動く
+#    例: [{"name": "prime", "folder": "/デイトレファイル", "prefix": "kabuteku",
+#          "email_list": "email_list_prime.txt", "params": {"CROSS_RSI_THRESHOLD_BUY": 35}}]
+#    params に書けるのは SWEEP_PARAMETERS の設定値だけ（閾値・本数・インジケーターの期間）
+
+default_feed = None
+feed_wait_executor = None
+
+
+# ▼ "signal_state.sqlite3" → "signal_state.prime.sqlite3"
+def feed_path(path, name):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+
+class Feed:
+    """1つの監視対象（フォルダ・接頭辞・検出の閾値・宛先）の設定と、その判定状態。
+
+    一覧・取得・判定・通知の関数はフィードを引数で受け取り、取得元（差分一覧のカーソル）・分足の保持・
+    CSVキャッシュ・シグナル履歴はフィードごとに持つ。名前のあるフィードは履歴・アーカイブ・キャッシュを
+    名前ごとに分ける。ダウンロードのスレッドプール、判定のプロセスプール、Dropbox の接続は共有する。
+    """
+
+    def __init__(self, name="", folder=None, prefix=None, email_list=None, params=None, source=None, directory=None):
+        self.name = name
+        self.folder = folder or DROPBOX_FOLDER
+        self.prefix = prefix or FILE_PREFIX
+        self.params = dict(params or {})
+        self.source_kind = source or DATA_SOURCE
+        self.directory = directory or LOCAL_SOURCE_DIR
+        self.signal_store_path = feed_path(SIGNAL_STORE_PATH, name) if name and SIGNAL_STORE_PATH else SIGNAL_STORE_PATH
+        self.archive_dir = os.path.join(ARCHIVE_DIR, name) if name and ARCHIVE_DIR else ARCHIVE_DIR
+        self.csv_cache_dir = os.path.join(CSV_CACHE_DIR, name) if name and CSV_CACHE_DIR else CSV_CACHE_DIR
+        self.recipients = RecipientList(email_list or EMAIL_LIST_PATH)
+
+        self.source = None
+        self.bar_store = None
+        self.signal_store = None
+        self.csv_cache = OrderedDict()  # ファイル名 → (rev, DataFrame)
+        self.warm_start_frames = {}  # 前営業日 → [(hhmm, rev, DataFrame)]（当日分だけ保持）
+        self.scheduler = CycleScheduler()
+        self.longpoll = None
+
+    # ▼ 取得元（初回利用時に作成し、以降は使い回す）
+    def get_source(self):
+        if self.source is None:
+            self.source = make_data_source(
+                self.source_kind, folder=self.folder, directory=self.directory, archive_dir=self.archive_dir, prefix=self.prefix
+            )
+        return self.source
+
+    # ▼ リングバッファ（初回利用時に作成。逐次計算が有効ならその状態も持たせる）
+    def get_bar_store(self):
+        if self.bar_store is None:
+            self.bar_store = BarStore(streaming=StreamingIndicators() if USE_STREAMING_INDICATORS else None)
+        return self.bar_store
+
+    # ▼ シグナル履歴（signal_store_path が空欄なら None）
+    def get_signal_store(self):
+        if self.signal_store is None and self.signal_store_path:
+            self.signal_store = SignalStateStore(self.signal_store_path)
+        return self.signal_store
+
+
+# ▼ モジュールの設定値（DATA_SOURCE・DROPBOX_FOLDER など）どおりの1フィード（初回利用時に作成）
+def get_default_feed():
+    global default_feed
+    if default_feed is None:
+        default_feed = Feed()
+    return default_feed
+
+
+# ▼ FEEDS_CONFIG を読み込む（ファイルがなければ空のリスト＝従来の1フィード）
+def load_feeds(path=None):
+    path = path or FEEDS_CONFIG
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    feeds = []
+    for entry in entries:
+        params = entry.get("params", {})
+        try:
+            check_sweep_parameters(params)
+        except ValueError as e:
+            raise ValueError(f"フィード {entry['name']}: {e}") from None
+        feeds.append(Feed(
+            entry["name"], folder=entry.get("folder"), prefix=entry.get("prefix"), email_list=entry.get("email_list"),
+            params=params, source=entry.get("data_source"), directory=entry.get("directory"),
+        ))
+    names = [feed.name for feed in feeds]
+    if len(set(names)) != len(names):
+        raise ValueError(f"フィード名が重複しています: {', '.join(names)}")
+    print(f"🗂️ フィード設定を読み込みました: {', '.join(names)}")
+    return feeds
+
+
+# ▼ どれかのフィードに新しいファイルが届くまで待つ（ロングポーリングはフィードごとに並行、それ以外は到着予測）
+def wait_for_feeds(feeds):
+    global feed_wait_executor
+    if feed_wait_executor is None:
+        feed_wait_executor = ThreadPoolExecutor(max_workers=len(feeds), thread_name_prefix="feed-longpoll")
+
+    polls, delays = [], []
+    now = get_japan_time()
+    for feed in feeds:
+        source = feed.get_source()
+        if source.supports_push():
+            # ✅ 前回のロングポーリングがまだ続いていればそのまま待つ（同じカーソルで二重に張らない）
+            if feed.longpoll is None or feed.longpoll.done():
+                feed.longpoll = feed_wait_executor.submit(longpoll_folder, source.cursor)
+            polls.append(feed.longpoll)
         else:
-            print(f"⏳ 非稼働時間（週末 or 祝日 or 取引時間外）: {check_date} {check_time.strftime('%H:%M')}")
+            delays.append(feed.scheduler.next_delay(now))
+
+    delay = min(delays) if delays else None
+    if not polls:
+        print(f"⏲️ {delay:.1f}秒待機中...")
+        time.sleep(delay)
+        return
+
+    print(f"⏲️ 新しいファイルを待機中（{len(polls)}フィード）...")
+    done, _ = wait(polls, timeout=delay, return_when=FIRST_COMPLETED)
+    for future in done:
+        if future.exception() is not None:
+            print(f"⚠️ ロングポーリングに失敗しました: {future.exception()}")
+            time.sleep(1)
+            break
+
+
+# ▼ ----- ローカルCSVでのリプレイ（メール送信・待機なしで取引時間の1分ごとに判定） -----
+
+REPLAY_SIGNAL_LOG = "replay_signals.csv"  
+# ✅ リプレイで検出したシグナルの出力先（日付・分・銘柄コード・銘柄名称・シグナル・各項目のJSON）
+
+
+# ▼ 稼働時間帯の hhmm を1分刻みで列挙
+def trading_minutes():
+    minutes = []
+    for start, end in TRADING_SESSIONS:
+        t, end_t = datetime.strptime(start, "%H%M"), datetime.strptime(end, "%H%M")
+        while t <= end_t:
+            minutes.append(t.strftime("%H%M"))
+            t += timedelta(minutes=1)
+    return minutes
+
+
+# ▼ 取得元の一覧 {ファイル名: rev} を、日付ごとの (hhmm, fname, rev) に分ける
+def group_files_by_date(index, prefix=None):
+    by_date = {}
+    for fname, rev in index.items():
+        parsed = parse_minute_filename(fname, prefix)
+        if parsed:
+            by_date.setdefault(parsed[0], []).append((parsed[1], fname, rev))
+    return by_date
+
+
+# ▼ 1日分をリプレイし、検出したシグナルを writer（csv.writer）へ書き出す
+#    分足の保持・キャッシュは feed のもの（省略するとこの日だけのフィードを作る。ライブの状態には触れない）
+def replay_trading_day(source, date, files, writer, feed=None):
+    feed = feed or Feed(source=source.name)
+    feed.source = source
+    feed.get_bar_store().reset(date)
+    first_hhmm = min(hhmm for hhmm, _, _ in files)
+    stepped = evaluated = signals = 0
+    last_window = None
+    start = time.perf_counter()
+
+    for minute in trading_minutes():
+        stepped += 1
+        # ✅ 最初のCSVより前の分は判定しない（list_today_csv_files は先のファイルを返すため）
+        if minute < first_hhmm:
+            continue
+        # ✅ 新しい分足が届いていなければ、ライブのロングポーリングと同じく判定しない
+        window = select_recent_files(files, minute, BAR_WINDOW)
+        if window == last_window:
+            continue
+        last_window = window
 
-        print("⏲️ 1秒待機中...")
-        time.sleep(1)
+        bar_store = update_bar_store(
+            date, window, lambda new_files: load_minute_frames(source, new_files, verbose=False, feed=feed),
+            warm_source=source, feed=feed,
+        )
+        if not bar_store.has_bars(bar_store.window_start):
+            continue
+        indicator_source = current_indicator_source(bar_store, feed.params) if DETECTOR_MODE != "vectorized" else None
+        output_data = evaluate_signals(bar_store, indicator_source=indicator_source, params=feed.params)
+        evaluated += 1
+        signals += len(output_data)
+
+        for row in output_data:
+            fields = json.dumps(signal_fields(row), ensure_ascii=False)
+            writer.writerow([date, minute, row["銘柄コード"], row["銘柄名称"], row["シグナル"], fields])
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"⏩ リプレイ {date}: {stepped}分（判定 {evaluated}回）/ シグナル {signals}件 / "
+        f"{elapsed:.1f}秒（{stepped / elapsed:.1f}分/秒）"
+    )
+    return {"date": date, "minutes": stepped, "evaluated": evaluated, "signals": signals, "seconds": elapsed}
 
-    except Exception as e:
-        print(f"🚫 メインループエラー: {e}")
+
+# ▼ フォルダ内の CSV を日付順にリプレイ（dates を省略すると全日付。latency / jitter で通信遅延を模擬）
+#    archive=True なら directory を分足アーカイブとして読む
+def replay_directory(directory, dates=None, log_path=REPLAY_SIGNAL_LOG, latency=0.0, jitter=0.0, archive=False):
+    if archive:
+        source = ArchiveSource(directory)
+    else:
+        source = LocalSource(directory, use_mmap=LOCAL_SOURCE_MMAP, latency=latency, jitter=jitter)
+    by_date = group_files_by_date(source.list_files())
+    feed = Feed(source=source.name)
+    results = []
+    with open(log_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["日付", "時刻", "銘柄コード", "銘柄名称", "シグナル", "項目"])
+        for date in sorted(dates or by_date):
+            if date not in by_date:
+                print(f"📭 {date} のCSVが見つかりませんでした。")
+                continue
+            results.append(replay_trading_day(source, date, by_date[date], writer, feed=feed))
+
+    if results:
+        minutes = sum(r["minutes"] for r in results)
+        seconds = sum(r["seconds"] for r in results)
+        print(
+            f"✅ リプレイ完了: {len(results)}日 / {minutes}分 / シグナル {sum(r['signals'] for r in results)}件 / "
+            f"{seconds:.1f}秒（{minutes / seconds:.1f}分/秒）→ {log_path}"
+        )
+    return results
+
+
+# ▼ ----- 疑似マーケットデータの生成とベンチマーク -----
+
+BENCHMARK_SIZES = [100, 1000, 4000]  
+# ✅ ベンチマークの銘柄数プリセット（小・中・全市場）
+
+BENCHMARK_MINUTES = BAR_WINDOW  
+# ✅ ベンチマークで生成する分足の本数（既定は保持する本数と同じ）
+
+BENCHMARK_RECIPIENTS = 100  
+# ✅ メール組み立ての計測に使う BCC 宛先の件数
+
+BENCHMARK_OUTPUT = "benchmark_results.json"  
+# ✅ ベンチマーク結果（段階ごとの秒数）の出力先
+
+BENCHMARK_REGRESSION_RATIO = 1.2  
+# ✅ 前回の結果と比べ、この倍率以上遅くなった段階を「悪化」として表示する
+
+
+# ▼ kabuteku 形式の分足CSV（N銘柄 × M分）を {ファイル名: bytes} で生成する
+def generate_synthetic_market(n_symbols, n_minutes, date="20250106", seed=0, missing_rate=0.02):
+    rng = np.random.default_rng(seed)
+    codes = np.array([str(1301 + i) for i in range(n_symbols)], dtype=object)
+    names = np.array([f"銘柄{code}" for code in codes], dtype=object)
+
+    # 銘柄ごとの株価水準・ボラティリティ・当日の地合い（トレンド）・出来高水準
+    price = np.exp(rng.normal(7.0, 0.8, n_symbols))
+    volatility = rng.uniform(0.0008, 0.004, n_symbols)
+    drift = rng.normal(0, 0.0004, n_symbols)
+    base_volume = np.exp(rng.normal(8.0, 1.2, n_symbols))
+    volume = np.zeros(n_symbols)
+    previous_close = np.round(price, 1)
+    open_price = None
+
+    files = {}
+    for hhmm in trading_minutes()[:n_minutes]:
+        market = rng.normal(0, 0.0006)
+        price = price * np.exp(market + drift + volatility * rng.standard_normal(n_symbols))
+        close = np.round(price, 1)
+        high = np.round(close * (1 + np.abs(rng.normal(0, 0.6, n_symbols)) * volatility), 1)
+        low = np.round(close * (1 - np.abs(rng.normal(0, 0.6, n_symbols)) * volatility), 1)
+        spike = np.where(rng.random(n_symbols) < 0.03, rng.uniform(3, 8, n_symbols), 1.0)
+        volume = volume + np.floor(base_volume * rng.gamma(2.0, 0.5, n_symbols) * spike)
+        open_price = close if open_price is None else open_price
+
+        # ✅ 検出には使わない列（始値・前日比・売買代金）も実際の全銘柄CSVと同じように含める
+        keep = rng.random(n_symbols) >= missing_rate
+        frame = pd.DataFrame({
+            "銘柄コード": codes[keep],
+            "銘柄名称": names[keep],
+            "始値": open_price[keep],
+            "現在値": close[keep],
+            "高値": high[keep],
+            "安値": low[keep],
+            "前日比": np.round(close - previous_close, 1)[keep],
+            "出来高": volume[keep].astype(np.int64),
+            "売買代金": np.round(volume * close)[keep].astype(np.int64),
+        })
+        files[f"{FILE_PREFIX}{date}_{hhmm}.csv"] = frame.to_csv(index=False).encode("utf-8")
+    return files
+
+
+# ▼ 生成したCSVをフォルダへ書き出す（replay / DATA_SOURCE="local" 用）
+def write_synthetic_market(directory, n_symbols, n_minutes, date="20250106", seed=0):
+    os.makedirs(directory, exist_ok=True)
+    files = generate_synthetic_market(n_symbols, n_minutes, date=date, seed=seed)
+    for fname, content in files.items():
+        with open(os.path.join(directory, fname), "wb") as f:
+            f.write(content)
+    print(f"🧪 {directory} に {n_symbols}銘柄 × {len(files)}分 のCSVを書き出しました。")
+    return sorted(files)
+
+
+# ▼ 1サイズぶんの段階別計測（一覧 → 取得・解析 → 結合 → インジケーター → 各検出関数 → HTML → メール組み立て）
+def benchmark_pipeline(n_symbols, n_minutes=BENCHMARK_MINUTES, repeat=1, seed=0, date="20250106"):
+    files = generate_synthetic_market(n_symbols, n_minutes, date=date, seed=seed)
+    last_hhmm = max(fname[-8:-4] for fname in files)
+    stages = {}
+
+    def timed(stage, func):
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed.append(time.perf_counter() - start)
+        stages[stage] = min(elapsed)
+        return result
+
+    def download():
+        feed.csv_cache.clear()
+        return load_minute_frames(source, listing, verbose=False, feed=feed)
+
+    def concat_sort():
+        feed.bar_store = None
+        store = feed.get_bar_store()
+        store.reset(date)
+        for hhmm, fname, rev in listing:
+            store.append(hhmm, rev, frames[hhmm])
+        store.window_start = listing[0][0]
+        return store.to_frame(since_hhmm=listing[0][0])
+
+    feed = Feed(source="memory")
+    source = feed.source = MemorySource(files)
+    listing = timed(
+        "listing", lambda: list_today_csv_files(target_date=date, limit=BAR_WINDOW, current_hhmm=last_hhmm, feed=feed)
+    )
+    frames = timed("download_parse", download)
+    frame_bytes = frames_memory_bytes(frames.values())
+    untyped_bytes = frames_memory_bytes([pd.read_csv(io.BytesIO(content)) for content in files.values()])
+    df_all = timed("concat_sort", concat_sort)
+    codes, names, values, present = timed("align", lambda: frame_to_aligned_window(df_all))
+    indicators = timed("indicators", lambda: compute_detector_indicators(values, present))
+
+    # ▼ 銘柄ごとの検出関数は、一括計算済みのインジケーターを渡して1関数ずつ全銘柄を計測
+    precomputed = {code: {key: matrix[i] for key, matrix in indicators.items()} for i, code in enumerate(codes)}
+    groups = list(df_all.groupby("銘柄コード"))
+    for detector in SIGNAL_DETECTORS:
+        timed(detector.name, lambda: [detector.detect(FeatureFrame(g, precomputed=precomputed.get(code))) for code, g in groups])
+
+    output_data = timed("detect_signals_vectorized", lambda: detect_signals_vectorized(codes, names, values, present, indicators))
+    html_content = timed("format_output_html", lambda: format_output_html(signals_to_dataframe(output_data))) if output_data else ""
+    recipients = [f"user{i}@example.com" for i in range(BENCHMARK_RECIPIENTS)]
+    timed("email_build", lambda: build_signal_email(html_content, last_hhmm, "sender@example.com", recipients).get())
+
+    return {
+        "symbols": n_symbols,
+        "minutes": len(files),
+        "rows": len(df_all),
+        "signals": len(output_data),
+        "frame_bytes": int(frame_bytes),
+        "frame_bytes_untyped": int(untyped_bytes),
+        "stages": stages,
+    }
+
+
+# ▼ 前回の結果と段階ごとに比べ、BENCHMARK_REGRESSION_RATIO 倍以上遅くなったものを表示
+def compare_benchmarks(previous, current):
+    before = {r["symbols"]: r["stages"] for r in previous.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        for stage, seconds in result["stages"].items():
+            old = before.get(result["symbols"], {}).get(stage)
+            if old and seconds >= old * BENCHMARK_REGRESSION_RATIO:
+                regressions.append((result["symbols"], stage, old, seconds))
+                print(f"⚠️ 悪化: {result['symbols']}銘柄 {stage} {old:.4f}秒 → {seconds:.4f}秒（{seconds / old:.2f}倍）")
+    if not regressions:
+        print("✅ 前回の結果から悪化した段階はありません。")
+    return regressions
+
+
+# ▼ サイズごとにベンチマークを実行し、JSON に保存する（compare に前回の JSON を渡すと悪化を表示）
+def run_benchmark(sizes=None, n_minutes=BENCHMARK_MINUTES, repeat=1, output_path=BENCHMARK_OUTPUT, label="", compare=None):
+    report = {
+        "label": label,
+        "created_at": datetime.now(JST).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "detector_mode": DETECTOR_MODE,
+        "repeat": repeat,
+        "results": [],
+    }
+    for n_symbols in sizes or BENCHMARK_SIZES:
+        result = benchmark_pipeline(n_symbols, n_minutes=n_minutes, repeat=repeat)
+        report["results"].append(result)
+        print(f"⏱️ {n_symbols}銘柄 × {result['minutes']}分（シグナル {result['signals']}件）")
+        print(
+            f"    分足DataFrameのメモリ: {result['frame_bytes'] / 1e6:.1f}MB"
+            f"（型指定なしの read_csv: {result['frame_bytes_untyped'] / 1e6:.1f}MB）"
+        )
+        for stage, seconds in result["stages"].items():
+            print(f"    {stage:<28} {seconds:8.4f}秒")
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ ベンチマーク結果を保存しました → {output_path}")
+
+    if compare:
+        with open(compare, "r", encoding="utf-8") as f:
+            compare_benchmarks(json.load(f), report)
+    return report
+
+
+# ▼ ----- パラメータスイープ（過去の分足で設定値の組み合わせを評価） -----
+
+SWEEP_HORIZONS = [5, 15, 30]  
+# ✅ フォワードリターンを測る本数（シグナルが出た分足から何本後の現在値と比べるか）
+
+SWEEP_STEP = 1  
+# ✅ 判定する間隔（分足の本数）。5 なら5本ごとに判定する
+
+SWEEP_WORKERS = 0  
+# ✅ 並列に動かすプロセス数（0 なら CPU コア数）
+
+SWEEP_OUTPUT = "sweep_results.csv"
+
+SWEEP_PARAMETERS = [
+    "UPTREND_HIGH_LOW_LENGTH", "VOLATILITY_THRESHOLD", "RSI_UP_THRESHOLD", "RSI_DOWN_THRESHOLD",
+    "USE_RSI_FOR_CROSS", "CROSS_RSI_THRESHOLD_BUY", "CROSS_RSI_THRESHOLD_SELL",
+    "CROSS_USE_VOLATILITY_FILTER", "CROSS_VOLATILITY_THRESHOLD",
+    "BOX_BREAKOUT_TOLERANCE", "BOX_BREAKOUT_USE_VOLUME_SPIKE", "BOX_BREAKOUT_VOLUME_RATIO",
+    "BOX_BREAKOUT_USE_VOLATILITY_SPIKE", "BOX_BREAKOUT_VOLATILITY_RATIO",
+    "BREAKOUT_VOLUME_RATIO", "BREAKOUT_USE_VOLATILITY_SPIKE", "BREAKOUT_VOLATILITY_RATIO",
+    "DOUBLE_PATTERN_MIN_PEAKS", "DOUBLE_PATTERN_TOLERANCE", "DOUBLE_PATTERN_VOLUME_SPIKE_RATIO",
+    "DOUBLE_PATTERN_VOLATILITY_JUMP", "DOUBLE_PATTERN_VOLATILITY_RATIO",
+    "UPTREND_LOOKBACK", "PULLBACK_LOOKBACK", "CROSS_SLOPE_LOOKBACK", "CROSS_PREV_ORDER_LOOKBACK",
+    "BOX_BREAKOUT_LOOKBACK", "BREAKOUT_LOOKBACK", "DOUBLE_PATTERN_LOOKBACK",
+    "MA_SHORT_WINDOW", "MA_MID_WINDOW", "MA_LONG_WINDOW", "STD_WINDOW", "RSI_PERIOD",
+    "MACD_SHORT", "MACD_LONG", "MACD_SIGNAL", "VOLUME_RECENT_WINDOW", "VOLUME_PAST_WINDOW",
+]
+# ✅ スイープ・フィードで変えられる設定値（検出関数・インジケーターの計算が params として受け取るもの）
+#    閾値・検出関数の本数・インジケーターの期間。ここにない名前は受け付けない
+
+FIXED_PARAMETERS = ["BAR_WINDOW", "TREND_TAIL", "CROSS_TAIL"]
+# ✅ 組み合わせごとには変えられない本数（分足の保持と、インジケーターを計算する区間の長さ）
+
+INDICATOR_PARAMETERS = {
+    "MA_5": ["MA_SHORT_WINDOW"],
+    "MA_25": ["MA_MID_WINDOW"],
+    "MA_60": ["MA_LONG_WINDOW"],
+    "標準偏差": ["STD_WINDOW"],
+    "RSI": ["RSI_PERIOD"],
+    "MACDヒストグラム": ["MACD_SHORT", "MACD_LONG", "MACD_SIGNAL"],
+    "出来高平均_直近": ["VOLUME_RECENT_WINDOW"],
+    "出来高平均_過去": ["VOLUME_RECENT_WINDOW", "VOLUME_PAST_WINDOW"],
+}
+# ✅ インジケーター → 計算に使う設定値（これ以外の設定値だけを変える組み合わせでは計算結果を使い回す）
+#    逐次インジケーターはモジュールの期間で作るため、これらを変えたフィードは一括計算を使う
+
+
+# ▼ 検出の設定値 {設定値: 値}（SWEEP_PARAMETERS の各値。params にあるものはそちらを使う）
+#    モジュール定数は書き換えないので、フィードやスイープの組み合わせごとの値を並行して使える
+def detector_parameters(params=None):
+    module = globals()
+    resolved = {name: module[name] for name in SWEEP_PARAMETERS}
+    resolved.update(params or {})
+    return resolved
+
+
+# ▼ インジケーターの期間のどれかがモジュールの設定値と違うか（params は detector_parameters() の戻り値）
+def indicator_parameters_changed(params):
+    module = globals()
+    return any(params[name] != module[name] for names in INDICATOR_PARAMETERS.values() for name in names)
+
+
+# ▼ SWEEP_PARAMETERS にない設定値があれば ValueError
+def check_sweep_parameters(names):
+    fixed = [name for name in names if name in FIXED_PARAMETERS]
+    if fixed:
+        raise ValueError(f"分足の窓・インジケーターを計算する本数は変えられません: {', '.join(fixed)}")
+    unknown = [name for name in names if name not in SWEEP_PARAMETERS]
+    if unknown:
+        raise ValueError(f"未対応の設定値です（SWEEP_PARAMETERS のみ）: {', '.join(unknown)}")
+
+
+# ▼ "CROSS_RSI_THRESHOLD_BUY=35,40" → ("CROSS_RSI_THRESHOLD_BUY", [35, 40])
+#    "DOUBLE_PATTERN_TOLERANCE=0.005:0.02" → ("DOUBLE_PATTERN_TOLERANCE", (0.005, 0.02))
+def parse_parameter_option(option):
+    name, _, spec = option.partition("=")
+    name = name.strip()
+    check_sweep_parameters([name])
+    if ":" in spec:
+        low, high = (ast.literal_eval(value.strip()) for value in spec.split(":", 1))
+        return name, (low, high)
+    return name, [ast.literal_eval(value.strip()) for value in spec.split(",")]
+
+
+# ▼ 探索空間 {設定値: 候補の list または (下限, 上限)} → 組み合わせの list
+#    samples を指定するとランダム探索（list は候補から、(下限, 上限) は一様に選ぶ。両端が整数なら整数）
+def parameter_sets(space, samples=None, seed=0):
+    if samples is None:
+        if any(isinstance(values, tuple) for values in space.values()):
+            raise ValueError("範囲指定（下限:上限）はランダム探索（--random）でのみ使えます")
+        names = list(space)
+        return [dict(zip(names, combo)) for combo in itertools.product(*(space[name] for name in names))]
+
+    rng = random.Random(seed)
+    sets = []
+    for _ in range(samples):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                params[name] = rng.randint(low, high) if isinstance(low, int) and isinstance(high, int) else rng.uniform(low, high)
+            else:
+                params[name] = rng.choice(values)
+        sets.append(params)
+    return sets
+
+
+# ▼ compute_detector_indicators と同じ結果を、cache（{(列名, tail, 依存する設定値): 配列}）を使い回して用意する
+#    （INDICATOR_PARAMETERS にない設定値だけが違う組み合わせでは、同じ配列を返す）
+def compute_detector_indicators_cached(values, present, cache, params=None):
+    params = detector_parameters(params)
+    width = values.shape[1]
+    needed = [(key, None) for key in INDICATOR_KEYS]
+    needed += [(key, tail) for tail, keys in detector_indicator_tails(params).items() if tail < width for key in keys]
+    matrices = {}
+    for key, tail in needed:
+        cache_key = (key, tail, tuple(params[name] for name in INDICATOR_PARAMETERS[key]))
+        if cache_key not in cache:
+            window = (values, present) if tail is None else (values[:, -tail:], present[:, -tail:])
+            cache[cache_key] = compute_indicator_matrix(*window, keys=[key], params=params)[key]
+        matrices[(key, tail)] = cache[cache_key]
+    return matrices
+
+
+# ▼ 1日分のうち分足 [start, stop) の位置で判定し、組み合わせ × シグナルごとの件数とフォワードリターンを集計する
+#    （ワーカープロセスで実行。分足は窓の先頭ぶんとフォワードリターンに使う後ろの分も読む）
+def sweep_day_chunk(source_spec, date, files, start, stop, sets, horizons, step):
+    kind, directory = source_spec
+    source = ArchiveSource(directory) if kind == "archive" else LocalSource(directory)
+    first = max(0, start - BAR_WINDOW + 1)
+    last = min(len(files), stop + max(horizons))
+    # ✅ この区間だけのフィードで読む（ディスクキャッシュは使わず、ワーカーが引き継いだ既定のフィードにも触れない）
+    feed = Feed(source=kind, directory=directory)
+    feed.csv_cache_dir = ""
+    frames = load_minute_frames(source, files[first:last], verbose=False, feed=feed)
+
+    # ▼ フォワードリターン用の終値表（銘柄コード → 分足の位置ごとの現在値）
+    closes = {}
+    for i in range(first, last):
+        df = frames.get(files[i][0])
+        if df is not None:
+            for code, price in zip(df["銘柄コード"].astype(str), df["現在値"].to_numpy(dtype=float)):
+                closes.setdefault(code, {})[i] = round(price, CSV_PRICE_DECIMALS) if CSV_PRICE_DECIMALS is not None else price
+
+    store = BarStore(initial_symbols=1024)
+    store.reset(date)
+    stats = {}
+    for i in range(first, stop):
+        hhmm, _, rev = files[i]
+        if hhmm in frames:
+            store.append(hhmm, rev, frames[hhmm])
+        if i < start or i % step:
+            continue
+        store.window_start = files[max(0, i - BAR_WINDOW + 1)][0]
+        if not store.has_bars(store.window_start):
+            continue
+        codes, names, values, present = window_arrays(store)
+
+        cache = {}
+        for set_id, params in enumerate(sets):
+            indicators = compute_detector_indicators_cached(values, present, cache, params)
+            output_data = detect_signals_vectorized(codes, names, values, present, indicators, params=params)
+            for row in output_data:
+                direction = 1.0 if "買い目" in row["シグナル"] else -1.0
+                for key in ((set_id, row["シグナル"]), (set_id, "全体")):
+                    entry = stats.setdefault(key, {"signals": 0, "returns": {h: [] for h in horizons}})
+                    entry["signals"] += 1
+                    future = closes.get(str(row["銘柄コード"]), {})
+                    for h in horizons:
+                        if i + h in future and row["現在値"]:
+                            entry["returns"][h].append(direction * (future[i + h] / row["現在値"] - 1.0))
+    return stats
+
+
+# ▼ 集計を組み合わせ × シグナルごとの表にする（リターンは %）
+def sweep_results_table(sets, stats, horizons):
+    rows = []
+    for (set_id, signal_name), entry in sorted(stats.items(), key=lambda item: (item[0][0], item[0][1] != "全体", item[0][1])):
+        row = {"組み合わせ": set_id, **sets[set_id], "シグナル": signal_name, "件数": entry["signals"]}
+        for h in horizons:
+            returns = np.asarray(entry["returns"][h])
+            row[f"平均リターン_{h}分"] = round(float(returns.mean()) * 100, 4) if len(returns) else np.nan
+            row[f"勝率_{h}分"] = round(float((returns > 0).mean()), 4) if len(returns) else np.nan
+            row[f"件数_{h}分"] = len(returns)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# ▼ フォルダ（CSV または分足アーカイブ）の過去日で、設定値の組み合わせをすべて評価する
+#    ウォームスタートはしない（各日を当日の分足だけで判定する）ので、件数がリプレイと一致するのは WARM_START=False のとき
+def run_parameter_sweep(directory, sets, dates=None, archive=False, horizons=None, step=None, workers=None, output_path=SWEEP_OUTPUT):
+    check_sweep_parameters({name for params in sets for name in params})
+    horizons = horizons or SWEEP_HORIZONS
+    step = step or SWEEP_STEP
+    workers = workers or SWEEP_WORKERS or os.cpu_count() or 1
+    source_spec = ("archive", directory) if archive else ("local", directory)
+    source = ArchiveSource(directory) if archive else LocalSource(directory)
+    by_date = group_files_by_date(source.list_files())
+
+    # ✅ 日ごとに分足の位置を区切ってワーカーへ配る（各ワーカーは担当区間の判定を全組み合わせで行い、インジケーターを使い回す）
+    tasks = []
+    for date in sorted(dates or by_date):
+        files = sorted(by_date.get(date, []))
+        if not files:
+            print(f"📭 {date} のCSVが見つかりませんでした。")
+            continue
+        chunks = max(1, min(workers * 2, len(files) // max(BAR_WINDOW // 3, 1)))
+        bounds = np.linspace(0, len(files), chunks + 1).astype(int)
+        tasks += [(source_spec, date, files, int(a), int(b), sets, horizons, step) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    start = time.perf_counter()
+    stats = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial in executor.map(sweep_day_chunk, *zip(*tasks)) if tasks else []:
+            for key, entry in partial.items():
+                merged = stats.setdefault(key, {"signals": 0, "returns": {h: [] for h in horizons}})
+                merged["signals"] += entry["signals"]
+                for h in horizons:
+                    merged["returns"][h].extend(entry["returns"][h])
+
+    table = sweep_results_table(sets, stats, horizons)
+    table.to_csv(output_path, index=False, encoding="utf-8")
+    print(
+        f"✅ スイープ完了: {len(sets)}通り × {len({task[1] for task in tasks})}日（{len(tasks)}区間 / {workers}プロセス）"
+        f" {time.perf_counter() - start:.1f}秒 → {output_path}"
+    )
+    return table
+
+
+# ▼ コマンドライン引数（サブコマンドなしなら監視ループを実行）
+def parse_command_line(argv=None):
+    parser = argparse.ArgumentParser(description="分足CSVのシグナル監視")
+    commands = parser.add_subparsers(dest="command")
+
+    replay = commands.add_parser("replay", help="ローカルのCSVで過去日をリプレイ（メール送信なし）")
+    replay.add_argument("directory", help="kabuteku{date}_{hhmm}.csv を置いたフォルダ")
+    replay.add_argument("dates", nargs="*", help="YYYYMMDD（省略時はフォルダ内の全日付）")
+    replay.add_argument("--log", default=REPLAY_SIGNAL_LOG, help="シグナルの出力先CSV")
+    replay.add_argument("--latency", type=float, default=0.0, help="CSV読み込みごとに足す疑似遅延（秒）")
+    replay.add_argument("--jitter", type=float, default=0.0, help="疑似遅延のばらつきの最大値（秒）")
+    replay.add_argument("--archive", action="store_true", help="directory を分足アーカイブ（ARCHIVE_DIR）として読む")
+
+    archive = commands.add_parser("archive", help="分足アーカイブの確認・日ごとのまとめ")
+    archive.add_argument("dates", nargs="*", help="YYYYMMDD（省略時はアーカイブ内の全日付）")
+    archive.add_argument("--dir", default=ARCHIVE_DIR)
+    archive.add_argument("--compact", action="store_true", help="分足ファイルを日ごとの day.arrow にまとめる")
+    archive.add_argument("--field", default="現在値", help="表示する項目（銘柄 × 時刻の表）")
+    archive.add_argument("--codes", nargs="*", help="表示する銘柄コード")
+
+    generate = commands.add_parser("generate", help="kabuteku 形式の疑似CSVをフォルダへ書き出す")
+    generate.add_argument("directory")
+    generate.add_argument("--symbols", type=int, default=1000)
+    generate.add_argument("--minutes", type=int, default=len(trading_minutes()))
+    generate.add_argument("--date", default="20250106")
+    generate.add_argument("--seed", type=int, default=0)
+
+    sweep = commands.add_parser("sweep", help="過去の分足で設定値の組み合わせを評価（シグナル数とフォワードリターン）")
+    sweep.add_argument("directory", help="kabuteku{date}_{hhmm}.csv を置いたフォルダ（--archive なら分足アーカイブ）")
+    sweep.add_argument("dates", nargs="*", help="YYYYMMDD（省略時はフォルダ内の全日付）")
+    sweep.add_argument("--param", action="append", default=[], help="NAME=v1,v2,...（候補）または NAME=下限:上限（--random のみ）。NAME は SWEEP_PARAMETERS のいずれか")
+    sweep.add_argument("--random", type=int, help="ランダム探索で評価する組み合わせの数（省略時は全組み合わせ）")
+    sweep.add_argument("--seed", type=int, default=0)
+    sweep.add_argument("--archive", action="store_true", help="directory を分足アーカイブとして読む")
+    sweep.add_argument("--horizons", type=int, nargs="+", default=SWEEP_HORIZONS, help="フォワードリターンの本数")
+    sweep.add_argument("--step", type=int, default=SWEEP_STEP, help="判定する間隔（分足の本数）")
+    sweep.add_argument("--workers", type=int, default=SWEEP_WORKERS, help="プロセス数（0 なら CPU コア数）")
+    sweep.add_argument("--output", default=SWEEP_OUTPUT)
+
+    history = commands.add_parser("history", help="記録したシグナルの履歴を表示（引け後の振り返り用）")
+    history.add_argument("date", help="YYYYMMDD")
+    history.add_argument("--active", action="store_true", help="未解除のシグナルだけ表示")
+    history.add_argument("--db", default=SIGNAL_STORE_PATH, help="SQLite ファイル")
+
+    fake_sendgrid = commands.add_parser("fake-sendgrid", help="テスト用の SendGrid もどきを起動（SENDGRID_HOST に指定する）")
+    fake_sendgrid.add_argument("--port", type=int, default=8025)
+    fake_sendgrid.add_argument("--fail-rate", type=float, default=0.0, help="429/5xx を返す割合")
+    fake_sendgrid.add_argument("--latency", type=float, default=0.0, help="応答までの遅延（秒）")
+    fake_sendgrid.add_argument("--log", help="受けたメールを JSON Lines で追記するファイル")
+
+    benchmark = commands.add_parser("benchmark", help="疑似データで段階ごとの所要時間を計測し JSON に保存")
+    benchmark.add_argument("--sizes", type=int, nargs="+", default=BENCHMARK_SIZES, help="銘柄数（既定: 100 1000 4000）")
+    benchmark.add_argument("--minutes", type=int, default=BENCHMARK_MINUTES)
+    benchmark.add_argument("--repeat", type=int, default=1, help="各段階を何回計測して最速を採るか")
+    benchmark.add_argument("--output", default=BENCHMARK_OUTPUT)
+    benchmark.add_argument("--label", default="", help="結果に残す版の名前など")
+    benchmark.add_argument("--compare", help="比較する前回の結果 JSON")
+    return parser.parse_args(argv)
+
+
+# ▼ 修正済み：監視ループ本体（build_intraday_dataframe() で当日CSVを全件取得）
+if __name__ == "__main__":
+    args = parse_command_line()
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, request_cycle_profile)
+    if args.command == "replay":
+        replay_directory(
+            args.directory, dates=args.dates, log_path=args.log, latency=args.latency, jitter=args.jitter, archive=args.archive
+        )
+        sys.exit(0)
+    if args.command == "archive":
+        for date in args.dates or archive_dates(args.dir):
+            if args.compact:
+                compact_archive_day(date, args.dir)
+            with pd.option_context("display.max_columns", 12, "display.width", 200):
+                print(archive_matrix(date, field=args.field, codes=args.codes, directory=args.dir))
+        sys.exit(0)
+    if args.command == "generate":
+        write_synthetic_market(args.directory, args.symbols, args.minutes, date=args.date, seed=args.seed)
+        sys.exit(0)
+    if args.command == "sweep":
+        space = dict(parse_parameter_option(option) for option in args.param)
+        table = run_parameter_sweep(
+            args.directory, parameter_sets(space, samples=args.random, seed=args.seed), dates=args.dates, archive=args.archive,
+            horizons=args.horizons, step=args.step, workers=args.workers, output_path=args.output,
+        )
+        with pd.option_context("display.max_rows", 200, "display.width", 200):
+            print(table[table["シグナル"] == "全体"])
+        sys.exit(0)
+    if args.command == "history":
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(SignalStateStore(args.db).history(args.date, active_only=args.active))
+        sys.exit(0)
+    if args.command == "fake-sendgrid":
+        run_fake_sendgrid(port=args.port, fail_rate=args.fail_rate, latency=args.latency, log_path=args.log)
+        sys.exit(0)
+    if args.command == "benchmark":
+        run_benchmark(args.sizes, n_minutes=args.minutes, repeat=args.repeat, output_path=args.output, label=args.label, compare=args.compare)
+        sys.exit(0)
+
+    feeds = load_feeds()
+    for feed in feeds or [get_default_feed()]:
+        try:
+            maintain_archive(TEST_DATE or get_japan_time().strftime("%Y%m%d"), feed.archive_dir)
+        except Exception as e:
+            print(f"⚠️ アーカイブの整理に失敗しました: {e}")
+    while True:
+        try:
+            now = get_japan_time()
+
+            # ▼ テスト日・テスト時刻があればそれを使う
+            check_date = datetime.strptime(TEST_DATE, "%Y%m%d").date() if TEST_DATE else now.date()
+            check_time = datetime.strptime(TEST_TIME, "%H%M").time() if TEST_TIME else now.time()
+            current_time_str = TEST_TIME if TEST_TIME else now.strftime("%H%M")
+            today_date_str = TEST_DATE if TEST_DATE else now.strftime("%Y%m%d")
+
+            # ▼ 稼働条件チェック（営業日・取引時間帯は日付ごとに作ったカレンダーで判定）
+            calendar = get_trading_calendar(check_date)
+
+            if calendar.is_open(check_time):
+                if feeds:
+                    # ▼ フィードを順に判定（取得・判定のプールは共有）し、どれかに新しいファイルが届くまで待機
+                    for feed in feeds:
+                        try:
+                            run_cycle(feed, today_date_str, current_time_str, now)
+                        except Exception as e:
+                            print(f"🚫 フィード {feed.name} の処理エラー: {e}")
+                    with metrics.time("wait"):
+                        wait_for_feeds(feeds)
+                else:
+                    feed = get_default_feed()
+                    run_cycle(feed, today_date_str, current_time_str, now)
+
+                    # ▼ 次の分足ファイルが届くまで待機（ロングポーリング / 到着予測）
+                    with metrics.time("wait"):
+                        feed.scheduler.wait(feed.get_source())
+            else:
+                print(f"⏳ 非稼働時間（週末 or 祝日 or 取引時間外）: {check_date} {check_time.strftime('%H:%M')}")
+                until_open = calendar.seconds_until_open(check_time)
+                if WARM_START and until_open:
+                    # ✅ 寄り付き前に前営業日の分足を用意しておき、最初の判定でまとめて取得しない
+                    for feed in feeds or [get_default_feed()]:
+                        try:
+                            load_warm_start_frames(today_date_str, feed.get_source(), archive=True, feed=feed)
+                        except Exception as e:
+                            print(f"⚠️ ウォームスタートの準備に失敗しました: {e}")
+                delay = min(until_open, SCHEDULER_IDLE_MAX_SLEEP) if until_open else SCHEDULER_IDLE_MAX_SLEEP
+                delay = max(delay, SCHEDULER_POLL_INTERVAL)
+                print(f"⏲️ {delay:.0f}秒待機中...")
+                time.sleep(delay)
+
+        except Exception as e:
+            print(f"🚫 メインループエラー: {e}")
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# ▼ リポジトリ直下の app.py を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# ▼ キャッシュ・履歴などの出力先をテストごとの一時フォルダにする
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+# ▼ kabuteku 形式の分足CSV（N銘柄 × M分。9:00 から1分刻み）を {ファイル名: bytes} で作る
+def make_minute_csvs(n_symbols=30, n_minutes=70, date="20250106", seed=0):
+    rng = np.random.default_rng(seed)
+    codes = [str(1301 + i) for i in range(n_symbols)]
+    price = np.exp(rng.normal(7.0, 0.8, n_symbols))
+    volatility = rng.uniform(0.0008, 0.004, n_symbols)
+    drift = rng.normal(0, 0.0004, n_symbols)
+    volume = np.zeros(n_symbols)
+
+    files = {}
+    for minute in range(n_minutes):
+        price = price * np.exp(drift + volatility * rng.standard_normal(n_symbols))
+        close = np.round(price, 1)
+        spike = np.where(rng.random(n_symbols) < 0.03, rng.uniform(3, 8, n_symbols), 1.0)
+        volume = volume + np.floor(np.exp(8.0) * rng.gamma(2.0, 0.5, n_symbols) * spike)
+        frame = pd.DataFrame({
+            "銘柄コード": codes,
+            "銘柄名称": [f"銘柄{code}" for code in codes],
+            "現在値": close,
+            "高値": np.round(close * (1 + np.abs(rng.normal(0, 0.6, n_symbols)) * volatility), 1),
+            "安値": np.round(close * (1 - np.abs(rng.normal(0, 0.6, n_symbols)) * volatility), 1),
+            "出来高": volume.astype(np.int64),
+        })
+        hhmm = f"{9 + minute // 60:02d}{minute % 60:02d}"
+        files[f"kabuteku{date}_{hhmm}.csv"] = frame.to_csv(index=False).encode("utf-8")
+    return files
+
+
+@pytest.fixture
+def minute_csvs():
+    return make_minute_csvs
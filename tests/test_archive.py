@@ -0,0 +1,121 @@
+import csv
+import io
+
+import numpy as np
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+pytest.importorskip("pyarrow")
+
+DATES = ["20250106", "20250107"]
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(app, "archive_revs", {})
+    monkeypatch.setattr(app, "default_feed", None)
+    return tmp_path / "archive"
+
+
+@pytest.fixture
+def market():
+    files = {}
+    for seed, date in enumerate(DATES):
+        files.update(make_minute_csvs(n_symbols=20, n_minutes=70, date=date, seed=seed))
+    return app.MemorySource(files)
+
+
+# ▼ ライブの監視ループと同じく1分ずつ取り込み、アーカイブへ保存する
+def ingest(source, date, archive=True):
+    files = sorted(app.group_files_by_date(source.list_files())[date])
+    for i in range(1, len(files) + 1):
+        window = files[max(0, i - app.BAR_WINDOW):i]
+        app.update_bar_store(date, window, lambda new_files: app.load_minute_frames(source, new_files, verbose=False), archive=archive)
+    return files
+
+
+def replay_rows(source, date):
+    buffer = io.StringIO()
+    files = app.group_files_by_date(source.list_files())[date]
+    app.replay_trading_day(source, date, files, csv.writer(buffer))
+    return buffer.getvalue()
+
+
+def test_minutes_are_archived_once_and_compacted_on_rollover(market, archive_dir):
+    files = ingest(market, DATES[0])
+    assert len(list((archive_dir / f"date={DATES[0]}").glob("*.arrow"))) == len(files)
+
+    hhmm, fname, rev = files[-1]
+    assert not app.archive_minute(DATES[0], hhmm, rev, app.read_minute_csv(market.read(fname)))
+
+    ingest(market, DATES[1])
+    assert [p.name for p in (archive_dir / f"date={DATES[0]}").iterdir()] == [app.ARCHIVE_DAY_FILE]
+    assert app.archive_dates() == DATES
+
+    table, offsets = app.load_archive_day(DATES[0])
+    assert sorted(offsets) == [hhmm for hhmm, _, _ in files]
+    assert table.num_rows == 20 * len(files)
+
+
+def test_read_archive_slices_dates_and_minutes(market):
+    ingest(market, DATES[0])
+    ingest(market, DATES[1])
+
+    table = app.read_archive(DATES[0], DATES[1], start_hhmm="0930", end_hhmm="0939", codes=["1301", "1302"])
+    assert table.num_rows == 2 * 2 * 10
+    assert set(table["日付"].to_pylist()) == set(DATES)
+
+    matrix = app.archive_matrix(DATES[1], start_hhmm="0930", end_hhmm="0930")
+    expected = app.read_minute_csv(market.read(f"kabuteku{DATES[1]}_0930.csv")).set_index("銘柄コード")["現在値"]
+    np.testing.assert_allclose(matrix[(DATES[1], "0930")].to_numpy(), expected.loc[matrix.index.astype(str)].to_numpy())
+
+
+def test_replay_from_archive_matches_the_csvs(market):
+    ingest(market, DATES[0])
+    ingest(market, DATES[1])  # 前日はまとめたファイル、当日は分足ファイルのまま
+    expected = [replay_rows(market, date) for date in DATES]
+
+    assert all(expected)
+    assert [replay_rows(app.ArchiveSource(), date) for date in DATES] == expected
+
+
+def test_replay_never_writes_the_archive(market, archive_dir):
+    ingest(market, DATES[0], archive=False)
+    replay_rows(market, DATES[1])
+
+    assert not archive_dir.exists()
+
+
+# ▼ 前日のうちに止まって分足ファイルが残っていても、起動時の整理でまとめ、保持日数より古い日付は消す
+def test_maintain_archive_compacts_leftovers_and_expires_old_days(market, archive_dir, monkeypatch):
+    ingest(market, DATES[0])
+    ingest(market, DATES[1])
+    app.maintain_archive("20250108")
+
+    assert [p.name for p in (archive_dir / f"date={DATES[1]}").iterdir()] == [app.ARCHIVE_DAY_FILE]
+    assert app.archive_dates() == DATES
+
+    monkeypatch.setattr(app, "ARCHIVE_RETENTION_DAYS", 1)
+    app.maintain_archive("20250108")
+    assert app.archive_dates() == DATES[1:]
+    assert (app.ARCHIVE_DIR, DATES[0]) not in app.archive_revs
+
+
+def test_maintain_archive_leaves_today_alone(market, archive_dir, monkeypatch):
+    monkeypatch.setattr(app, "ARCHIVE_RETENTION_DAYS", 1)
+    files = ingest(market, DATES[0])
+    app.maintain_archive(DATES[0])
+
+    assert len(list((archive_dir / f"date={DATES[0]}").glob("*.arrow"))) == len(files)
+
+
+def test_archive_without_pyarrow_fails_clearly(monkeypatch):
+    monkeypatch.setattr(app, "pa", None)
+
+    for call in (app.archive_schema, lambda: app.load_archive_day(DATES[0]), lambda: app.read_archive(DATES[0]), app.ArchiveSource):
+        with pytest.raises(RuntimeError, match="pyarrow"):
+            call()
+    assert app.archive_minute(DATES[0], "0900", "r", None) is False
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def frames(minute_csvs):
+    files = minute_csvs(n_symbols=8, n_minutes=12)
+    return {fname[-8:-4]: app.read_minute_csv(content) for fname, content in sorted(files.items())}
+
+
+def fill(store, frames, rev="r"):
+    for hhmm, df in frames.items():
+        store.append(hhmm, rev, df)
+    return store
+
+
+# ▼ 以前の組み立て方（全分足を結合して 銘柄コード → 時刻 順に並べ替え）
+def concat_sort(frames):
+    parts = [df.assign(ファイル時刻=hhmm) for hhmm, df in frames.items()]
+    df_all = pd.concat(parts, ignore_index=True)
+    df_all["銘柄コード"] = df_all["銘柄コード"].astype(str)
+    df_all["ファイル時刻"] = pd.to_datetime(df_all["ファイル時刻"], format="%H%M").dt.time
+    df_all = df_all.sort_values(by=["銘柄コード", "ファイル時刻"], kind="stable").reset_index(drop=True)
+    return df_all[["銘柄コード", "銘柄名称", *app.BAR_FIELDS, "ファイル時刻"]]
+
+
+# ▼ 銘柄コード・銘柄名称のカテゴリ型を文字列に戻して比べる
+def plain(df):
+    return df.astype({"銘柄コード": str, "銘柄名称": str})
+
+
+def test_to_frame_matches_concat_and_sort(frames):
+    df = fill(app.BarStore(initial_symbols=2), frames).to_frame()
+
+    pd.testing.assert_frame_equal(plain(df[concat_sort(frames).columns]), plain(concat_sort(frames)), check_dtype=False)
+
+
+def test_ring_keeps_only_the_last_capacity_minutes(frames):
+    store = fill(app.BarStore(capacity=5), frames)
+    last = dict(list(frames.items())[-5:])
+
+    assert [hhmm for hhmm, _ in store.sequence()] == list(last)
+    assert store.last_hhmm() == max(frames)
+    pd.testing.assert_frame_equal(plain(store.to_frame()), plain(concat_sort(last)), check_dtype=False)
+    assert list(store.to_frame(since_hhmm=list(last)[2])["ファイル時刻"].unique()) == sorted(
+        pd.to_datetime(list(last)[2:], format="%H%M").time
+    )
+
+
+def test_matches_only_when_stored_revs_agree(frames):
+    store = fill(app.BarStore(), dict(list(frames.items())[:3]))
+    files = [(hhmm, f"kabuteku20250106_{hhmm}.csv", "r") for hhmm in list(frames)[:5]]
+
+    assert store.matches(files)
+    assert store.matches(files[1:])  # 窓が進んで先頭の分足が外れても一致
+    assert not store.matches([files[0], (files[1][0], files[1][1], "r2"), *files[2:]])
+    assert not store.matches(files[:1] + files[2:])  # 保持済みの分足が一覧から消えた
+
+
+def test_new_symbols_and_mixed_code_types(frames):
+    store = app.BarStore(initial_symbols=1)
+    first, second = list(frames.items())[:2]
+    store.append(first[0], "r", first[1].head(3).assign(銘柄コード=first[1]["銘柄コード"].head(3).astype(int)))
+    store.append(second[0], "r", second[1].assign(銘柄コード=" " + second[1]["銘柄コード"].astype(str)))
+
+    df = store.to_frame()
+
+    assert sorted(store.codes) == sorted(second[1]["銘柄コード"].astype(str))
+    assert df.groupby("銘柄コード").size().to_dict() == {
+        code: 2 if i < 3 else 1 for i, code in enumerate(second[1]["銘柄コード"].astype(str))
+    }
+
+
+def test_has_bars_only_counts_the_window(frames):
+    store = fill(app.BarStore(), dict(list(frames.items())[:3]))
+
+    assert store.has_bars() and store.has_bars(list(frames)[2])
+    assert not store.has_bars(list(frames)[3]) and not app.BarStore().has_bars()
+
+
+# ▼ 一括判定はリングバッファの配列をそのまま使い、分足ごとに DataFrame を組み立てない
+def test_vectorized_replay_never_builds_frames(tmp_path, monkeypatch, minute_csvs):
+    for fname, content in minute_csvs(n_symbols=20, n_minutes=40).items():
+        (tmp_path / fname).write_bytes(content)
+    monkeypatch.setattr(app, "default_feed", None)
+    app.replay_directory(str(tmp_path), log_path=str(tmp_path / "expected.csv"))
+
+    monkeypatch.setattr(app.BarStore, "to_frame", lambda self, since_hhmm=None: pytest.fail("to_frame が呼ばれた"))
+    monkeypatch.setattr(app, "default_feed", None)
+
+    app.replay_directory(str(tmp_path), log_path=str(tmp_path / "signals.csv"))
+    assert (tmp_path / "signals.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
@@ -0,0 +1,38 @@
+import io
+import json
+
+import pandas as pd
+
+import app
+
+
+def test_synthetic_market_is_reproducible_and_drops_some_rows():
+    files = app.generate_synthetic_market(50, 20, seed=2)
+    frames = [pd.read_csv(io.BytesIO(content)) for content in files.values()]
+
+    assert files == app.generate_synthetic_market(50, 20, seed=2)
+    assert sorted(files) == [f"kabuteku20250106_{hhmm}.csv" for hhmm in app.trading_minutes()[:20]]
+    assert {"銘柄コード", "銘柄名称", "現在値", "高値", "安値", "出来高", "始値", "前日比", "売買代金"} == set(frames[0].columns)
+    assert sum(len(df) for df in frames) < 50 * 20
+    assert all((df["安値"] <= df["現在値"]).all() and (df["現在値"] <= df["高値"]).all() for df in frames)
+
+
+def test_write_synthetic_market(tmp_path):
+    written = app.write_synthetic_market(str(tmp_path / "csv"), 10, 5, date="20250107")
+
+    assert sorted(p.name for p in (tmp_path / "csv").iterdir()) == written
+    assert app.group_files_by_date(app.LocalSource(str(tmp_path / "csv")).list_files()).keys() == {"20250107"}
+
+
+def test_benchmark_saves_stages_and_flags_regressions(tmp_path, capsys):
+    output = tmp_path / "bench.json"
+    report = app.run_benchmark(sizes=[30], n_minutes=70, output_path=str(output), label="base")
+
+    saved = json.loads(output.read_text(encoding="utf-8"))
+    assert saved["label"] == "base" and saved["results"][0]["symbols"] == 30
+    assert {"listing", "format_output_html"} <= set(saved["results"][0]["stages"])
+
+    slower = {"results": [{"symbols": 30, "stages": {stage: seconds * 2 + 1 for stage, seconds in report["results"][0]["stages"].items()}}]}
+    assert app.compare_benchmarks(report, slower)
+    assert not app.compare_benchmarks(slower, report)
+    assert "悪化" in capsys.readouterr().out
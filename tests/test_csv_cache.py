@@ -0,0 +1,126 @@
+import os
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import dropbox
+import pytest
+
+import app
+
+DATE = "20250106"
+
+
+# ▼ 一覧とダウンロードだけを持つ Dropbox もどき（ダウンロードしたファイル名を記録する）
+class FakeDropbox:
+    def __init__(self, files):
+        self.files = dict(files)
+        self.revs = {fname: 1 for fname in files}
+        self.downloads = []
+        self.lock = threading.Lock()
+
+    def put(self, fname, content):
+        self.files[fname] = content
+        self.revs[fname] = self.revs.get(fname, 0) + 1
+
+    def files_list_folder(self, path):
+        entries = [
+            dropbox.files.FileMetadata(name=fname, rev=f"{rev:0>9x}", content_hash=f"{rev:0>64x}")
+            for fname, rev in self.revs.items()
+        ]
+        return dropbox.files.ListFolderResult(entries=entries, cursor="c", has_more=False)
+
+    def files_list_folder_continue(self, cursor):
+        return self.files_list_folder("")
+
+    def files_download(self, path):
+        fname = os.path.basename(path)
+        with self.lock:
+            self.downloads.append(fname)
+        return None, SimpleNamespace(content=self.files[fname])
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(app, "csv_cache_stats", {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0})
+    monkeypatch.setattr(app, "USE_INCREMENTAL_LISTING", False)
+    monkeypatch.setattr(app, "default_feed", None)
+    monkeypatch.setattr(app, "get_japan_time", lambda: datetime(2025, 1, 6, 10, 0, tzinfo=app.JST))
+
+
+@pytest.fixture
+def dbx(minute_csvs, monkeypatch):
+    fake = FakeDropbox(minute_csvs(n_symbols=5, n_minutes=6, date=DATE))
+    monkeypatch.setattr(app, "get_dropbox_client", lambda: fake)
+    return fake
+
+
+def test_second_cycle_reads_only_new_minutes(dbx):
+    first = app.build_intraday_dataframe(target_date=DATE)
+    second = app.build_intraday_dataframe(target_date=DATE)
+
+    assert second.equals(first)
+    assert sorted(dbx.downloads) == sorted(dbx.files)
+    assert app.csv_cache_stats["memory_hits"] == 0  # ✅ 保持済みの分足はキャッシュにも問い合わせない
+
+
+def test_rebuilt_window_is_served_from_memory(dbx, monkeypatch):
+    first = app.build_intraday_dataframe(target_date=DATE)
+    app.get_default_feed().bar_store = None
+    second = app.build_intraday_dataframe(target_date=DATE)
+
+    assert second.equals(first)
+    assert sorted(dbx.downloads) == sorted(dbx.files)
+    assert app.csv_cache_stats["memory_hits"] == len(dbx.files)
+
+
+def test_only_changed_file_is_downloaded_again(dbx):
+    app.build_intraday_dataframe(target_date=DATE)
+    fname = max(dbx.files)
+    dbx.put(fname, dbx.files[min(dbx.files)])
+
+    df = app.build_intraday_dataframe(target_date=DATE)
+
+    assert dbx.downloads.count(fname) == 2
+    assert len(dbx.downloads) == len(dbx.files) + 1
+    assert df.groupby("銘柄コード").size().eq(len(dbx.files)).all()
+
+
+def test_memory_eviction_falls_back_to_disk(dbx, monkeypatch):
+    monkeypatch.setattr(app, "CSV_CACHE_MEMORY_ENTRIES", 2)
+    expected = app.build_intraday_dataframe(target_date=DATE)
+    app.get_default_feed().bar_store = None
+
+    df = app.build_intraday_dataframe(target_date=DATE)
+
+    assert df.equals(expected)
+    assert len(dbx.downloads) == len(dbx.files)
+    assert app.csv_cache_stats["disk_hits"] >= len(dbx.files) - 2
+
+
+def test_disk_cache_evicts_least_recently_used(dbx, monkeypatch):
+    app.build_intraday_dataframe(target_date=DATE)
+    paths = sorted(os.path.join(app.CSV_CACHE_DIR, name) for name in os.listdir(app.CSV_CACHE_DIR))
+    for i, path in enumerate(paths):
+        os.utime(path, (1_000_000 + i, 1_000_000 + i))  # ✅ 最終利用時刻で古いものを決める
+    monkeypatch.setattr(app, "CSV_CACHE_MAX_BYTES", sum(os.path.getsize(path) for path in paths[2:]))
+
+    app.evict_csv_disk_cache()
+
+    assert sorted(os.path.join(app.CSV_CACHE_DIR, name) for name in os.listdir(app.CSV_CACHE_DIR)) == paths[2:]
+    assert app.csv_cache_stats["evictions"] == 2
+
+
+def test_downloads_run_concurrently_and_keep_minute_order(dbx, monkeypatch):
+    monkeypatch.setattr(app, "download_executor", None)
+    monkeypatch.setattr(app, "DOWNLOAD_CONCURRENCY", len(dbx.files))
+    # ✅ 全ファイルのダウンロードが同時に始まらなければ Barrier がタイムアウトして読み込みに失敗する
+    barrier = threading.Barrier(len(dbx.files), timeout=5)
+    download = dbx.files_download
+    dbx.files_download = lambda path: (barrier.wait(), download(path))[1]
+
+    df = app.build_intraday_dataframe(target_date=DATE)
+
+    assert len(df) == 5 * len(dbx.files)
+    times = [t.strftime("%H%M") for t in df[df["銘柄コード"] == df["銘柄コード"].iloc[0]]["ファイル時刻"]]
+    assert times == sorted(fname[-8:-4] for fname in dbx.files)
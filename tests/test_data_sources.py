@@ -0,0 +1,79 @@
+import csv
+import io
+
+import pandas as pd
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+DATE = "20250106"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(app, "default_feed", None)
+
+
+@pytest.fixture(scope="module")
+def market():
+    return make_minute_csvs(n_symbols=40, n_minutes=70, date=DATE, seed=1)
+
+
+# ▼ 1日分をリプレイし、(結果, 書き出した行) を返す
+def replay_rows(source):
+    buffer = io.StringIO()
+    files = app.group_files_by_date(source.list_files())[DATE]
+    result = app.replay_trading_day(source, DATE, files, csv.writer(buffer))
+    return result, list(csv.reader(io.StringIO(buffer.getvalue())))
+
+
+def write_dir(directory, files):
+    directory.mkdir()
+    for fname, content in files.items():
+        (directory / fname).write_bytes(content)
+    return str(directory)
+
+
+def test_replay_from_memory_source_matches_local_files(market, tmp_path):
+    result, rows = replay_rows(app.MemorySource(market))
+    assert result["evaluated"] == 68
+    assert result["signals"] == len(rows) > 0
+
+    local_result, local_rows = replay_rows(app.LocalSource(write_dir(tmp_path / "csv", market)))
+    assert local_rows == rows
+    assert local_result["signals"] == result["signals"]
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_local_source_reads_frames_and_tracks_revs(market, tmp_path, use_mmap):
+    source = app.LocalSource(write_dir(tmp_path / "csv", market), use_mmap=use_mmap)
+    fname = sorted(market)[0]
+    index = source.list_files()
+
+    assert set(index) == set(market)
+    pd.testing.assert_frame_equal(source.read_frame(fname), app.read_minute_csv(market[fname]))
+    assert source.read(fname) == market[fname]
+
+    (tmp_path / "csv" / fname).write_bytes(market[fname] + market[fname].splitlines(keepends=True)[-1])
+    assert source.list_files()[fname] != index[fname]
+
+
+def test_memory_source_put_bumps_rev_and_remove_drops_file(market):
+    source = app.MemorySource(market)
+    fname = sorted(market)[0]
+    before = source.list_files()[fname]
+
+    source.put(fname, market[fname])
+    assert source.list_files()[fname] != before
+    source.remove(fname)
+    assert fname not in source.list_files()
+
+
+def test_data_source_follows_setting(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DATA_SOURCE", "local")
+    monkeypatch.setattr(app, "LOCAL_SOURCE_DIR", str(tmp_path))
+
+    source = app.get_data_source()
+    assert isinstance(source, app.LocalSource) and source.directory == str(tmp_path)
+    assert app.get_data_source() is source
@@ -0,0 +1,55 @@
+import pytest
+
+import app
+from test_vectorized_detectors import replay_stores
+
+RELAXED = {
+    "VOLATILITY_THRESHOLD": 0.0,
+    "CROSS_VOLATILITY_THRESHOLD": 0.0,
+    "DOUBLE_PATTERN_TOLERANCE": 0.03,
+    "DOUBLE_PATTERN_VOLUME_SPIKE_RATIO": 0.8,
+    "BOX_BREAKOUT_VOLUME_RATIO": 0.5,
+    "BREAKOUT_VOLUME_RATIO": 0.5,
+}
+
+
+def test_registry_covers_every_signal_once():
+    priorities = [detector.priority for detector in app.SIGNAL_DETECTORS]
+    assert sorted(priorities) == list(range(len(priorities)))
+    signals = [name for detector in app.SIGNAL_DETECTORS for name in detector.signals]
+    assert len(signals) == len(set(signals)) == len(app.SIGNAL_DETECTOR_NAMES)
+
+
+# ▼ 事前条件で落とした銘柄では、検出関数が当たらないこと（既定値と緩めた条件の両方）
+@pytest.mark.parametrize("relaxed", [False, True])
+def test_prefilters_never_drop_a_hit(monkeypatch, relaxed):
+    if relaxed:
+        for name, value in RELAXED.items():
+            monkeypatch.setattr(app, name, value)
+
+    hits = 0
+    for store in replay_stores():
+        df = store.to_frame()
+        codes, _, values, present = app.frame_to_aligned_window(df, max_bars=app.detector_window())
+        candidates = app.detector_candidates(app.window_bars(values, present))
+        row_of = {code: i for i, code in enumerate(codes)}
+        for code, df_group in df.groupby("銘柄コード"):
+            features = app.FeatureFrame(df_group)
+            for detector in app.SIGNAL_DETECTORS:
+                if detector.detect(features):
+                    hits += 1
+                    assert candidates[detector.name][row_of[code]], (store.last_hhmm(), code, detector.name)
+    assert hits > 0
+
+
+def test_vectorized_evaluates_only_candidates():
+    store = list(replay_stores())[-1]
+    codes, names, values, present = store.aligned_window()
+    evaluated = {}
+    app.detect_signals_vectorized(codes, names, values, present, evaluated=evaluated)
+
+    candidates = app.detector_candidates(app.window_bars(values, present))
+    assert set(evaluated) == {detector.name for detector in app.SIGNAL_DETECTORS}
+    for name, count in evaluated.items():
+        assert count <= candidates[name].sum()
+    assert sum(evaluated.values()) < len(codes) * len(app.SIGNAL_DETECTORS)
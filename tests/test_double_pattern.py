@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+
+def test_local_extrema_match_neighbour_comparison():
+    rng = np.random.default_rng(0)
+    highs = rng.integers(0, 6, (50, 40)).astype(float)  # 同値が続く区間も含む
+    lows = highs - rng.integers(0, 3, (50, 40))
+
+    peaks, valleys = app.find_local_extrema(highs, lows)
+
+    for row in range(len(highs)):
+        h, lo = highs[row], lows[row]
+        assert list(np.flatnonzero(peaks[row])) == [i for i in range(1, len(h) - 1) if h[i - 1] < h[i] > h[i + 1]]
+        assert list(np.flatnonzero(valleys[row])) == [i for i in range(1, len(lo) - 1) if lo[i - 1] > lo[i] < lo[i + 1]]
+
+
+# ▼ ダブルトップ/ボトムが出やすいように条件を緩めて、銘柄ごとの判定と一括判定を比べる
+@pytest.mark.parametrize("volatility_jump", [True, False])
+def test_double_pattern_masks_match_per_symbol_detector(monkeypatch, volatility_jump):
+    monkeypatch.setattr(app, "DOUBLE_PATTERN_TOLERANCE", 0.03)
+    monkeypatch.setattr(app, "DOUBLE_PATTERN_VOLUME_SPIKE_RATIO", 0.8)
+    monkeypatch.setattr(app, "DOUBLE_PATTERN_VOLATILITY_JUMP", volatility_jump)
+    store = app.BarStore()
+    for fname, content in sorted(make_minute_csvs(n_symbols=150, n_minutes=60, seed=5).items()):
+        store.append(fname[-8:-4], "r", app.read_minute_csv(content))
+    df = store.to_frame()
+
+    expected = {}
+    for code, df_group in df.groupby("銘柄コード"):
+        result = app.detect_double_pattern(df_group)
+        if result:
+            expected[code] = result
+    rows = {row["銘柄コード"]: row for row in app.detect_signals_vectorized(*app.frame_to_aligned_window(df))}
+    vectorized = {code: row for code, row in rows.items() if row["シグナル"] in ("【売り目】ダブルトップ", "【買い目】ダブルボトム")}
+
+    assert len({row["シグナル"] for row in expected.values()}) == 2
+    for code, row in vectorized.items():
+        assert {key: row[key] for key in expected[code]} == expected[code]
+    # ✅ 一括判定では先に判定される他のシグナルが優先されるため、出なかった銘柄はそちらに該当している
+    assert set(expected) - set(vectorized) <= set(rows) - set(vectorized)
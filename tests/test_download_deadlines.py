@@ -0,0 +1,166 @@
+import json
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+DATE = "20250106"
+
+
+# ▼ ファイルごとに「呼ばれた回数目の振る舞い」を決められる取得元（None は普通に返す）
+#    振る舞いは秒数（その秒数待ってから返す）か例外
+class FlakySource(app.MemorySource):
+    def __init__(self, files):
+        super().__init__(files)
+        self.plans = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def read(self, fname):
+        with self.lock:
+            n = self.calls.get(fname, 0)
+            self.calls[fname] = n + 1
+        plan = self.plans.get(fname, [])
+        action = plan[n] if n < len(plan) else None
+        if isinstance(action, BaseException):
+            raise action
+        if action:
+            time.sleep(action)
+        return super().read(fname)
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    monkeypatch.setattr(app, "metrics", app.PipelineMetrics())
+    monkeypatch.setattr(app, "default_feed", None)
+    monkeypatch.setattr(app, "csv_cache_stats", {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0})
+    monkeypatch.setattr(app, "CSV_CACHE_DIR", "")
+    monkeypatch.setattr(app, "DOWNLOAD_RETRY_BASE", 0.01)
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE_MIN_DELAY", 0.1)
+    monkeypatch.setattr(app, "DOWNLOAD_DEADLINE", 2.0)
+    monkeypatch.setattr(app, "download_executor", None)
+    monkeypatch.setattr(app, "abandoned_downloads", set())
+
+
+@pytest.fixture
+def source():
+    return FlakySource(make_minute_csvs(n_symbols=5, n_minutes=4, date=DATE))
+
+
+def keys_of(source):
+    return [(fname[-8:-4], fname, rev) for fname, (rev, _) in sorted(source.list_files().items())]
+
+
+def test_retryable_errors_are_retried_and_others_are_not(source):
+    keys = keys_of(source)
+    flaky, missing = keys[0][1], keys[1][1]
+    source.plans[flaky] = [ConnectionError("reset"), ConnectionError("reset")]
+    source.plans[missing] = [FileNotFoundError(missing)]
+
+    results, attempts = app.fetch_with_deadlines(source, keys)
+
+    assert attempts[keys[0]] == 3 and source.calls[flaky] == 3
+    assert results[keys[0]][0].equals(app.read_minute_csv(source.files[flaky]))
+    assert isinstance(results[keys[1]], FileNotFoundError) and source.calls[missing] == 1
+    assert all(not isinstance(results[key], Exception) for key in keys[2:])
+
+
+def test_straggler_is_hedged(source, monkeypatch):
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE", True)
+    key = keys_of(source)[0]
+    source.plans[key[1]] = [1.5]
+
+    start = time.monotonic()
+    results, attempts = app.fetch_with_deadlines(source, [key])
+
+    assert time.monotonic() - start < 1.0
+    assert attempts[key] == 2
+    assert not isinstance(results[key], Exception)
+    assert app.metrics.counters[("download_hedge_wins", ())] == 1
+
+
+def test_deadline_gives_up_on_a_hung_file(source, monkeypatch):
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE", False)
+    monkeypatch.setattr(app, "DOWNLOAD_DEADLINE", 0.2)
+    key = keys_of(source)[0]
+    source.plans[key[1]] = [1.0]
+
+    start = time.monotonic()
+    results, _ = app.fetch_with_deadlines(source, [key])
+
+    assert time.monotonic() - start < 0.6
+    assert isinstance(results[key], TimeoutError)
+
+
+def test_failed_file_falls_back_to_last_good_copy(source, monkeypatch, workdir):
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE", False)
+    keys = keys_of(source)
+    frames = app.load_minute_frames(source, keys, verbose=False)
+    hhmm, fname, old_rev = keys[0]
+
+    source.put(fname, make_minute_csvs(n_symbols=5, n_minutes=4, date=DATE, seed=9)[fname])
+    source.plans[fname] = [ConnectionError("reset")] * 10
+    new_key = (hhmm, fname, source.list_files()[fname][0])
+    reloaded = app.load_minute_frames(source, [new_key] + keys[1:], verbose=False)
+
+    assert reloaded[hhmm].equals(frames[hhmm])
+    assert reloaded[hhmm].attrs["stale_rev"] == old_rev
+    # ✅ 代用した版は古い rev のままキャッシュに残り、次のサイクルで取り直される
+    assert app.get_default_feed().csv_cache[fname][0] == old_rev
+    logged = [json.loads(line) for line in (workdir / app.DOWNLOAD_FAILURE_LOG).read_text(encoding="utf-8").splitlines()]
+    assert [(entry["minute"], entry["fallback"], entry["attempts"]) for entry in logged] == [(hhmm, True, 1 + app.DOWNLOAD_RETRIES)]
+
+
+# ▼ 形式不正は書き込み途中を読んだだけかもしれないので1回だけ取り直し、2回続けば諦める
+def test_parse_errors_are_retried_once(source, monkeypatch):
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE", False)
+    keys = keys_of(source)
+    partial, broken = keys[0][1], keys[1][1]
+    source.plans[partial] = [pd.errors.ParserError("truncated")]
+    source.plans[broken] = [pd.errors.ParserError("truncated")] * 2
+
+    results, attempts = app.fetch_with_deadlines(source, keys[:2])
+
+    assert not isinstance(results[keys[0]], Exception) and attempts[keys[0]] == 2
+    assert isinstance(results[keys[1]], pd.errors.ParserError) and source.calls[broken] == 2 == attempts[keys[1]]
+
+
+# ▼ 期限切れで見捨てた取得がプールを塞いだら作り直し、次のサイクルの取得を待たせない
+def test_abandoned_downloads_do_not_block_the_next_cycle(source, monkeypatch):
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE", False)
+    monkeypatch.setattr(app, "DOWNLOAD_CONCURRENCY", 2)
+    monkeypatch.setattr(app, "DOWNLOAD_ABANDONED_MAX", 2)
+    monkeypatch.setattr(app, "DOWNLOAD_DEADLINE", 0.3)
+    keys = keys_of(source)
+    for key in keys[:2]:
+        source.plans[key[1]] = [1.5]
+
+    results, _ = app.fetch_with_deadlines(source, keys[:2])
+    old_executor = app.download_executor
+
+    assert all(isinstance(results[key], TimeoutError) for key in keys[:2])
+    assert old_executor is None and app.metrics.counters[("download_pool_resets", ())] == 1
+
+    results, _ = app.fetch_with_deadlines(source, keys[2:])
+    assert all(not isinstance(results[key], Exception) for key in keys[2:])
+
+
+def test_failed_file_falls_back_to_the_disk_cache(source, monkeypatch, workdir):
+    monkeypatch.setattr(app, "DOWNLOAD_HEDGE", False)
+    monkeypatch.setattr(app, "CSV_CACHE_DIR", str(workdir / "csv_cache"))
+    source.cacheable = True  # Dropbox と同じくダウンロードしたCSVをディスクキャッシュへ保存する
+    keys = keys_of(source)
+    frames = app.load_minute_frames(source, keys, verbose=False)
+    app.get_default_feed().csv_cache.clear()
+    hhmm, fname, _ = keys[0]
+
+    source.put(fname, make_minute_csvs(n_symbols=5, n_minutes=4, date=DATE, seed=9)[fname])
+    source.plans[fname] = [ConnectionError("reset")] * 10
+    reloaded = app.load_minute_frames(source, [(hhmm, fname, source.list_files()[fname][0])], verbose=False)
+
+    pd.testing.assert_frame_equal(reloaded[hhmm], frames[hhmm])
+    assert reloaded[hhmm].attrs["stale_rev"][0] == "stale"
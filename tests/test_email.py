@@ -0,0 +1,125 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import app
+
+OUTPUT_DATA = [{
+    "銘柄コード": "1301", "銘柄名称": "銘柄1301", "シグナル": "【買い目】ゴールデンクロス",
+    "現在値": 1000.0, "MA_5": 999.0, "MA_25": 998.0, "RSI": 55.0,
+}]
+
+
+@pytest.fixture
+def email_list(tmp_path, monkeypatch):
+    path = tmp_path / "email_list.txt"
+    path.write_text("a@example.com\nb@example.com\nc@example.com\na@example.com\n", encoding="utf-8")
+    monkeypatch.setattr(app, "sendgrid_rate_limiter", app.RateLimiter(0.0))
+    return path
+
+
+# ▼ fake-sendgrid を空いているポートで起動し、受け取った内容のログの場所を返す
+@pytest.fixture
+def fake_sendgrid(tmp_path, monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    log_path = tmp_path / "sendgrid.jsonl"
+    threading.Thread(target=app.run_fake_sendgrid, kwargs={"port": port, "log_path": str(log_path)}, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+    monkeypatch.setattr(app, "SENDGRID_HOST", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("SENDGRID_API_KEY", "test-key")
+    monkeypatch.setenv("SENDER_EMAIL", "sender@example.com")
+    return log_path
+
+
+def test_email_is_sent_in_bcc_chunks(fake_sendgrid, email_list, monkeypatch, capsys):
+    monkeypatch.setattr(app, "EMAIL_BCC_CHUNK", 2)
+
+    app.send_output_dataframe_via_email(OUTPUT_DATA, "1000", recipients=app.RecipientList(str(email_list)), label="prime")
+
+    records = [json.loads(line) for line in fake_sendgrid.read_text(encoding="utf-8").splitlines()]
+    assert sorted(record["bcc"] for record in records) == [1, 2]  # 重複を除いた3件を2件ずつ
+    assert all(record["subject"] == "【10:00】株式 - テクニカルシグナル通知（prime）" for record in records)
+    assert "🚫" not in capsys.readouterr().out
+
+
+def test_recipient_list_is_reread_only_when_the_file_changes(email_list):
+    recipients = app.RecipientList(str(email_list))
+    assert recipients.get() == ["a@example.com", "b@example.com", "c@example.com"]
+    first = recipients.get()
+
+    email_list.write_text("d@example.com\n", encoding="utf-8")
+    os.utime(email_list, ns=(0, 1))
+    assert recipients.get() == ["d@example.com"]
+    assert recipients.get() is not first
+
+
+class FlakyClient:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, message):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        if status >= 400:
+            error = Exception(f"HTTP {status}")
+            error.status_code = status
+            raise error
+        return type("Response", (), {"status_code": status})()
+
+
+def test_send_with_retry_backs_off_on_retryable_errors(email_list, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+    monkeypatch.setattr(app, "EMAIL_RETRY_BASE", 1.0)
+
+    client = FlakyClient(429, 503, 202)
+    assert app.send_with_retry(client, None, "1000").status_code == 202
+    assert client.calls == 3
+    assert len(sleeps) == 2 and 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0
+
+    client = FlakyClient(400, 202)
+    with pytest.raises(Exception, match="400"):
+        app.send_with_retry(client, None, "1000")
+    assert client.calls == 1
+
+    monkeypatch.setattr(app, "EMAIL_MAX_RETRIES", 1)
+    with pytest.raises(Exception, match="500"):
+        app.send_with_retry(FlakyClient(500, 500, 202), None, "1000")
+
+
+def test_dispatcher_drops_the_oldest_pending_notification(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+    sent = []
+
+    def send(output_data, current_time, cleared=None, recipients=None, label=""):
+        started.set()
+        release.wait(5)
+        sent.append(current_time)
+
+    monkeypatch.setattr(app, "send_output_dataframe_via_email", send)
+    dispatcher = app.EmailDispatcher(maxsize=1)
+    dispatcher.submit(OUTPUT_DATA, "1000")
+    assert started.wait(5)
+    dispatcher.submit(OUTPUT_DATA, "1001")
+    dispatcher.submit(OUTPUT_DATA, "1002")  # 1001 は送信待ちのまま押し出される
+
+    release.set()
+    assert dispatcher.flush(timeout=5)
+    assert sent == ["1000", "1002"]
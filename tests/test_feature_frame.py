@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+import app
+
+DETECTORS = [
+    app.detect_uptrend, app.detect_downtrend,
+    app.detect_golden_cross, app.detect_dead_cross,
+    app.detect_box_breakout,
+    app.detect_breakout, app.detect_double_pattern,
+]
+
+
+@pytest.fixture(scope="module")
+def store():
+    from conftest import make_minute_csvs
+
+    store = app.BarStore(streaming=app.StreamingIndicators())
+    for fname, content in sorted(make_minute_csvs(n_symbols=80, n_minutes=120, seed=3).items()):
+        store.append(fname[-8:-4], "r", app.read_minute_csv(content))
+    return store
+
+
+# ▼ 全検出関数の結果を (銘柄コード, 検出関数名) → 結果 で集める
+def run_detectors(store, wrap):
+    results = {}
+    for code, df_group in store.to_frame().groupby("銘柄コード"):
+        for detector in DETECTORS:
+            result = detector(wrap(code, df_group))
+            if result:
+                results[(code, detector.__name__)] = result
+    return results
+
+
+def test_feature_frame_matches_plain_dataframes(store):
+    expected = run_detectors(store, lambda code, df_group: df_group)
+
+    assert expected
+    assert run_detectors(store, lambda code, df_group: app.FeatureFrame(df_group)) == expected
+
+
+@pytest.mark.parametrize("indicator_source", ["batch", "stream"])
+def test_precomputed_indicators_give_the_same_signals(store, monkeypatch, indicator_source):
+    expected = run_detectors(store, lambda code, df_group: df_group)
+    monkeypatch.setattr(app, "INDICATOR_SOURCE", indicator_source)
+    precomputed = app.current_indicator_source(store)
+
+    results = run_detectors(store, lambda code, df_group: app.FeatureFrame(df_group, precomputed=precomputed[code]))
+
+    assert results.keys() == expected.keys()
+    if indicator_source == "batch":
+        assert results == expected
+
+
+def test_features_are_computed_once(store, monkeypatch):
+    df_group = next(iter(store.to_frame().groupby("銘柄コード")))[1]
+    features = app.FeatureFrame(df_group)
+    calls = []
+    compute = features._compute
+    monkeypatch.setattr(features, "_compute", lambda *args: calls.append(args) or compute(*args))
+
+    for detector in DETECTORS:
+        detector(features)
+
+    assert len(calls) == len(set(calls))
+    assert "MA_25" in {args[0] for args in calls}
+
+
+# ▼ 逐次計算はモジュールの期間で作るため、期間を変えた params では一括計算の値を使う
+def test_stream_source_falls_back_to_batch_for_other_periods(store, monkeypatch):
+    params = {"RSI_PERIOD": 14}
+    monkeypatch.setattr(app, "INDICATOR_SOURCE", "batch")
+    expected = app.current_indicator_source(store, params)
+    monkeypatch.setattr(app, "INDICATOR_SOURCE", "stream")
+    precomputed = app.current_indicator_source(store, params)
+
+    for code, indicators in expected.items():
+        for key, matrix in indicators.items():
+            np.testing.assert_array_equal(precomputed[code][key], matrix, err_msg=f"{code} {key}")
+    results = run_detectors(store, lambda code, df_group: app.FeatureFrame(df_group, precomputed=precomputed[code], params=params))
+    assert results == run_detectors(store, lambda code, df_group: app.FeatureFrame(df_group, params=params))
@@ -0,0 +1,104 @@
+import json
+import threading
+from datetime import datetime
+
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+DATE = "20250106"
+RELAXED = {"DOUBLE_PATTERN_TOLERANCE": 0.03, "DOUBLE_PATTERN_VOLUME_SPIKE_RATIO": 0.8}
+
+
+def write_feed_dir(directory, prefix, seed):
+    directory.mkdir()
+    for fname, content in make_minute_csvs(n_symbols=40, n_minutes=70, date=DATE, seed=seed).items():
+        (directory / fname.replace("kabuteku", prefix)).write_bytes(content)
+    return str(directory)
+
+
+@pytest.fixture
+def feeds_file(tmp_path):
+    path = tmp_path / "feeds.json"
+    entries = [
+        {"name": "prime", "data_source": "local", "directory": write_feed_dir(tmp_path / "prime", "kabuteku", 1),
+         "email_list": "email_prime.txt"},
+        {"name": "growth", "data_source": "local", "directory": write_feed_dir(tmp_path / "growth", "growth", 2),
+         "prefix": "growth", "email_list": "email_growth.txt", "params": RELAXED},
+    ]
+    path.write_text(json.dumps(entries), encoding="utf-8")
+    return path
+
+
+def test_load_feeds_validates_entries(feeds_file, tmp_path):
+    prime, growth = app.load_feeds(str(feeds_file))
+    assert (prime.name, prime.prefix, prime.params) == ("prime", app.FILE_PREFIX, {})
+    assert (growth.prefix, growth.params) == ("growth", RELAXED)
+    assert growth.signal_store_path == "signal_state.growth.sqlite3"
+    assert app.load_feeds(str(tmp_path / "missing.json")) == []
+
+    for entries in (
+        [{"name": "a", "params": {"BAR_WINDOW": 30}}],  # 分足の窓の本数は変えられない
+        [{"name": "a"}, {"name": "a"}],
+    ):
+        feeds_file.write_text(json.dumps(entries), encoding="utf-8")
+        with pytest.raises(ValueError):
+            app.load_feeds(str(feeds_file))
+
+
+# ▼ 2つのフィードで1サイクルずつ回し、通知がフィードごとの宛先・名前・閾値で出ることを確かめる
+def test_cycles_keep_feed_state_apart(feeds_file, monkeypatch):
+    monkeypatch.setattr(app, "get_japan_time", lambda: datetime(2025, 1, 6, 10, 9, tzinfo=app.JST))
+    sent = {}
+    monkeypatch.setattr(
+        app, "dispatch_signal_email",
+        lambda output_data, current_time, cleared=None, recipients=None, label="": sent.setdefault(label, (recipients.path, output_data)),
+    )
+    feeds = app.load_feeds(str(feeds_file))
+    now = app.get_japan_time()
+
+    for feed in feeds:
+        app.run_cycle(feed, DATE, "1009", now)
+
+    prime, growth = feeds
+    assert prime.bar_store is not growth.bar_store and prime.csv_cache.keys().isdisjoint(growth.csv_cache)
+    assert all(fname.startswith("growth") for fname in growth.csv_cache)
+    for feed in feeds:
+        expected = app.evaluate_signals(feed.bar_store.to_frame(), params=feed.params)
+        path, rows = sent[feed.name]
+        assert path == f"email_{feed.name}.txt"
+        assert [(row["銘柄コード"], row["シグナル"]) for row in rows] == [(row["銘柄コード"], row["シグナル"]) for row in expected]
+    assert app.DOUBLE_PATTERN_TOLERANCE != RELAXED["DOUBLE_PATTERN_TOLERANCE"]
+
+
+# ▼ フィードごとの閾値で同時に判定しても、1つずつ判定したときと同じ結果になる（モジュール定数を書き換えない）
+def test_feed_parameters_are_isolated_across_threads(tmp_path):
+    source = app.LocalSource(write_feed_dir(tmp_path / "csv", "kabuteku", 3))
+    feed = app.Feed(source="local")
+    files = sorted(app.group_files_by_date(source.list_files())[DATE])[-app.BAR_WINDOW:]
+    store = app.update_bar_store(DATE, files, lambda new_files: app.load_minute_frames(source, new_files, verbose=False, feed=feed), feed=feed)
+
+    def signals(params):
+        return [(row["銘柄コード"], row["シグナル"]) for row in app.evaluate_signals(store, params=params)]
+
+    expected = {"default": signals({}), "relaxed": signals(RELAXED)}
+    assert expected["default"] != expected["relaxed"]
+
+    results, errors = {"default": [], "relaxed": []}, []
+
+    def worker(name, params):
+        try:
+            for _ in range(5):
+                results[name].append(signals(params))
+        except Exception as e:  # pragma: no cover - 失敗時の表示用
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(name, params)) for name, params in [("default", {}), ("relaxed", RELAXED)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert all(result == expected[name] for name, runs in results.items() for result in runs)
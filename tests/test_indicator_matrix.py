@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+# ▼ 一部の銘柄で分足を欠けさせたストア（詰めて右寄せする処理も通す）
+@pytest.fixture
+def store(minute_csvs):
+    store = app.BarStore()
+    for i, (fname, content) in enumerate(sorted(minute_csvs(n_symbols=12, n_minutes=70).items())):
+        df = app.read_minute_csv(content)
+        if i % 7 == 3:
+            df = df.iloc[2:]
+        store.append(fname[-8:-4], "r", df)
+    return store
+
+
+# ▼ 銘柄ごとの pandas 計算（検出関数と同じ式）
+def per_symbol(group):
+    price, volume = group["現在値"], group["出来高"]
+    return {
+        "MA_5": price.rolling(window=app.MA_SHORT_WINDOW).mean(),
+        "MA_25": price.rolling(window=app.MA_MID_WINDOW).mean(),
+        "MA_60": price.rolling(window=app.MA_LONG_WINDOW).mean(),
+        "標準偏差": price.rolling(window=app.STD_WINDOW).std(),
+        "RSI": app.calculate_rsi(price),
+        "MACDヒストグラム": app.calculate_macd_hist(price),
+        "出来高平均_直近": volume.rolling(window=app.VOLUME_RECENT_WINDOW).mean(),
+        "出来高平均_過去": volume.shift(app.VOLUME_RECENT_WINDOW).rolling(window=app.VOLUME_PAST_WINDOW).mean(),
+    }
+
+
+def test_indicator_matrix_matches_per_symbol_series(store):
+    codes, _, values, present = store.aligned_window()
+    matrix = app.compute_indicator_matrix(values, present)
+    groups = dict(tuple(store.to_frame().groupby("銘柄コード")))
+
+    assert sorted(codes) == sorted(groups)
+    assert not present.all()  # 欠けた分足のある銘柄が含まれている
+    for row, code in enumerate(codes):
+        expected = per_symbol(groups[code].reset_index(drop=True))
+        n = int(present[row].sum())
+        for key, series in expected.items():
+            np.testing.assert_allclose(matrix[key][row, -n:], series.to_numpy(dtype=float), rtol=1e-9, equal_nan=True, err_msg=f"{code} {key}")
+
+
+def test_ewm_handles_leading_and_inner_gaps_like_pandas():
+    matrix = np.array([
+        [np.nan, np.nan, 1.0, 2.0, np.nan, 4.0, 4.0, 3.0],
+        [5.0, np.nan, np.nan, 6.0, 7.0, np.nan, 8.0, 9.0],
+    ])
+    expected = np.vstack([pd.Series(row).ewm(span=3, adjust=False).mean().to_numpy() for row in matrix])
+
+    np.testing.assert_allclose(app.ewm_mean_2d(matrix, 3), expected, equal_nan=True)
@@ -0,0 +1,97 @@
+import dropbox
+import pytest
+
+import app
+
+
+# ▼ 目印から (rev, content_hash) を作る（Dropbox の検証に通る長さまで左を0で埋める）
+def meta(tag):
+    return f"{tag:0>9}", f"{tag:0>64}"
+
+
+def file_entry(name, tag):
+    rev, content_hash = meta(tag)
+    return dropbox.files.FileMetadata(name=name, rev=rev, content_hash=content_hash)
+
+
+# ▼ files_list_folder / _continue を返すだけの Dropbox もどき（カーソルごとに返すページを決めておく）
+class FakeDropbox:
+    def __init__(self, full_pages):
+        self.full_pages = full_pages
+        self.deltas = {}
+        self.reset_cursors = set()
+        self.calls = []
+
+    def page(self, pages, i, prefix):
+        more = i + 1 < len(pages)
+        cursor = f"{prefix}{i + 1}" if more else f"{prefix}end"
+        return dropbox.files.ListFolderResult(entries=pages[i], cursor=cursor, has_more=more)
+
+    def files_list_folder(self, path):
+        self.calls.append(("list", path))
+        return self.page(self.full_pages, 0, "full")
+
+    def files_list_folder_continue(self, cursor):
+        self.calls.append(("continue", cursor))
+        if cursor in self.reset_cursors:
+            raise dropbox.exceptions.ApiError("rid", dropbox.files.ListFolderContinueError.reset, None, None)
+        if cursor.startswith("full") and cursor != "fullend":
+            return self.page(self.full_pages, int(cursor[4:]), "full")
+        return dropbox.files.ListFolderResult(entries=self.deltas.pop(cursor, []), cursor=cursor, has_more=False)
+
+
+@pytest.fixture(autouse=True)
+def fresh_feed(monkeypatch):
+    monkeypatch.setattr(app, "default_feed", None)
+
+
+# ▼ 差分一覧の状態（カーソル・索引）を持つ取得元
+@pytest.fixture
+def source():
+    return app.DropboxSource()
+
+
+def test_first_sync_lists_every_page_then_applies_deltas(source):
+    dbx = FakeDropbox([
+        [file_entry("kabuteku20250106_0900.csv", "a1")],
+        [file_entry("kabuteku20250106_0901.csv", "b1")],
+    ])
+    assert app.sync_folder_listing(dbx, source) == {
+        "kabuteku20250106_0900.csv": meta("a1"),
+        "kabuteku20250106_0901.csv": meta("b1"),
+    }
+
+    dbx.deltas["fullend"] = [
+        file_entry("kabuteku20250106_0901.csv", "b2"),
+        file_entry("kabuteku20250106_0902.csv", "c1"),
+        dropbox.files.DeletedMetadata(name="kabuteku20250106_0900.csv"),
+    ]
+    index = app.sync_folder_listing(dbx, source)
+
+    assert index == {"kabuteku20250106_0901.csv": meta("b2"), "kabuteku20250106_0902.csv": meta("c1")}
+    assert [call for call in dbx.calls if call[0] == "list"] == [("list", app.DROPBOX_FOLDER)]
+
+
+def test_reset_cursor_relists_from_scratch(source):
+    dbx = FakeDropbox([[file_entry("kabuteku20250106_0900.csv", "a1")]])
+    app.sync_folder_listing(dbx, source)
+    source.file_index["kabuteku20250106_0859.csv"] = ("stale", "stale")
+    dbx.reset_cursors.add("fullend")
+    dbx.full_pages = [[file_entry("kabuteku20250106_0900.csv", "a2")]]
+
+    index = app.sync_folder_listing(dbx, source)
+
+    assert index == {"kabuteku20250106_0900.csv": meta("a2")}
+    assert source.cursor == "fullend"
+    assert [call[0] for call in dbx.calls] == ["list", "continue", "list"]
+
+
+def test_today_files_are_filtered_by_prefix_and_windowed(monkeypatch):
+    entries = [file_entry(f"kabuteku20250106_09{m:02d}.csv", f"e{m}") for m in range(10)]
+    entries += [file_entry("kabuteku20250103_0905.csv", "d0"), file_entry("memo.txt", "f0")]
+    monkeypatch.setattr(app, "get_dropbox_client", lambda: FakeDropbox([entries]))
+
+    files = app.list_today_csv_files(target_date="20250106", limit=3, current_hhmm="0905")
+
+    assert [hhmm for hhmm, _, _ in files] == ["0903", "0904", "0905"]
+    assert files[-1] == ("0905", "kabuteku20250106_0905.csv", meta("e5"))
@@ -0,0 +1,121 @@
+import json
+import threading
+
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    fresh = app.PipelineMetrics(buckets=[0.1, 1])
+    monkeypatch.setattr(app, "metrics", fresh)
+    return fresh
+
+
+def test_histograms_and_counters_in_prometheus_text(metrics):
+    for seconds in (0.05, 0.5, 2.0):
+        metrics.observe("listing", seconds)
+    metrics.count("files_loaded", 3)
+    metrics.count("bytes_downloaded", 10, source='a"b')
+
+    text = metrics.to_prometheus()
+
+    assert 'kabuteku_stage_seconds_bucket{stage="listing",le="0.1"} 1' in text
+    assert 'kabuteku_stage_seconds_bucket{stage="listing",le="1"} 2' in text
+    assert 'kabuteku_stage_seconds_bucket{stage="listing",le="+Inf"} 3' in text
+    assert 'kabuteku_stage_seconds_count{stage="listing"} 3' in text
+    assert "kabuteku_files_loaded_total 3" in text
+    assert 'kabuteku_bytes_downloaded_total{source="a\\"b"} 10' in text
+
+
+def test_counters_are_safe_across_threads(metrics):
+    def work():
+        for _ in range(1000):
+            metrics.count("files_loaded")
+            with metrics.time("download"):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    summary = metrics.summary()
+    assert summary["counters"]["files_loaded"] == 8000
+    assert summary["stages"]["download"]["count"] == 8000
+
+
+def test_evaluate_signals_counts_hits_per_detector(metrics):
+    store = app.BarStore()
+    for fname, content in sorted(make_minute_csvs(n_symbols=60, n_minutes=100, seed=3).items()):
+        store.append(fname[-8:-4], "r", app.read_minute_csv(content))
+
+    output_data = app.evaluate_signals(store.to_frame())
+    summary = metrics.summary()
+
+    assert summary["counters"]["symbols_evaluated"] == 60
+    assert sum(v for k, v in summary["counters"].items() if k.startswith("detector_hits|")) == len(output_data) > 0
+    assert sum(v for k, v in summary["counters"].items() if k.startswith("signals|")) == len(output_data)
+    assert all(0 <= rate <= 1 for rate in summary["hit_rates"].values())
+    assert {"align", "detect"} <= set(summary["stages"])
+
+
+def test_hit_rates_while_other_threads_count(metrics):
+    stop = threading.Event()
+
+    def work():
+        i = 0
+        while not stop.is_set():
+            metrics.count("detector_symbols_evaluated", 2, detector=f"d{i % 500}")
+            metrics.count("detector_hits", 1, detector=f"d{i % 500}")
+            i += 1
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(200):
+            assert all(0 <= rate <= 0.5 for rate in metrics.hit_rates().values())
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def test_prometheus_file_is_opt_in(metrics, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics.observe("cycle", 0.2)
+
+    metrics.export()
+
+    assert app.METRICS_PROMETHEUS_PATH == "" and not list(tmp_path.iterdir())
+
+
+def test_export_writes_prometheus_file_and_json_line(metrics, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(app, "METRICS_PROMETHEUS_PATH", str(tmp_path / "metrics.prom"))
+    monkeypatch.setattr(app, "METRICS_JSON_INTERVAL", 1)
+    metrics.observe("cycle", 0.2)
+    metrics.last_summary -= 2
+
+    metrics.export()
+
+    assert (tmp_path / "metrics.prom").read_text(encoding="utf-8") == metrics.to_prometheus()
+    assert json.loads(capsys.readouterr().out)["stages"]["cycle"]["count"] == 1
+
+
+def test_trigger_file_profiles_one_cycle(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "PROFILE_TRIGGER_FILE", str(tmp_path / "trigger"))
+    monkeypatch.setattr(app, "PROFILE_OUTPUT_DIR", str(tmp_path / "profiles"))
+    assert app.start_cycle_profile() is None
+
+    (tmp_path / "trigger").touch()
+    profiler = app.start_cycle_profile()
+    sum(range(1000))
+    app.finish_cycle_profile(profiler)
+
+    assert not (tmp_path / "trigger").exists()
+    assert len(list((tmp_path / "profiles").glob("cycle_*.prof"))) == 1
+    assert app.start_cycle_profile() is None
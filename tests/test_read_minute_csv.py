@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture(autouse=True)
+def fresh_categories(monkeypatch):
+    monkeypatch.setattr(app, "csv_header_layouts", {})
+    monkeypatch.setattr(app, "csv_symbol_categories", {"銘柄コード": None, "銘柄名称": None})
+
+
+HEADER = "銘柄コード, 銘柄名称,始値,現在値,高値,安値,前日比,出来高,売買代金\n"
+
+
+def csv_bytes(*rows, header=HEADER):
+    return (header + "".join(",".join(map(str, row)) + "\n" for row in rows)).encode("utf-8")
+
+
+@pytest.mark.parametrize("engine", ["c", "pyarrow"])
+def test_reads_only_detector_columns_with_dtypes(monkeypatch, engine):
+    monkeypatch.setattr(app, "CSV_ENGINE", engine)
+    df = app.read_minute_csv(csv_bytes([1301, "極洋", 4000, 4010.5, 4020.1, 3990.3, 10, 12345, 999]))
+
+    assert list(df.columns) == ["銘柄コード", "銘柄名称", "現在値", "高値", "安値", "出来高"]
+    assert df["現在値"].dtype == np.float32 and df["出来高"].dtype == np.int64
+    assert isinstance(df["銘柄コード"].dtype, pd.CategoricalDtype)
+    assert list(app.bar_field_values(df)[0]) == [4010.5, 4020.1, 3990.3, 12345.0]
+
+
+def test_symbol_categories_are_shared_across_files():
+    first = app.read_minute_csv(csv_bytes([1301, "極洋", 1, 10.0, 10.0, 10.0, 0, 5, 0], [1332, "日水", 1, 20.0, 20.0, 20.0, 0, 6, 0]))
+    second = app.read_minute_csv(csv_bytes([1332, "日水", 1, 21.0, 21.0, 21.0, 0, 7, 0], [1333, "マルハ", 1, 30.0, 30.0, 30.0, 0, 8, 0]))
+
+    assert list(second["銘柄コード"].cat.categories) == ["1301", "1332", "1333"]
+    assert first["銘柄コード"].cat.categories.equals(second["銘柄コード"].cat.categories[:2])
+    assert list(second["銘柄コード"].astype(str)) == ["1332", "1333"]
+
+
+def test_blank_and_text_numbers_are_coerced():
+    df = app.read_minute_csv(csv_bytes([1301, "極洋", 1, "", 10.0, 9.0, 0, 5, 0], [1332, "日水", 1, "-", 20.0, 19.0, 0, 6, 0]))
+
+    assert df["現在値"].isna().all()
+    assert df["高値"].dtype == np.float32
+    assert list(df["出来高"]) == [5, 6]
+
+
+def test_reads_from_a_path_like_from_bytes(tmp_path):
+    content = csv_bytes([1301, "極洋", 1, 10.0, 10.0, 10.0, 0, 5, 0])
+    path = tmp_path / "kabuteku20250106_0900.csv"
+    path.write_bytes(content)
+
+    pd.testing.assert_frame_equal(app.read_minute_csv(str(path), memory_map=True), app.read_minute_csv(content))
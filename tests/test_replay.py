@@ -0,0 +1,73 @@
+import csv
+import json
+
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+DATES = ["20250106", "20250107"]
+
+
+@pytest.fixture
+def csv_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "default_feed", None)
+    directory = tmp_path / "csv"
+    directory.mkdir()
+    for seed, date in enumerate(DATES):
+        for fname, content in make_minute_csvs(n_symbols=40, n_minutes=70, date=date, seed=seed).items():
+            (directory / fname).write_bytes(content)
+    return directory
+
+
+def read_log(path):
+    with open(path, encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_replay_directory_logs_every_signal(csv_dir, tmp_path):
+    log_path = tmp_path / "signals.csv"
+    results = app.replay_directory(str(csv_dir), log_path=str(log_path))
+    header, *rows = read_log(log_path)
+
+    assert [r["date"] for r in results] == DATES
+    # ✅ 09:02 から最後のファイル（10:09）まで毎分新しい分足が届き、その後は判定しない
+    assert all(r["evaluated"] == 68 for r in results)
+    assert len(rows) == sum(r["signals"] for r in results) > 0
+    assert header == ["日付", "時刻", "銘柄コード", "銘柄名称", "シグナル", "項目"]
+    assert all("0902" <= row[1] <= "1009" and json.loads(row[5]) is not None for row in rows)
+    assert rows == sorted(rows, key=lambda row: (row[0], row[1]))
+
+
+def test_replay_is_repeatable_and_filters_dates(csv_dir, tmp_path):
+    app.replay_directory(str(csv_dir), log_path=str(tmp_path / "all.csv"))
+    results = app.replay_directory(str(csv_dir), dates=[DATES[1], "20250108"], log_path=str(tmp_path / "one.csv"))
+
+    assert [r["date"] for r in results] == [DATES[1]]
+    assert read_log(tmp_path / "one.csv")[1:] == [row for row in read_log(tmp_path / "all.csv")[1:] if row[0] == DATES[1]]
+
+
+# ▼ リプレイ途中の判定は、その時刻までのファイルだけで組み立てたストアの判定と同じ（先読みしない）
+def test_replay_minute_matches_fresh_evaluation(csv_dir, tmp_path):
+    log_path = tmp_path / "signals.csv"
+    app.replay_directory(str(csv_dir), dates=[DATES[0]], log_path=str(log_path))
+    rows = read_log(log_path)[1:]
+    minute = rows[len(rows) // 2][1]
+
+    feed = app.Feed(source="local", directory=str(csv_dir))
+    source = feed.get_source()
+    files = app.group_files_by_date(source.list_files())[DATES[0]]
+    window = app.select_recent_files(files, minute, app.BAR_WINDOW)
+    store = app.update_bar_store(
+        DATES[0], window, lambda new_files: app.load_minute_frames(source, new_files, verbose=False, feed=feed), feed=feed
+    )
+    expected = [(row["銘柄コード"], row["シグナル"]) for row in app.evaluate_signals(store)]
+
+    assert [(row[2], row[4]) for row in rows if row[1] == minute] == expected
+
+
+def test_replay_subcommand_arguments():
+    args = app.parse_command_line(["replay", "csv", DATES[0], "--log", "out.csv", "--latency", "0.01"])
+
+    assert (args.command, args.directory, args.dates, args.log, args.latency) == ("replay", "csv", [DATES[0]], "out.csv", 0.01)
+    assert app.parse_command_line([]).command is None
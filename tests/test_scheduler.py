@@ -0,0 +1,98 @@
+from datetime import date, datetime, time
+
+import pytest
+
+import app
+
+
+def test_trading_calendar_sessions_and_holidays():
+    monday = app.TradingCalendar(date(2025, 1, 6))
+
+    assert monday.is_open(time(9, 2)) and monday.is_open(time(11, 30)) and monday.is_open(time(15, 0))
+    assert not monday.is_open(time(9, 1)) and not monday.is_open(time(12, 0)) and not monday.is_open(time(15, 1))
+    assert monday.seconds_until_open(time(8, 0)) == 62 * 60
+    assert monday.seconds_until_open(time(12, 0)) == 30 * 60
+    assert monday.seconds_until_open(time(15, 30)) is None
+
+    for closed in (date(2025, 1, 13), date(2025, 1, 11)):  # 成人の日 / 土曜
+        calendar = app.TradingCalendar(closed)
+        assert not calendar.is_open(time(10, 0))
+        assert calendar.seconds_until_open(time(8, 0)) is None
+
+
+def test_trading_calendar_is_built_once_per_date():
+    day = date(2025, 1, 6)
+    calendar = app.get_trading_calendar(day)
+
+    assert app.get_trading_calendar(day) is calendar
+    app.get_trading_calendar(date(2025, 1, 7))
+    assert app.get_trading_calendar(day) is not calendar
+
+
+def test_fingerprint_changes_with_any_rev():
+    files = [("0900", "kabuteku20250106_0900.csv", "a"), ("0901", "kabuteku20250106_0901.csv", "b")]
+
+    assert app.file_set_fingerprint(files) == app.file_set_fingerprint(list(files))
+    assert app.file_set_fingerprint(files) != app.file_set_fingerprint(files[:1] + [("0901", files[1][1], "c")])
+
+
+def test_scheduler_skips_unchanged_sets_and_learns_arrival(monkeypatch):
+    scheduler = app.CycleScheduler()
+    scheduler.mark_processed("a", datetime(2025, 1, 6, 10, 0, 40))
+    assert scheduler.is_unchanged("a") and not scheduler.is_unchanged("b")
+    assert scheduler.next_delay(datetime(2025, 1, 6, 10, 0, 41)) == app.SCHEDULER_POLL_INTERVAL
+
+    for i, (fingerprint, second) in enumerate([("b", 3), ("c", 5), ("d", 4)], start=1):
+        scheduler.mark_processed(fingerprint, datetime(2025, 1, 6, 10, i, second))
+
+    assert scheduler.expected_offset() == 4
+    # 10:03:04 に届いたので、次は 10:04:04 の SCHEDULER_EARLY_WAKE 秒前に起きる
+    assert scheduler.next_delay(datetime(2025, 1, 6, 10, 3, 10)) == pytest.approx(54 - app.SCHEDULER_EARLY_WAKE)
+    assert scheduler.next_delay(datetime(2025, 1, 6, 10, 4, 3)) == app.SCHEDULER_POLL_INTERVAL
+
+    monkeypatch.setattr(app, "SCHEDULER_SKIP_UNCHANGED", False)
+    assert not scheduler.is_unchanged("d")
+
+
+def test_expected_offset_wraps_around_the_minute():
+    scheduler = app.CycleScheduler()
+    scheduler.arrival_offsets.extend([59.5, 0.5, 1.0, 58.0, 0.2])
+
+    assert scheduler.expected_offset() == pytest.approx(0.2)
+
+
+def test_wait_uses_push_when_available(monkeypatch):
+    class Source:
+        def __init__(self, push):
+            self.push = push
+            self.waited = 0
+
+        def supports_push(self):
+            return self.push
+
+        def wait_for_change(self):
+            self.waited += 1
+
+    sleeps = []
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+    scheduler = app.CycleScheduler()
+
+    push = Source(True)
+    scheduler.wait(push)
+    scheduler.wait(Source(False))
+
+    assert push.waited == 1
+    assert sleeps == [app.SCHEDULER_POLL_INTERVAL]
+
+
+def test_bar_store_covers_only_a_fully_loaded_window(minute_csvs):
+    store = app.BarStore()
+    files = []
+    for fname, content in sorted(minute_csvs(n_symbols=3, n_minutes=4).items()):
+        hhmm = fname[-8:-4]
+        files.append((hhmm, fname, "r"))
+        store.append(hhmm, "r", app.read_minute_csv(content))
+
+    assert store.covers(files)
+    assert not store.covers(files + [("0904", "kabuteku20250106_0904.csv", "r")])
+    assert not store.covers([])
@@ -0,0 +1,70 @@
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+
+@pytest.fixture(scope="module")
+def window():
+    store = app.BarStore()
+    for fname, content in sorted(make_minute_csvs(n_symbols=150, n_minutes=100, seed=3).items()):
+        store.append(fname[-8:-4], "r", app.read_minute_csv(content))
+    return app.frame_to_aligned_window(store.to_frame())
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(app, "SIGNAL_SHARD_MIN_SYMBOLS", 20)
+    yield
+    if app.signal_executor is not None:
+        app.signal_executor.shutdown()
+        app.signal_executor = None
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_sharded_signals_match_single_process(window, executor, workers):
+    expected = app.detect_signals_vectorized(*window)
+
+    assert expected
+    assert app.detect_signals_sharded(*window, workers=workers) == expected
+
+
+# ▼ 閾値の上書きはワーカープロセスへ引数で渡る（ワーカー側のモジュール定数には頼らない）
+def test_sharded_signals_use_the_given_parameters(window, executor):
+    params = {"DOUBLE_PATTERN_TOLERANCE": 0.03, "DOUBLE_PATTERN_VOLUME_SPIKE_RATIO": 0.8}
+    expected = app.detect_signals_vectorized(*window, params=params)
+
+    assert expected != app.detect_signals_vectorized(*window)
+    assert app.detect_signals_sharded(*window, workers=2, params=params) == expected
+
+
+def test_small_universes_stay_on_one_process(window, monkeypatch):
+    monkeypatch.setattr(app, "SIGNAL_SHARD_MIN_SYMBOLS", 200)
+
+    assert app.detect_signals_sharded(*window, workers=4) == app.detect_signals_vectorized(*window)
+    assert app.signal_executor is None
+
+
+def test_speedup_report_checks_results_agree(window, executor, capsys):
+    report = app.report_signal_speedup(*window, workers=2, repeat=1)
+
+    assert report["symbols"] == len(window[0]) and report["workers"] == 2
+    assert "結果一致" in capsys.readouterr().out
+
+
+def test_speedup_report_uses_the_given_parameters(window, executor, monkeypatch):
+    params = {"DOUBLE_PATTERN_TOLERANCE": 0.03}
+    seen = []
+    detect = app.detect_signals_vectorized
+    monkeypatch.setattr(app, "detect_signals_vectorized", lambda *args, params=None, **kwargs: seen.append(params) or detect(*args, params=params, **kwargs))
+
+    app.report_signal_speedup(*window, workers=2, repeat=1, params=params)
+
+    assert seen and all(p["DOUBLE_PATTERN_TOLERANCE"] == 0.03 for p in seen)
+
+
+def test_executor_is_rebuilt_only_when_the_worker_count_changes(executor):
+    first = app.get_signal_executor(2)
+
+    assert app.get_signal_executor(2) is first
+    assert app.get_signal_executor(3) is not first and app.signal_executor_workers == 3
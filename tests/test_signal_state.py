@@ -0,0 +1,97 @@
+import pytest
+
+import app
+
+DATE = "20250106"
+BUY = "【買い目】ゴールデンクロス"
+SELL = "【売り目】デッドクロス"
+
+
+def row(code, signal, price=1000.0):
+    return {"銘柄コード": code, "銘柄名称": f"銘柄{code}", "シグナル": signal, "現在値": price}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "SIGNAL_STORE_PATH", str(tmp_path / "state.sqlite3"))
+    monkeypatch.setattr(app, "default_feed", None)
+    return app.get_signal_store()
+
+
+def keys(rows):
+    return [(r["銘柄コード"], r["シグナル"]) for r in rows]
+
+
+def test_record_tracks_new_kept_and_cleared(store):
+    new, cleared = store.record(DATE, "1000", [row("1301", BUY), row("1302", SELL)])
+    assert keys(new) == [("1301", BUY), ("1302", SELL)] and cleared == []
+
+    new, cleared = store.record(DATE, "1001", [row("1301", BUY, 1010.0)])
+    assert new == []
+    assert keys(cleared) == [("1302", SELL)] and cleared[0]["発生"] == "1000" and cleared[0]["解除"] == "1001"
+
+    history = store.history(DATE)
+    assert history[["銘柄コード", "発生", "最終確認", "解除", "回数"]].fillna("").values.tolist() == [
+        ["1301", "1000", "1001", "", 2],
+        ["1302", "1000", "1000", "1001", 1],
+    ]
+    assert store.history(DATE, active_only=True)["銘柄コード"].tolist() == ["1301"]
+
+
+def test_signal_that_clears_and_fires_again_is_a_new_episode(store):
+    store.record(DATE, "1000", [row("1301", BUY)])
+    store.record(DATE, "1001", [])
+    new, _ = store.record(DATE, "1001", [row("1301", BUY)])  # 同じ分のうちに再び発生
+
+    assert keys(new) == [("1301", BUY)]
+    history = store.history(DATE)
+    assert history[["発生", "解除"]].fillna("").values.tolist() == [["1000", "1001"], ["1001", ""]]
+
+
+def test_notify_mode_defaults_to_all(store):
+    output_data = [row("1301", BUY)]
+
+    assert app.NOTIFY_MODE == "all"
+    assert app.select_notifications(output_data, DATE, "1000") == (output_data, [])
+    assert app.select_notifications(output_data, DATE, "1001") == (output_data, [])
+
+
+def test_new_and_changed_modes(store, monkeypatch):
+    monkeypatch.setattr(app, "NOTIFY_MODE", "new")
+    assert keys(app.select_notifications([row("1301", BUY)], DATE, "1000")[0]) == [("1301", BUY)]
+    assert app.select_notifications([row("1301", BUY), row("1302", SELL)], DATE, "1001") == ([row("1302", SELL)], [])
+
+    monkeypatch.setattr(app, "NOTIFY_MODE", "changed")
+    selected, cleared = app.select_notifications([row("1302", SELL), row("1303", BUY)], DATE, "1002")
+    assert keys(selected) == [("1303", BUY)]
+    assert keys(cleared) == [("1301", BUY)]
+
+
+def test_digest_sends_each_slot_once_without_clears(store, monkeypatch):
+    monkeypatch.setattr(app, "NOTIFY_MODE", "digest")
+    monkeypatch.setattr(app, "NOTIFY_DIGEST_MINUTES", 30)
+
+    assert app.select_notifications([row("1301", BUY)], DATE, "0902") == ([], [])  # 当日の起点
+    assert app.select_notifications([row("1302", SELL)], DATE, "0915") == ([], [])
+    selected, cleared = app.select_notifications([], DATE, "0930")
+
+    # ✅ 起点の分に出たシグナルも含み、解除（1301・1302 とも 0930 で解除）は載せない
+    assert keys(selected) == [("1301", BUY), ("1302", SELL)]
+    assert cleared == []
+
+    app.select_notifications([row("1303", BUY)], DATE, "0945")
+    selected, _ = app.select_notifications([], DATE, "1000")
+    assert keys(selected) == [("1303", BUY)]
+
+
+def test_unknown_notify_mode_is_rejected(store, monkeypatch):
+    monkeypatch.setattr(app, "NOTIFY_MODE", "sometimes")
+
+    with pytest.raises(ValueError):
+        app.select_notifications([], DATE, "1000")
+
+
+def test_history_subcommand_arguments():
+    args = app.parse_command_line(["history", DATE, "--active", "--db", "x.sqlite3"])
+
+    assert (args.command, args.date, args.active, args.db) == ("history", DATE, True, "x.sqlite3")
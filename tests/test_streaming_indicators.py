@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def fill(store, files, drop_every=0):
+    for i, (fname, content) in enumerate(sorted(files.items())):
+        df = app.read_minute_csv(content)
+        if drop_every and i % drop_every == 3:
+            df = df.iloc[2:]
+        store.append(fname[-8:-4], "r", df)
+    return store
+
+
+@pytest.mark.parametrize("drop_every", [0, 7])
+def test_streamed_indicators_match_batch(minute_csvs, drop_every):
+    store = fill(app.BarStore(streaming=app.StreamingIndicators(), initial_symbols=4), minute_csvs(n_symbols=12, n_minutes=70), drop_every)
+
+    codes, _, values, present = store.aligned_window()
+    expected = app.compute_indicator_matrix(values, present)
+    streamed_codes, streamed = store.aligned_indicators()
+
+    assert list(streamed_codes) == list(codes)
+    for key in app.INDICATOR_KEYS:
+        np.testing.assert_allclose(streamed[key], expected[key], rtol=app.STREAMING_VALIDATE_TOLERANCE, equal_nan=True, err_msg=key)
+
+
+def test_streamed_tail_matches_batch_after_the_ring_wraps(minute_csvs):
+    store = fill(app.BarStore(capacity=80, streaming=app.StreamingIndicators()), minute_csvs(n_symbols=6, n_minutes=200))
+
+    _, _, values, present = store.aligned_window()
+    expected = app.compute_indicator_matrix(values, present)
+    _, streamed = store.aligned_indicators()
+
+    # ✅ MACD は EMA を当日全体から持ち越すため、窓だけから計算し直した値とは一致しない
+    for key in app.INDICATOR_KEYS:
+        if key != "MACDヒストグラム":
+            tail = slice(-app.STREAMING_VALIDATE_BARS, None)
+            np.testing.assert_allclose(streamed[key][:, tail], expected[key][:, tail], rtol=app.STREAMING_VALIDATE_TOLERANCE, err_msg=key)
+
+
+def test_reset_clears_streaming_state(minute_csvs):
+    files = minute_csvs(n_symbols=4, n_minutes=30)
+    store = fill(app.BarStore(streaming=app.StreamingIndicators()), files)
+    store.reset("20250107")
+    fill(store, files)
+
+    fresh = fill(app.BarStore(streaming=app.StreamingIndicators()), files)
+    for key in app.INDICATOR_KEYS:
+        np.testing.assert_array_equal(store.aligned_indicators()[1][key], fresh.aligned_indicators()[1][key], err_msg=key)
@@ -0,0 +1,121 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+DATE = "20250106"
+
+
+@pytest.fixture
+def csv_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "default_feed", None)
+    directory = tmp_path / "csv"
+    directory.mkdir()
+    for fname, content in make_minute_csvs(n_symbols=40, n_minutes=120, date=DATE, seed=3).items():
+        (directory / fname).write_bytes(content)
+    return directory
+
+
+def test_parameter_options_and_sets():
+    assert app.parse_parameter_option("CROSS_RSI_THRESHOLD_BUY=35,40") == ("CROSS_RSI_THRESHOLD_BUY", [35, 40])
+    assert app.parse_parameter_option("DOUBLE_PATTERN_TOLERANCE=0.005:0.02") == ("DOUBLE_PATTERN_TOLERANCE", (0.005, 0.02))
+    assert app.parse_parameter_option("RSI_PERIOD=14,26") == ("RSI_PERIOD", [14, 26])
+    with pytest.raises(ValueError):
+        app.parse_parameter_option("SIGNAL_STORE_PATH='x'")
+    for name in ["BAR_WINDOW", "TREND_TAIL", "CROSS_TAIL"]:
+        with pytest.raises(ValueError, match="変えられません"):
+            app.parse_parameter_option(f"{name}=60")
+
+    space = {"RSI_UP_THRESHOLD": [50, 60], "USE_RSI_FOR_CROSS": [True, False]}
+    assert len(app.parameter_sets(space)) == 4
+    with pytest.raises(ValueError):
+        app.parameter_sets({"DOUBLE_PATTERN_TOLERANCE": (0.005, 0.02)})
+
+    sampled = app.parameter_sets({"DOUBLE_PATTERN_TOLERANCE": (0.005, 0.02), "DOUBLE_PATTERN_MIN_PEAKS": (2, 4)}, samples=20, seed=1)
+    assert sampled == app.parameter_sets({"DOUBLE_PATTERN_TOLERANCE": (0.005, 0.02), "DOUBLE_PATTERN_MIN_PEAKS": (2, 4)}, samples=20, seed=1)
+    assert all(0.005 <= p["DOUBLE_PATTERN_TOLERANCE"] <= 0.02 and p["DOUBLE_PATTERN_MIN_PEAKS"] in (2, 3, 4) for p in sampled)
+
+
+def test_detector_parameters_override_without_touching_the_module(monkeypatch):
+    monkeypatch.setattr(app, "RSI_DOWN_THRESHOLD", 42)
+    params = app.detector_parameters({"RSI_UP_THRESHOLD": app.RSI_UP_THRESHOLD + 10})
+
+    assert set(params) == set(app.SWEEP_PARAMETERS)
+    assert params["RSI_UP_THRESHOLD"] == app.RSI_UP_THRESHOLD + 10
+    assert params["RSI_DOWN_THRESHOLD"] == 42
+
+
+@pytest.fixture(scope="module")
+def window():
+    store = app.BarStore()
+    for fname, content in sorted(make_minute_csvs(n_symbols=60, n_minutes=100, date=DATE, seed=5).items()):
+        store.append(fname[-8:-4], "r", app.read_minute_csv(content))
+    return store.to_frame(), app.frame_to_aligned_window(store.to_frame())
+
+
+# ▼ 閾値だけが違う組み合わせではインジケーターを使い回し、期間を変えたらそのインジケーターだけ計算し直す
+def test_indicator_cache_follows_indicator_parameters(window, monkeypatch):
+    _, (_, _, values, present) = window
+    computed = []
+    compute = app.compute_indicator_matrix
+
+    def counting(values, present, keys=None, params=None):
+        computed.extend(keys or app.INDICATOR_KEYS)
+        return compute(values, present, keys=keys, params=params)
+
+    monkeypatch.setattr(app, "compute_indicator_matrix", counting)
+    cache = {}
+    default = app.compute_detector_indicators_cached(values, present, cache, {})
+    first = len(computed)
+    relaxed = app.compute_detector_indicators_cached(values, present, cache, {"VOLATILITY_THRESHOLD": 0.0, "RSI_UP_THRESHOLD": 40})
+    assert len(computed) == first
+    assert all(relaxed[key] is default[key] for key in default)
+
+    period = app.compute_detector_indicators_cached(values, present, cache, {"RSI_PERIOD": 14})
+    assert set(computed[first:]) == {"RSI"}
+    assert all(period[key] is default[key] for key in default if key[0] != "RSI")
+    assert not np.allclose(period[("RSI", None)], default[("RSI", None)], equal_nan=True)
+    for key, matrix in app.compute_detector_indicators(values, present, {"RSI_PERIOD": 14}).items():
+        np.testing.assert_array_equal(period[key], matrix, err_msg=str(key))
+
+
+# ▼ params で渡した期間・本数は、モジュールの設定値を変えたときと同じ結果になる
+@pytest.mark.parametrize("mode", ["vectorized", "per_symbol"])
+def test_period_parameters_match_module_settings(window, monkeypatch, mode):
+    df, _ = window
+    monkeypatch.setattr(app, "DETECTOR_MODE", mode)
+    params = {"RSI_PERIOD": 14, "MA_MID_WINDOW": 20, "VOLUME_PAST_WINDOW": 40, "DOUBLE_PATTERN_LOOKBACK": 30}
+    overridden = app.evaluate_signals(df, params=params)
+    assert overridden != app.evaluate_signals(df)
+
+    for name, value in params.items():
+        monkeypatch.setattr(app, name, value)
+    assert overridden == app.evaluate_signals(df)
+
+
+def test_sweep_with_default_parameters_matches_replay(csv_dir, tmp_path):
+    replay = app.replay_directory(str(csv_dir), log_path=str(tmp_path / "replay.csv"))
+    sets = [{}, {"VOLATILITY_THRESHOLD": 0.0, "CROSS_VOLATILITY_THRESHOLD": 0.0, "CROSS_USE_VOLATILITY_FILTER": True}]
+
+    table = app.run_parameter_sweep(str(csv_dir), sets, horizons=[5], workers=2, output_path=str(tmp_path / "sweep.csv"))
+
+    overall = table[table["シグナル"] == "全体"].set_index("組み合わせ")
+    assert overall.loc[0, "件数"] == replay[0]["signals"] > 0
+    assert overall["件数"].get(1, 0) < overall.loc[0, "件数"]
+    assert {"平均リターン_5分", "勝率_5分", "件数_5分"} <= set(table.columns)
+    assert (tmp_path / "sweep.csv").exists()
+
+
+def child_has_no_download_pool():
+    return app.download_executor is None
+
+
+# ▼ fork したワーカーは親のダウンロード用スレッドプールを使わない（スレッドは引き継がれず、投げた取得が進まない）
+def test_forked_workers_start_their_own_download_pool():
+    app.get_download_executor().submit(int).result()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as pool:
+        assert pool.submit(child_has_no_download_pool).result()
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+
+# ▼ リフレッシュトークンの POST に連番のアクセストークンを返す（state["status"] で障害を起こせる）
+@pytest.fixture
+def token_endpoint(monkeypatch):
+    state = {"status": 200, "expires_in": 3600, "issued": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if state["status"] != 200:
+                self.send_response(state["status"])
+                self.end_headers()
+                return
+            state["issued"] += 1
+            body = json.dumps({"access_token": f"token-{state['issued']}", "expires_in": state["expires_in"]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(app, "TOKEN_URL", f"http://127.0.0.1:{server.server_port}/oauth2/token")
+    monkeypatch.setattr(app, "TOKEN_PROBE", False)
+    monkeypatch.setattr(app, "TOKEN_RETRY_BASE", 0.05)
+    monkeypatch.setattr(app, "TOKEN_RETRY_MAX", 0.1)
+    monkeypatch.setattr(app, "TOKEN_REFRESH_MARGIN", timedelta(0))
+    monkeypatch.setattr(app, "REFRESH_INTERVAL", timedelta(seconds=0.2))
+    monkeypatch.setattr(app, "dropbox_connection", None)
+    # ✅ 環境変数を最後に設定し、後片付けで最初に戻す（残ったスレッドが本物のエンドポイントに行かないように）
+    for name in ["DROPBOX_CLIENT_ID", "DROPBOX_CLIENT_SECRET", "DROPBOX_REFRESH_TOKEN"]:
+        monkeypatch.setenv(name, "test")
+    yield state
+    server.shutdown()
+
+
+def current_token():
+    return app.get_dropbox_client()._oauth2_access_token
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_token_is_refreshed_in_the_background(token_endpoint):
+    assert current_token() == "token-1"
+    wait_until(lambda: token_endpoint["issued"] >= 3)
+    assert current_token() != "token-1"
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        app.get_dropbox_client()
+    assert (time.perf_counter() - start) / 1000 < 1e-3
+
+
+def test_old_token_is_kept_during_an_outage_and_replaced_on_recovery(token_endpoint):
+    current_token()
+    token_endpoint["status"] = 500
+    wait_until(lambda: app.dropbox_connection.failures >= 3)
+    issued = token_endpoint["issued"]
+    assert current_token() == f"token-{issued}"
+
+    token_endpoint["status"] = 200
+    wait_until(lambda: app.dropbox_connection.failures == 0)
+    assert current_token() == f"token-{issued + 1}"
+
+
+def test_expired_token_raises_instead_of_exiting(token_endpoint):
+    token_endpoint["expires_in"] = 1
+    current_token()
+    token_endpoint["status"] = 500
+    wait_until(lambda: not app.dropbox_connection.usable())
+
+    with pytest.raises(RuntimeError):
+        app.dropbox_connection.get(timeout=0.1)
+
+    token_endpoint["status"] = 200
+    assert current_token().startswith("token-")
@@ -0,0 +1,85 @@
+from datetime import date
+
+import pytest
+
+import app
+from conftest import make_minute_csvs
+
+PREVIOUS, TODAY = "20250106", "20250107"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(app, "archive_revs", {})
+    monkeypatch.setattr(app, "WARM_START_BARS", 30)
+
+
+@pytest.fixture
+def feed():
+    feed = app.Feed(source="memory")
+    feed.bar_store = app.BarStore(capacity=30)
+    return feed
+
+
+@pytest.fixture
+def source():
+    files = make_minute_csvs(n_symbols=10, n_minutes=40, date=PREVIOUS, seed=0)
+    files.update(make_minute_csvs(n_symbols=10, n_minutes=40, date=TODAY, seed=1))
+    return app.MemorySource(files)
+
+
+def today_files(source, n):
+    return sorted(app.group_files_by_date(source.list_files())[TODAY])[:n]
+
+
+def update(feed, source, files):
+    return app.update_bar_store(
+        TODAY, files, lambda new_files: app.load_minute_frames(source, new_files, verbose=False, feed=feed), warm_source=source, feed=feed
+    )
+
+
+def test_warm_start_is_opt_in(source, feed):
+    assert app.WARM_START is False
+    update(feed, source, today_files(source, 3))
+
+    assert feed.bar_store.warm == 0 and feed.bar_store.count == 3
+
+
+def test_seeded_bars_do_not_affect_matches(source, feed, monkeypatch):
+    monkeypatch.setattr(app, "WARM_START", True)
+    files = today_files(source, 3)
+    update(feed, source, files)
+    store = feed.bar_store
+
+    assert (store.warm, store.count) == (27, 30)  # 窓に入りきる分だけ前日の最後の分足で埋める
+    assert store.slot_hhmm[store.slots()[0]] == "0913"
+    assert [hhmm for hhmm, _ in store.sequence()] == ["0900", "0901", "0902"]
+    assert store.last_hhmm() == "0902"
+    assert store.matches(files) and store.covers(files)
+    assert store.aligned_window(files[0][0])[2].shape[1] == 30
+
+    # ✅ 次の分足は前日の最も古い分足を押し出すだけで、窓を作り直さない
+    update(feed, source, today_files(source, 4))
+    assert feed.bar_store is store and (store.warm, store.count) == (26, 30)
+
+    # ✅ 当日分のファイルが差し替わったら作り直し、もう一度前日分で埋める
+    source.put(files[1][1], source.read(files[1][1]))
+    update(feed, source, today_files(source, 4))
+    assert (store.warm, store.count) == (26, 30)
+    assert [hhmm for hhmm, _ in store.sequence()] == ["0900", "0901", "0902", "0903"]
+
+
+def test_warm_bars_roll_out_as_the_day_fills_the_window(source, feed, monkeypatch):
+    monkeypatch.setattr(app, "WARM_START", True)
+    for n in range(1, 31):
+        update(feed, source, today_files(source, n))
+
+    assert feed.bar_store.warm == 0
+    assert [hhmm for hhmm, _ in feed.bar_store.sequence()] == [hhmm for hhmm, _, _ in today_files(source, 30)]
+
+
+def test_previous_business_day_skips_year_end_closures():
+    assert app.previous_business_day("20250107") == "20250106"
+    assert app.previous_business_day("20250106") == "20241230"  # 12/31・1/1〜1/3・土日を飛ばす
+    assert not app.is_business_day(date(2024, 12, 31))